@@ -3,49 +3,179 @@ Automatically generated file from migration script.
 """
 
 
+import hashlib
 import os
+import threading
+import time
+from typing import Optional
 
+from ..services.perceptual_hash import BKTree, ImageSignature, hamming
+from ..utils.config import ASPECT_TOLERANCE, DHASH_MAX_DISTANCE, FILE_HASH_CHUNK, PHASH_MAX_DISTANCE
+from ..utils.storage import open_database
 
 
 class FileAgent:
-    """Agente per la gestione dei file e duplicati."""
+    """
+    Agente per la gestione dei file e duplicati.
 
-    def __init__(self, watch_dir: str):
+    Gli hash dei contenuti già visti sono in un indice SQLite nella
+    cartella monitorata: ogni nuovo file è un solo INSERT, non la
+    riscrittura dell'intera cronologia. Il file è letto a blocchi e, se
+    percorso, dimensione e data di modifica sono già noti, non viene
+    riletto affatto. Può essere usato da più thread.
+
+    Per i quasi duplicati (lo stesso scontrino fotografato due volte) gli
+    hash percettivi sono tenuti anche in un albero BK in memoria, caricato
+    alla prima ricerca. Scontrini con la stessa impaginazione hanno phash
+    vicini: una corrispondenza vale solo se coincidono anche dhash e
+    proporzioni.
+    """
+
+    def __init__(self, watch_dir: str, chunk_size: int = FILE_HASH_CHUNK):
         self.watch_dir = watch_dir
-        self.file_history = set()
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._conn = open_database(os.path.join(watch_dir, ".file_history.sqlite3"))
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS hashes (
+                hash TEXT PRIMARY KEY,
+                path TEXT,
+                created_at REAL NOT NULL
+            )
+        """)
+        # Hash già calcolati, validi finché dimensione e data di modifica non cambiano
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                hash TEXT NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS perceptual (
+                phash TEXT NOT NULL,
+                path TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                dhash TEXT,
+                aspect REAL
+            )
+        """)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(perceptual)")}
+        if "dhash" not in columns:
+            # Indici creati col solo phash: quelle righe non bastano più a confermare un duplicato
+            self._conn.execute("ALTER TABLE perceptual ADD COLUMN dhash TEXT")
+            self._conn.execute("ALTER TABLE perceptual ADD COLUMN aspect REAL")
+        self._conn.commit()
+        self._perceptual_tree: Optional[BKTree] = None
         self.load_history()
 
     def load_history(self):
-        """Carica la cronologia dei file processati."""
+        """Importa la vecchia cronologia testuale (.file_history), se presente."""
         try:
             history_file = os.path.join(self.watch_dir, ".file_history")
-            if os.path.exists(history_file):
-                with open(history_file, "r") as f:
-                    self.file_history = set(f.read().splitlines())
+            if not os.path.exists(history_file):
+                return
+            with open(history_file, "r") as f:
+                hashes = [line for line in f.read().splitlines() if line]
+            now = time.time()
+            with self._lock:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO hashes (hash, path, created_at) VALUES (?, NULL, ?)",
+                    [(file_hash, now) for file_hash in hashes]
+                )
+                self._conn.commit()
+            os.replace(history_file, history_file + ".importato")
         except Exception as e:
             print(f"Errore nel caricamento della cronologia: {str(e)}")
 
-    def save_history(self):
-        """Salva la cronologia dei file processati."""
-        try:
-            history_file = os.path.join(self.watch_dir, ".file_history")
-            with open(history_file, "w") as f:
-                f.write("\n".join(self.file_history))
-        except Exception as e:
-            print(f"Errore nel salvataggio della cronologia: {str(e)}")
+    def file_hash(self, file_path: str) -> str:
+        """MD5 del contenuto, letto a blocchi di `chunk_size` byte."""
+        digest = hashlib.md5()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def known_hash(self, file_path: str, stat: os.stat_result) -> Optional[str]:
+        """Hash già calcolato per questo file, se non è cambiato da allora."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT hash FROM files WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (file_path, stat.st_size, stat.st_mtime_ns)
+            ).fetchone()
+        return row[0] if row else None
 
     def is_duplicate(self, file_path: str) -> bool:
         """Controlla se il file è un duplicato."""
-        import hashlib
         try:
-            with open(file_path, "rb") as f:
-                file_hash = hashlib.md5(f.read()).hexdigest()
-                if file_hash in self.file_history:
-                    return True
-                self.file_history.add(file_hash)
-                self.save_history()
-                return False
+            file_path = os.path.abspath(file_path)
+            stat = os.stat(file_path)
+            file_hash = self.known_hash(file_path, stat) or self.file_hash(file_path)
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO files (path, size, mtime_ns, hash) VALUES (?, ?, ?, ?)",
+                    (file_path, stat.st_size, stat.st_mtime_ns, file_hash)
+                )
+                added = self._conn.execute(
+                    "INSERT OR IGNORE INTO hashes (hash, path, created_at) VALUES (?, ?, ?)",
+                    (file_hash, file_path, time.time())
+                ).rowcount
+                self._conn.commit()
+            return added == 0
         except Exception as e:
             print(f"Errore nel controllo duplicati: {str(e)}")
             return False
 
+    def near_duplicate(self, perceptual: ImageSignature, file_path: str,
+                       max_distance: int = PHASH_MAX_DISTANCE,
+                       max_dhash_distance: int = DHASH_MAX_DISTANCE,
+                       aspect_tolerance: float = ASPECT_TOLERANCE) -> Optional[str]:
+        """
+        Controlla se un'immagine con la stessa impronta è già stata vista.
+
+        Il phash restringe i candidati tramite l'albero BK; ciascuno deve
+        avere anche dhash entro `max_dhash_distance` bit e rapporto
+        larghezza/altezza entro `aspect_tolerance`.
+
+        Returns:
+            str: Percorso dell'immagine più simile; altrimenti None e
+            l'impronta viene registrata.
+        """
+        try:
+            with self._lock:
+                tree = self.perceptual_tree()
+                for _, _, (path, difference, aspect) in tree.search(perceptual.phash, max_distance):
+                    if (hamming(perceptual.dhash, difference) <= max_dhash_distance
+                            and abs(perceptual.aspect - aspect) <= aspect_tolerance * aspect):
+                        return path
+                tree.add(perceptual.phash, (file_path, perceptual.dhash, perceptual.aspect))
+                self._conn.execute(
+                    "INSERT INTO perceptual (phash, path, created_at, dhash, aspect) VALUES (?, ?, ?, ?, ?)",
+                    (format(perceptual.phash, "016x"), file_path, time.time(),
+                     format(perceptual.dhash, "016x"), perceptual.aspect)
+                )
+                self._conn.commit()
+            return None
+        except Exception as e:
+            print(f"Errore nel controllo dei quasi duplicati: {str(e)}")
+            return None
+
+    def perceptual_tree(self) -> BKTree:
+        """Albero BK delle impronte salvate (lock già acquisito)."""
+        if self._perceptual_tree is None:
+            self._perceptual_tree = BKTree()
+            rows = self._conn.execute(
+                "SELECT phash, path, dhash, aspect FROM perceptual WHERE dhash IS NOT NULL"
+            )
+            for value, path, difference, aspect in rows:
+                self._perceptual_tree.add(int(value, 16), (path, int(difference, 16), aspect))
+        return self._perceptual_tree
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
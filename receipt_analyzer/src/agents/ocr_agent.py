@@ -2,41 +2,226 @@
 Automatically generated file from migration script.
 """
 
+import hashlib
+import os
+import time
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from ..services.image_preparation import PREPARATION_VERSION
+from ..services.perceptual_hash import ImageSignature
+from ..services.result_cache import prompt_version
+from ..utils.config import (OCR_CONTRAST_THRESHOLD, OCR_MAX_EDGE, OCR_NOISE_THRESHOLD,
+                            OCR_PROCESS_WORKERS)
+
+# Versione dell'elaborazione di `optimize_to_buffer` (ritaglio, CLAHE, denoise, nitidezza):
+# l'immagine inviata non è quella di `prepare_image`, quindi la cache non deve confonderle.
+# Cambia con le soglie; il numero di revisione va aumentato se cambiano i passi.
+OCR_PREPROCESS_VERSION = prompt_version(
+    "preprocess/1", str(OCR_MAX_EDGE), str(OCR_NOISE_THRESHOLD), str(OCR_CONTRAST_THRESHOLD), PREPARATION_VERSION
+)
+
+
+def estimate_noise(gray) -> float:
+    """
+    Deviazione standard del rumore (metodo di Immerkær): un solo filtro
+    3x3 sull'immagine, nessun ciclo in Python.
+    """
+    import cv2
+    import numpy as np
+
+    height, width = gray.shape[:2]
+    if height < 3 or width < 3:
+        return 0.0
+    kernel = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32)
+    response = cv2.filter2D(gray.astype(np.float32), -1, kernel)[1:-1, 1:-1]
+    return float(np.sqrt(np.pi / 2) * np.abs(response).sum() / (6 * (width - 2) * (height - 2)))
+
+
+def measure_contrast(gray) -> float:
+    """Contrasto RMS: deviazione standard dei livelli di grigio."""
+    return float(gray.std())
+
+
+def preprocess(image, max_edge: int = OCR_MAX_EDGE,
+               noise_threshold: float = OCR_NOISE_THRESHOLD,
+               contrast_threshold: float = OCR_CONTRAST_THRESHOLD) -> Tuple[object, Dict[str, float]]:
+    """
+    Prepara l'immagine per l'OCR su una copia ridotta in scala di grigi.
+
+    Contrasto e riduzione del rumore sono applicati solo se servono:
+    CLAHE se il contrasto misurato è sotto `contrast_threshold`, denoise se
+    il rumore stimato supera `noise_threshold`.
+
+    Returns:
+        tuple: (immagine elaborata, tempi in secondi per passo). I passi
+        saltati compaiono con chiave "<passo>_saltato" e il valore misurato.
+    """
+    import cv2
+
+    timings = {}
+
+    def timed(step, func, *args):
+        started = time.perf_counter()
+        result = func(*args)
+        timings[step] = time.perf_counter() - started
+        return result
+
+    def resize(img):
+        height, width = img.shape[:2]
+        scale = max_edge / max(height, width)
+        if scale >= 1:
+            return img
+        return cv2.resize(img, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+    image = timed("resize", resize, image)
+    if image.ndim == 3:
+        image = timed("grayscale", cv2.cvtColor, image, cv2.COLOR_BGR2GRAY)
+
+    contrast = measure_contrast(image)
+    if contrast < contrast_threshold:
+        image = timed("contrast", OCRAgent.enhance_contrast, image)
+    else:
+        timings["contrast_saltato"] = contrast
+
+    noise = timed("stima_rumore", estimate_noise, image)
+    if noise > noise_threshold:
+        image = timed("denoise", OCRAgent.denoise, image, noise)
+    else:
+        timings["denoise_saltato"] = noise
+
+    image = timed("sharpen", OCRAgent.sharpen, image)
+    return image, timings
+
+
+class OptimizedImage(NamedTuple):
+    """Immagine elaborata in memoria, pronta per l'invio al modello vision."""
+    data: bytes
+    mime: str
+    source_hash: str  # sha256 del file originale, radice delle chiavi della cache
+    original_bytes: int
+    size: Tuple[int, int]
+    timings: Dict[str, float]
+    signature: Optional[ImageSignature] = None  # Hash percettivi dello scontrino ritagliato
+
+
+def receipt_signature(gray) -> ImageSignature:
+    """Impronta dell'originale ritagliato: la stessa ricevuta fotografata di nuovo dà gli stessi hash."""
+    from ..services.image_preparation import receipt_bounds
+    from ..services.perceptual_hash import signature
+
+    bounds = receipt_bounds(gray)
+    x, y, w, h = bounds if bounds is not None else (0, 0, gray.shape[1], gray.shape[0])
+    return signature(gray[y:y + h, x:x + w])
+
+
+def file_signature(image_path: str) -> Optional[ImageSignature]:
+    """Impronta di un file su disco, senza elaborarlo; None se non è un'immagine leggibile."""
+    import cv2
+
+    image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    return receipt_signature(image) if image is not None else None
+
+
+def optimize_to_buffer(image_path: str, max_edge: int = OCR_MAX_EDGE) -> OptimizedImage:
+    """
+    Legge ed elabora l'immagine senza file temporanei: il risultato è
+    ritagliato, ridotto e compresso in memoria con le impostazioni di
+    invio (IMAGE_*), così il worker la usa senza rileggerla né ricodificarla.
+    Eseguibile in un processo separato.
+    """
+    import cv2
+    import numpy as np
+
+    from ..services.image_preparation import encode_array
+
+    started = time.perf_counter()
+    with open(image_path, "rb") as image_file:
+        raw = image_file.read()
+    image = cv2.imdecode(np.frombuffer(raw, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError(f"Impossibile leggere l'immagine: {image_path}")
+    timings = {"decode": time.perf_counter() - started}
+
+    started = time.perf_counter()
+    perceptual = receipt_signature(image)
+    timings["phash"] = time.perf_counter() - started
+
+    image, steps = preprocess(image, max_edge)
+    timings.update(steps)
+
+    started = time.perf_counter()
+    data, mime, size = encode_array(image)
+    timings["encode"] = time.perf_counter() - started
+    return OptimizedImage(data, mime, hashlib.sha256(raw).hexdigest(), len(raw), size, timings, perceptual)
+
+
+def archive_image(data: bytes, path: str) -> str:
+    """Scrive `data` in `path` passando da un file temporaneo, così chi osserva la cartella non legge file parziali."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as archive_file:
+        archive_file.write(data)
+    os.replace(temp_path, path)
+    return path
+
+
+def format_timings(timings: Dict[str, float]) -> str:
+    parts = []
+    for step, value in timings.items():
+        if step.endswith("_saltato"):
+            parts.append(f"{step[:-len('_saltato')]} saltato ({value:.1f})")
+        else:
+            parts.append(f"{step} {value * 1000:.0f} ms")
+    return ", ".join(parts)
 
 
 class OCRAgent:
     """Agente per l'ottimizzazione del riconoscimento del testo."""
 
-    def __init__(self):
+    def __init__(self, max_workers: int = OCR_PROCESS_WORKERS):
         self.preprocessing_methods = [
             self.enhance_contrast,
             self.denoise,
             self.sharpen
         ]
+        self.max_workers = max_workers
+        self._executor = None
 
-    def enhance_contrast(self, image):
+    @staticmethod
+    def enhance_contrast(image):
         """Migliora il contrasto dell'immagine."""
         try:
             import cv2
-            import numpy as np
+            clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+            if image.ndim == 2:
+                return clahe.apply(image)
             lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
             l, a, b = cv2.split(lab)
-            clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
             cl = clahe.apply(l)
             limg = cv2.merge((cl, a, b))
             return cv2.cvtColor(limg, cv2.COLOR_LAB2BGR)
         except:
             return image
 
-    def denoise(self, image):
-        """Rimuove il rumore dall'immagine."""
+    @staticmethod
+    def denoise(image, noise: Optional[float] = None):
+        """
+        Rimuove il rumore dall'immagine.
+
+        Sulle immagini in scala di grigi usa fastNlMeansDenoising con
+        finestre ridotte e filtro proporzionato al rumore stimato.
+        """
         try:
             import cv2
+            if image.ndim == 2:
+                strength = min(max(noise or 10.0, 3.0), 15.0)
+                return cv2.fastNlMeansDenoising(image, None, h=strength,
+                                                templateWindowSize=5, searchWindowSize=15)
             return cv2.fastNlMeansDenoisingColored(image)
         except:
             return image
 
-    def sharpen(self, image):
+    @staticmethod
+    def sharpen(image):
         """Aumenta la nitidezza dell'immagine."""
         try:
             import cv2
@@ -46,21 +231,26 @@ class OCRAgent:
         except:
             return image
 
-    def optimize_image(self, image_path: str) -> str:
-        """Ottimizza l'immagine per il riconoscimento del testo."""
-        try:
-            import cv2
-            image = cv2.imread(image_path)
+    @property
+    def executor(self):
+        if self._executor is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # spawn: i processi figli non ereditano i thread di Qt
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
 
-            # Applica i metodi di preprocessing in sequenza
-            for method in self.preprocessing_methods:
-                image = method(image)
+    def optimize_to_buffer_async(self, image_path: str):
+        """
+        Ottimizza l'immagine nel pool e restituisce il buffer codificato.
 
-            # Salva l'immagine ottimizzata
-            optimized_path = image_path.replace(".", "_optimized.")
-            cv2.imwrite(optimized_path, image)
-            return optimized_path
-        except Exception as e:
-            print(f"Errore nell'ottimizzazione dell'immagine: {str(e)}")
-            return image_path
+        Returns:
+            concurrent.futures.Future: risultato OptimizedImage.
+        """
+        return self.executor.submit(optimize_to_buffer, image_path)
 
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
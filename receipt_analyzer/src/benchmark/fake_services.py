@@ -0,0 +1,323 @@
+import asyncio
+import hashlib
+import json
+import random
+import re
+import socket
+import threading
+import time
+from datetime import date, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from aiohttp import web
+
+MERCHANTS = ("Bar Centrale", "Farmacia Rossi", "Libreria Verdi", "Trattoria da Mario", "Supermercato Coop",
+             "Taxi Roma", "Hotel Bellavista", "Ferramenta Bianchi", "Museo Civico", "Gelateria Fiore")
+PLACES = ("Roma", "Milano", "Napoli", "Torino", "Firenze", "Bologna", "Londra", "New York", "Muscat")
+CURRENCIES = {"Londra": "GBP", "New York": "USD", "Muscat": "OMR"}
+CATEGORIES = (("Cibo e Ristorazione", "Bar"), ("Servizi", "Farmacia"), ("Shopping", "Libri"),
+              ("Cibo e Ristorazione", "Ristorante"), ("Shopping", "Alimentari"), ("Trasporti", "Taxi"),
+              ("Servizi", "Alloggio"), ("Shopping", "Casa"), ("Altro", "Cultura"), ("Cibo e Ristorazione", "Gelateria"))
+# Tassi verso l'euro della tabella finta (valuta base EUR)
+RATES = {"USD": 1.08, "GBP": 0.86, "OMR": 0.42, "CHF": 0.95, "JPY": 162.0}
+
+
+def receipt_fields(key: str) -> Dict[str, Any]:
+    """
+    Dati "letti" da uno scontrino, ricavati in modo deterministico da `key`
+    (l'immagine inviata): la stessa immagine dà sempre lo stesso risultato.
+    Circa uno scontrino su dieci non ha la località, così passa dal geocoding.
+    """
+    digest = int(hashlib.sha256(key.encode()).hexdigest(), 16)
+    index = digest % len(MERCHANTS)
+    place = PLACES[(digest >> 8) % len(PLACES)]
+    day = date(2024, 1, 1) + timedelta(days=(digest >> 16) % 365)
+    return {
+        "data": day.isoformat(),
+        "importo": round(1 + (digest >> 32) % 30000 / 100, 2),
+        "valuta": CURRENCIES.get(place, "EUR"),
+        "esercente": f"{MERCHANTS[index]} {(digest >> 64) % 100000:05d}",
+        "luogo": "Località sconosciuta" if (digest >> 96) % 10 == 0 else place,
+    }
+
+
+def category_of(text: str) -> Tuple[str, str]:
+    """Categoria e sottocategoria dell'esercente citato nel testo."""
+    for merchant, category in zip(MERCHANTS, CATEGORIES):
+        if merchant in text:
+            return category
+    return "Altro", "Generico"
+
+
+class FakeServices:
+    """
+    Server HTTP locale che imita OpenAI (chat completions, anche in
+    streaming), ExchangeRate-API, Frankfurter, la sorgente di forex-python,
+    fixer.io e Nominatim, per misurare la pipeline senza rete né costi.
+
+    Ogni servizio ha una latenza configurabile (secondi, con `jitter`
+    relativo) e una percentuale di risposte 500 (`error_rate`). Gira su un
+    event loop proprio, in un thread dedicato; `stats` conta le richieste
+    e gli errori restituiti per servizio.
+    """
+
+    def __init__(self, latency: Optional[Dict[str, float]] = None, jitter: float = 0.2,
+                 error_rate: float = 0.0, seed: int = 0):
+        self.latency = {"openai": 0.0, "fx": 0.0, "geocoding": 0.0, **(latency or {})}
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.stats = {name: {"richieste": 0, "errori": 0} for name in self.latency}
+        # Limiti OpenAI simulati (alti, come un account di livello elevato) e consumo nel minuto
+        self.rate_limits = {"requests": 10000, "tokens": 30000000}
+        self._minute = (0, 0, 0)
+        self.port: Optional[int] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def openai_url(self) -> str:
+        return f"{self.base_url}/v1"
+
+    @property
+    def fx_api_url(self) -> str:
+        return f"{self.base_url}/fx"
+
+    @property
+    def fx_history_url(self) -> str:
+        return f"{self.base_url}/history"
+
+    @property
+    def forex_url(self) -> str:
+        return f"{self.base_url}/forex"
+
+    @property
+    def fixer_url(self) -> str:
+        return f"{self.base_url}/fixer"
+
+    @property
+    def geocoding_url(self) -> str:
+        return f"{self.base_url}/search"
+
+    def start(self) -> "FakeServices":
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        self.port = sock.getsockname()[1]
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+        self._thread = threading.Thread(target=self._serve, args=(sock, started),
+                                        name="fake-services", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(10)
+        self._loop.close()
+        self._loop = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _serve(self, sock: socket.socket, started: threading.Event):
+        asyncio.set_event_loop(self._loop)
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_get("/fx/latest/{base}", self.fx_open_table)
+        app.router.add_get("/fx/{key}/latest/{base}", self.fx_table)
+        app.router.add_get("/fx/{key}/pair/{source}/{target}", self.fx_pair)
+        app.router.add_get("/history/{start}..{end}", self.fx_history)
+        app.router.add_get("/forex/latest", self.fx_symbols)
+        app.router.add_get("/fixer/latest", self.fx_symbols)
+        app.router.add_get("/search", self.geocoding)
+        self._runner = web.AppRunner(app, access_log=None)
+        self._loop.run_until_complete(self._runner.setup())
+        self._loop.run_until_complete(web.SockSite(self._runner, sock).start())
+        started.set()
+        self._loop.run_forever()
+
+    async def _delay(self, service: str) -> bool:
+        """Attende la latenza del servizio; False se la richiesta deve fallire."""
+        stats = self.stats[service]
+        stats["richieste"] += 1
+        latency = self.latency[service] * (1 + self.random.uniform(-self.jitter, self.jitter))
+        if latency > 0:
+            await asyncio.sleep(latency)
+        if self.random.random() < self.error_rate:
+            stats["errori"] += 1
+            return False
+        return True
+
+    @staticmethod
+    def _server_error() -> web.Response:
+        return web.json_response({"error": {"message": "Errore simulato", "type": "server_error"}}, status=500)
+
+    # OpenAI
+
+    def _rate_headers(self, tokens: int) -> Dict[str, str]:
+        """Header x-ratelimit-* come quelli di OpenAI, con il consumo del minuto corrente."""
+        minute, requests, used = self._minute
+        if minute != int(time.time() // 60):
+            minute, requests, used = int(time.time() // 60), 0, 0
+        self._minute = (minute, requests + 1, used + tokens)
+        return {
+            "x-ratelimit-limit-requests": str(self.rate_limits["requests"]),
+            "x-ratelimit-remaining-requests": str(max(0, self.rate_limits["requests"] - requests - 1)),
+            "x-ratelimit-limit-tokens": str(self.rate_limits["tokens"]),
+            "x-ratelimit-remaining-tokens": str(max(0, self.rate_limits["tokens"] - used - tokens)),
+        }
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        if not await self._delay("openai"):
+            return self._server_error()
+        content = self.completion_content(body)
+        prompt_tokens = sum(self.prompt_tokens(m.get("content", "")) for m in body.get("messages", []))
+        completion_tokens = max(1, len(content) // 4)
+        headers = self._rate_headers(prompt_tokens + completion_tokens)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        base = {"id": f"chatcmpl-{self.random.getrandbits(48):x}", "created": int(time.time()),
+                "model": body.get("model", "gpt-4o")}
+
+        if not body.get("stream"):
+            return web.json_response({
+                **base, "object": "chat.completion",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": usage,
+            }, headers=headers)
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", **headers})
+        await response.prepare(request)
+        chunk = {**base, "object": "chat.completion.chunk"}
+        pieces = [content[i:i + 64] for i in range(0, len(content), 64)]
+        for i, piece in enumerate(pieces):
+            delta = {"role": "assistant", "content": piece} if i == 0 else {"content": piece}
+            await response.write(self._event({**chunk, "choices": [
+                {"index": 0, "delta": delta, "finish_reason": None}]}))
+        await response.write(self._event({**chunk, "choices": [
+            {"index": 0, "delta": {}, "finish_reason": "stop"}]}))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await response.write(self._event({**chunk, "choices": [], "usage": usage}))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    @staticmethod
+    def prompt_tokens(content) -> int:
+        """Stima dei token: un token ogni 4 caratteri, 765 per immagine (dettaglio alto, 1024px)."""
+        if isinstance(content, str):
+            return len(content) // 4
+        return sum(765 if part.get("type") == "image_url" else len(part.get("text", "")) // 4
+                   for part in content)
+
+    @staticmethod
+    def _event(payload: Dict[str, Any]) -> bytes:
+        return f"data: {json.dumps(payload)}\n\n".encode()
+
+    @staticmethod
+    def completion_content(body: Dict[str, Any]) -> str:
+        """Risposta al prompt: vision (singola, a lotti, single_pass) o catene testuali."""
+        content = body["messages"][-1]["content"]
+        if isinstance(content, list):
+            prompt = content[0]["text"]
+            images = [part["image_url"]["url"] for part in content if part.get("type") == "image_url"]
+            receipts = [receipt_fields(url) for url in images]
+            if prompt.startswith("Ci sono"):
+                return json.dumps({"scontrini": [{"indice": i + 1, **fields}
+                                                 for i, fields in enumerate(receipts)]})
+            if "validazione" in prompt:
+                fields = receipts[0]
+                category, subcategory = category_of(fields["esercente"])
+                return json.dumps({
+                    **fields,
+                    "validazione": {"data_valida": True, "importo_valido": True, "valuta_valida": True,
+                                    "messaggi": []},
+                    "categoria": category, "sottocategoria": subcategory, "confidenza": 0.9,
+                    "tags": [subcategory.lower()],
+                })
+            return json.dumps(receipts[0])
+
+        if "Testo da analizzare:" in content:
+            text = content.split("Testo da analizzare:", 1)[1].strip()
+            match = re.search(r"\{.*\}", text, re.S)
+            return match.group(0) if match else json.dumps(receipt_fields(text))
+        if "Dati da validare:" in content:
+            return json.dumps({"data_valida": True, "importo_valido": True, "valuta_valida": True,
+                               "correzioni": {"data": None, "importo": None, "valuta": None},
+                               "messaggi": []})
+        category, subcategory = category_of(content.split("Descrizione da analizzare:", 1)[-1])
+        return json.dumps({"categoria": category, "confidenza": 0.9, "sottocategoria": subcategory,
+                           "tags": [subcategory.lower()]})
+
+    # Tassi di cambio
+
+    async def fx_open_table(self, request: web.Request) -> web.Response:
+        if not await self._delay("fx"):
+            return self._server_error()
+        return web.json_response({"result": "success", "base_code": request.match_info["base"],
+                                  "rates": self.rate_table(request.match_info["base"])})
+
+    async def fx_table(self, request: web.Request) -> web.Response:
+        if not await self._delay("fx"):
+            return self._server_error()
+        return web.json_response({"result": "success", "base_code": request.match_info["base"],
+                                  "conversion_rates": self.rate_table(request.match_info["base"])})
+
+    async def fx_pair(self, request: web.Request) -> web.Response:
+        if not await self._delay("fx"):
+            return self._server_error()
+        table = self.rate_table(request.match_info["source"])
+        return web.json_response({"result": "success",
+                                  "conversion_rate": table.get(request.match_info["target"], 1.0)})
+
+    async def fx_symbols(self, request: web.Request) -> web.Response:
+        """Tassi richiesti con base e symbols (sorgente di forex-python, fixer.io)."""
+        if not await self._delay("fx"):
+            return self._server_error()
+        table = self.rate_table(request.query.get("base", "EUR"))
+        symbols = request.query.get("symbols", "").split(",")
+        return web.json_response({"success": True, "base": request.query.get("base", "EUR"),
+                                  "rates": {symbol: table[symbol] for symbol in symbols if symbol in table}})
+
+    async def fx_history(self, request: web.Request) -> web.Response:
+        if not await self._delay("fx"):
+            return self._server_error()
+        start = date.fromisoformat(request.match_info["start"])
+        end = date.fromisoformat(request.match_info["end"])
+        base = request.query.get("from", "EUR")
+        rates = {}
+        day = start
+        while day <= end:
+            if day.weekday() < 5:  # Come la BCE: niente tassi nel weekend
+                rates[day.isoformat()] = self.rate_table(base)
+            day += timedelta(days=1)
+        return web.json_response({"base": base, "start_date": start.isoformat(), "end_date": end.isoformat(),
+                                  "rates": rates})
+
+    @staticmethod
+    def rate_table(base: str) -> Dict[str, float]:
+        rates = {"EUR": 1.0, **RATES}
+        divisor = rates.get(base, 1.0)
+        return {currency: round(rate / divisor, 6) for currency, rate in rates.items() if currency != base}
+
+    # Geocoding
+
+    async def geocoding(self, request: web.Request) -> web.Response:
+        if not await self._delay("geocoding"):
+            return self._server_error()
+        query = request.query.get("q", "")
+        return web.json_response([{"display_name": f"{query}, Italia", "lat": "41.9", "lon": "12.5"}])
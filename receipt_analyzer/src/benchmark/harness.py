@@ -0,0 +1,248 @@
+import glob
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from ..utils.config import BASE_DIR, BENCHMARK_DIR, EXTRACTION_MODE, MAX_CONCURRENT_WORKERS
+
+# Latenze predefinite dei servizi finti (secondi): piccole, per corpus grandi in tempi ragionevoli
+DEFAULT_LATENCY = {"openai": 0.05, "fx": 0.02, "geocoding": 0.03}
+BENCHMARK_API_KEY = "sk-benchmark"
+PERCENTILES = (50, 95, 99)
+
+
+def generate_corpus(directory: str, count: int, seed: int = 0) -> List[str]:
+    """
+    Scontrini sintetici: un foglio chiaro su sfondo scuro, in posizione e con
+    righe di testo diverse per ogni immagine (nessun duplicato né quasi duplicato).
+    """
+    import cv2
+    import numpy as np
+
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    for i in range(count):
+        image = np.full((1200, 900, 3), rng.randint(40, 90), dtype=np.uint8)
+        x, y = rng.randint(40, 160), rng.randint(40, 120)
+        cv2.rectangle(image, (x, y), (x + 600, y + 1000), (235, 235, 230), thickness=-1)
+        lines = [f"SCONTRINO N. {i:05d}", f"CASSA {rng.randint(1, 9)}  OP. {rng.randint(100, 999)}"]
+        lines += [f"ARTICOLO {rng.randint(1000, 9999)}   {rng.uniform(0.5, 80):7.2f}" for _ in range(rng.randint(4, 12))]
+        lines.append(f"TOTALE   {rng.uniform(1, 300):7.2f}")
+        for row, text in enumerate(lines):
+            cv2.putText(image, text, (x + 30, y + 70 + row * 60), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (20, 20, 20), 2)
+        path = os.path.join(directory, f"scontrino_{i:05d}.jpg")
+        cv2.imwrite(path, image, [cv2.IMWRITE_JPEG_QUALITY, 85])
+        paths.append(path)
+    return paths
+
+
+def percentiles(values: Sequence[float]) -> Dict[str, float]:
+    """p50/p95/p99 (metodo nearest-rank) dei valori, in secondi."""
+    ordered = sorted(values)
+    if not ordered:
+        return {f"p{p}": 0.0 for p in PERCENTILES}
+    return {f"p{p}": round(ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)], 4) for p in PERCENTILES}
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Memoria residente massima del processo in MB; None dove `resource` non esiste (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux riporta kB, macOS byte
+    return round(peak / 2**20 if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                                capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+def run_size(size: int, config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Elabora un corpus sintetico di `size` scontrini con BatchProcessor,
+    contro i servizi finti, senza cache né giornale. Eseguita in un processo
+    separato per corpus: il picco di memoria misurato è solo il suo.
+    """
+    from ..cli import BatchProcessor, ConsoleLogger
+    from ..models.currency_manager import CurrencyConversionManager
+    from ..models.rate_store import RateStore
+    from ..models.receipt_store import ReceiptStore
+    from ..services.async_runtime import AsyncRuntime
+    from ..services.receipt_analyzer import ReceiptAnalysisChain
+    from .fake_services import FakeServices
+
+    work_dir = tempfile.mkdtemp(prefix="receipt_benchmark_")
+    try:
+        paths = generate_corpus(os.path.join(work_dir, "scontrini"), size, config["seed"])
+        services = FakeServices(config["latenza"], config["jitter"], config["errori"], config["seed"]).start()
+        runtime = AsyncRuntime()
+        logger = ConsoleLogger()
+        store = ReceiptStore(os.path.join(work_dir, "receipts.sqlite3"))
+        rate_store = RateStore(os.path.join(work_dir, "fx_rates.sqlite3"))
+        try:
+            analysis_chain = ReceiptAnalysisChain(runtime=runtime, api_key=BENCHMARK_API_KEY,
+                                                  logger=logger.log_action, base_url=services.openai_url)
+            analysis_chain.geocoding_url = services.geocoding_url
+            currency_manager = CurrencyConversionManager(logger, runtime=runtime, rate_store=rate_store,
+                                                         interactive=False)
+            currency_manager.exchange_api_key = None
+            currency_manager.api_url = currency_manager.open_url = services.fx_api_url
+            currency_manager.history_url = services.fx_history_url
+            currency_manager.forex_url = services.forex_url
+            currency_manager.fixer_url = services.fixer_url
+            processor = BatchProcessor(
+                runtime=runtime,
+                analysis_chain=analysis_chain,
+                currency_manager=currency_manager,
+                store=store,
+                client=runtime.openai_client(BENCHMARK_API_KEY, services.openai_url),
+                workers=config["workers"],
+                logger=logger,
+                mode=config["modalita"],
+                print_rows=False
+            )
+            summary = processor.run(paths)
+        finally:
+            runtime.shutdown()
+            services.stop()
+            store.close()
+            rate_store.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    total = summary["totale_fasi"]
+    return {
+        "scontrini": size,
+        "completati": summary["completati"],
+        "falliti": summary["falliti"],
+        "duplicati": summary["duplicati"],
+        "secondi": summary["secondi"],
+        "scontrini_al_secondo": round(summary["completati"] / summary["secondi"], 2) if summary["secondi"] else 0.0,
+        "latenza": percentiles(processor.latencies),
+        "fasi": {stage: percentiles(samples) for stage, samples in processor.stage_samples.items()},
+        "chiamate_modello": int(total["chiamate"]),
+        "token": int(total["prompt_tokens"] + total["completion_tokens"]),
+        "rss_picco_mb": peak_rss_mb(),
+        "richieste": services.stats,
+        "limiti_openai": summary.get("openai"),
+    }
+
+
+def run_benchmark(sizes: Sequence[int], latency: Optional[Dict[str, float]] = None, jitter: float = 0.2,
+                  error_rate: float = 0.0, workers: int = MAX_CONCURRENT_WORKERS, mode: str = EXTRACTION_MODE,
+                  seed: int = 0, isolate: bool = True, log=print) -> Dict[str, Any]:
+    """
+    Esegue il benchmark per ogni dimensione di corpus, ciascuna (con
+    `isolate`) in un processo avviato con spawn.
+
+    Returns:
+        dict: Configurazione, commit e risultati per dimensione del corpus.
+    """
+    config = {
+        "latenza": {**DEFAULT_LATENCY, **(latency or {})},
+        "jitter": jitter,
+        "errori": error_rate,
+        "workers": workers,
+        "modalita": mode,
+        "seed": seed,
+    }
+    results = {
+        "creato": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "config": config,
+        "corpus": {},
+    }
+    for size in sizes:
+        log(f"Benchmark: {size} scontrini ({mode}, {workers} worker)...")
+        if isolate:
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result = executor.submit(run_size, size, config).result()
+        else:
+            result = run_size(size, config)
+        results["corpus"][str(size)] = result
+    return results
+
+
+def save_result(results: Dict[str, Any], output_dir: str = BENCHMARK_DIR) -> str:
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"bench_{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def latest_result(config: Dict[str, Any], output_dir: str = BENCHMARK_DIR) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """Ultimo risultato salvato con la stessa configurazione (confrontabile), con il suo percorso."""
+    for path in sorted(glob.glob(os.path.join(output_dir, "bench_*.json")), reverse=True):
+        try:
+            with open(path, encoding="utf-8") as f:
+                previous = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if previous.get("config") == config:
+            return path, previous
+    return None
+
+
+def compare(results: Dict[str, Any], previous: Dict[str, Any]) -> Dict[str, Dict[str, float]]:
+    """
+    Variazioni percentuali rispetto a un risultato precedente, per i corpus
+    presenti in entrambi: throughput, p95 di latenza e di ogni fase, picco RSS.
+    Per il throughput un valore negativo è un peggioramento, per gli altri un miglioramento.
+    """
+    def delta(after, before):
+        return round((after - before) / before * 100, 1) if after is not None and before else None
+
+    changes = {}
+    for size, current in results["corpus"].items():
+        before = previous["corpus"].get(size)
+        if before is None:
+            continue
+        size_changes = {
+            "scontrini_al_secondo": delta(current["scontrini_al_secondo"], before["scontrini_al_secondo"]),
+            "latenza_p95": delta(current["latenza"]["p95"], before["latenza"]["p95"]),
+            "rss_picco_mb": delta(current["rss_picco_mb"], before["rss_picco_mb"]),
+        }
+        for stage, values in current["fasi"].items():
+            if stage in before["fasi"]:
+                size_changes[f"{stage}_p95"] = delta(values["p95"], before["fasi"][stage]["p95"])
+        changes[size] = size_changes
+    return changes
+
+
+def print_report(results: Dict[str, Any], changes: Optional[Dict[str, Dict[str, float]]] = None):
+    config = results["config"]
+    latency = ", ".join(f"{name} {value * 1000:.0f} ms" for name, value in config["latenza"].items())
+    print(f"\nBenchmark {config['modalita']} ({config['workers']} worker, {latency}, "
+          f"errori {config['errori'] * 100:.0f}%) - commit {results['commit'] or 'n/d'}")
+    for size, result in results["corpus"].items():
+        rss = f"{result['rss_picco_mb']:.0f} MB" if result["rss_picco_mb"] is not None else "n/d"
+        print(f"\n  {size} scontrini: {result['scontrini_al_secondo']:.2f} scontrini/s, "
+              f"{result['completati']} completati, {result['falliti']} falliti, picco RSS {rss}")
+        print("  " + "Fase".ljust(16) + "".join(f"p{p}".rjust(10) for p in PERCENTILES))
+        for stage, values in [*result["fasi"].items(), ("scontrino", result["latenza"])]:
+            print("  " + stage.ljust(16) + "".join(f"{values[f'p{p}'] * 1000:8.1f}ms" for p in PERCENTILES))
+        size_changes = (changes or {}).get(size)
+        if size_changes:
+            print("  Rispetto al precedente: " + ", ".join(
+                f"{name} {value:+.1f}%" for name, value in size_changes.items() if value is not None))
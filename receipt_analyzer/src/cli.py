@@ -0,0 +1,471 @@
+"""
+Modalità senza interfaccia grafica.
+
+    python -m receipt_analyzer batch <cartella> [--workers N] [--db PATH] [--output FILE]
+    python -m receipt_analyzer compare <cartella>
+    python -m receipt_analyzer cache list|purge [--image HASH] [--stage NOME]
+    python -m receipt_analyzer bench [--sizes 10,1000,10000] [--openai-ms MS] [--error-rate R]
+
+Le API key sono lette da variabili d'ambiente, file .env o dai file
+salvati dall'interfaccia (vedi utils.api_keys): nessun dialogo.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List, Optional
+
+from .services.stage_metrics import merge
+from .utils.config import (BENCHMARK_DIR, BENCHMARK_SIZES, EXTRACTION_MODE, EXTRACTION_MODES,
+                           IMAGE_EXTENSIONS, JOBS_DB, MAX_CONCURRENT_WORKERS, RECEIPTS_DB, RESULT_CACHE_DB, RESULT_CACHE_MAX_BYTES,
+                           VISION_BATCH_SIZE, VISION_BATCH_WINDOW_MS)
+
+
+class ConsoleLogger:
+    """Logger per la riga di comando, con la stessa interfaccia della finestra principale."""
+
+    def __init__(self, verbose: bool = False):
+        self.verbose = verbose
+
+    def log_action(self, message: str):
+        if self.verbose:
+            print(message, file=sys.stderr)
+
+    __call__ = log_action
+
+
+def find_images(directory: str) -> List[str]:
+    """Immagini di scontrini nella cartella, in ordine di nome; i file `_optimized` sono esclusi."""
+    paths = []
+    for name in sorted(os.listdir(directory)):
+        stem, ext = os.path.splitext(name)
+        if ext.lower() in IMAGE_EXTENSIONS and not stem.endswith("_optimized"):
+            paths.append(os.path.join(directory, name))
+    return paths
+
+
+class BatchProcessor:
+    """
+    Elabora una cartella di scontrini con la stessa pipeline dell'interfaccia.
+
+    Al massimo `workers` scontrini sono in elaborazione contemporaneamente
+    sul loop condiviso; le righe finiscono nell'archivio (e opzionalmente in
+    un file JSON Lines) man mano che ciascuno scontrino è completato.
+    Con `store` None le righe non vengono salvate (confronto tra modalità).
+    Con un `journal` le fasi completate di ogni scontrino sono salvate: un
+    batch interrotto e rilanciato riprende da dove si era fermato. Con uno
+    `span_exporter` gli span delle fasi, salvataggio compreso, sono esportati.
+    """
+
+    def __init__(self, runtime, analysis_chain, currency_manager, store, result_cache=None,
+                 client=None, workers: int = MAX_CONCURRENT_WORKERS, output=None, logger=None,
+                 mode: str = EXTRACTION_MODE, vision_batcher=None, journal=None, print_rows: bool = True,
+                 span_exporter=None):
+        self.runtime = runtime
+        self.analysis_chain = analysis_chain
+        self.currency_manager = currency_manager
+        self.store = store
+        self.result_cache = result_cache
+        self.client = client
+        self.workers = max(1, workers)
+        self.output = output
+        self.logger = logger or ConsoleLogger()
+        self.mode = mode
+        self.vision_batcher = vision_batcher
+        self.journal = journal
+        self.print_rows = print_rows
+        self.span_exporter = span_exporter
+        self.latencies: List[float] = []
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.nested_stages = set()  # Misurate dentro un'altra fase: escluse dai totali
+        # Durate di ogni fase per scontrino, per i percentili del benchmark
+        self.stage_samples: Dict[str, List[float]] = {}
+        self.image_bytes = {"bytes_originali": 0, "bytes_inviati": 0, "bytes_risparmiati": 0}
+        self.failures: Dict[str, str] = {}
+        self.duplicates: Dict[str, str] = {}
+
+    def pipeline(self):
+        from .services.pipeline import ReceiptPipeline
+        pipeline = ReceiptPipeline(
+            client=self.client,
+            analysis_chain=self.analysis_chain,
+            currency_manager=self.currency_manager,
+            result_cache=self.result_cache,
+            runtime=self.runtime,
+            log=self.logger.log_action,
+            mode=self.mode,
+            vision_batcher=self.vision_batcher,
+            receipt_store=self.store
+        )
+        pipeline.span_exporter = self.span_exporter
+        return pipeline
+
+    async def process_file(self, path: str, semaphore: asyncio.Semaphore):
+        from .models.receipt_store import result_to_row
+        from .services.pipeline import DuplicateReceipt
+
+        async with semaphore:
+            started = time.perf_counter()
+            pipeline = self.pipeline()
+            job_id = None
+            if self.journal is not None:
+                job_id = self.journal.enqueue(path).id
+                pipeline.journal, pipeline.job_id = self.journal, job_id
+                pipeline.resume_results = self.journal.completed_stages(job_id)
+            try:
+                data = await pipeline.process_receipt(path)
+            except DuplicateReceipt as e:
+                self.duplicates[path] = str(e)
+                self.logger.log_action(f"{os.path.basename(path)}: {str(e)}")
+                if job_id is not None:
+                    self.journal.fail(job_id, str(e))
+                return
+            except Exception as e:
+                if job_id is not None:
+                    self.journal.fail(job_id, str(e))
+                self.failures[path] = str(e)
+                self.logger.log_action(f"Errore elaborazione {path}: {str(e)}")
+                return
+            self.latencies.append(time.perf_counter() - started)
+            merge([pipeline.image_stats], self.image_bytes)
+
+        row = result_to_row(data, path)
+        if self.store is not None:
+            with pipeline.metrics.measure("persistence"):
+                self.store.add(row)
+            pipeline.export_spans()
+        for stage, values in pipeline.metrics.stages.items():
+            self.stages[stage] = merge([values], self.stages.get(stage))
+            self.stage_samples.setdefault(stage, []).append(values["secondi"])
+        self.nested_stages |= pipeline.metrics.nested
+        if job_id is not None:
+            self.journal.complete(job_id)
+        if self.output is not None:
+            self.output.write(json.dumps({"file": path, "row": row, "result": data}, ensure_ascii=False) + "\n")
+            self.output.flush()
+        if self.print_rows:
+            print(f"[{len(self.latencies)}] {os.path.basename(path)}: {row['Importo (EUR)']:.2f} EUR "
+                  f"({row['Categoria']})")
+
+    async def run_async(self, paths: List[str]) -> Dict:
+        semaphore = asyncio.Semaphore(self.workers)
+        started = time.perf_counter()
+        await asyncio.gather(*(self.process_file(path, semaphore) for path in paths))
+        return self.summary(len(paths), time.perf_counter() - started)
+
+    def run(self, paths: List[str]) -> Dict:
+        return self.runtime.run(self.run_async(paths))
+
+    def summary(self, total: int, elapsed: float) -> Dict:
+        completed = len(self.latencies)
+        summary = {
+            "modalita": self.mode,
+            "file": total,
+            "completati": completed,
+            "falliti": len(self.failures),
+            "duplicati": len(self.duplicates),
+            "secondi": round(elapsed, 2),
+            "throughput_min": round(completed / elapsed * 60, 2) if elapsed > 0 else 0.0,
+            "latenza_media": round(statistics.mean(self.latencies), 2) if self.latencies else 0.0,
+            "latenza_max": round(max(self.latencies), 2) if self.latencies else 0.0,
+            "fasi": self.stages,
+            "totale_fasi": merge(values for stage, values in self.stages.items()
+                                 if stage not in self.nested_stages),
+            "immagini": dict(self.image_bytes),
+        }
+        if self.result_cache is not None:
+            summary["cache_hit"] = self.result_cache.hits
+            summary["cache_miss"] = self.result_cache.misses
+        if self.currency_manager is not None:
+            summary["fx"] = dict(self.currency_manager.cache_stats)
+            lookup = self.currency_manager.provider_lookup
+            if lookup.stats["ricerche"]:
+                summary["fx_provider"] = {**lookup.stats, "salute": lookup.report()}
+        if self.vision_batcher is not None:
+            summary["ocr_lotti"] = dict(self.vision_batcher.stats)
+        limiter = getattr(self.runtime, "openai_limiter", None)
+        if limiter is not None:
+            summary["openai"] = limiter.state()
+        return summary
+
+
+def print_summary(summary: Dict):
+    print(f"\nRiepilogo batch ({summary['modalita']})")
+    print(f"  Scontrini:   {summary['completati']}/{summary['file']} completati, {summary['falliti']} falliti, "
+          f"{summary['duplicati']} duplicati")
+    print(f"  Durata:      {summary['secondi']:.2f} s")
+    print(f"  Throughput:  {summary['throughput_min']:.2f} scontrini/min")
+    print(f"  Latenza:     media {summary['latenza_media']:.2f} s, max {summary['latenza_max']:.2f} s")
+    images = summary["immagini"]
+    if images["bytes_originali"]:
+        print(f"  Immagini:    {images['bytes_originali'] / 2**20:.1f} MB -> {images['bytes_inviati'] / 2**20:.1f} MB "
+              f"inviati ({images['bytes_risparmiati'] / images['bytes_originali'] * 100:.0f}% risparmiati)")
+    if "cache_hit" in summary:
+        print(f"  Cache:       {summary['cache_hit']} hit, {summary['cache_miss']} miss")
+    if "fx" in summary:
+        fx = summary["fx"]
+        print(f"  Cache FX:    {fx['hit']} hit, {fx['miss']} miss, {fx['fetch']} chiamate al provider")
+    if "fx_provider" in summary:
+        providers = summary["fx_provider"]
+        health = ", ".join(f"{name} {values['punteggio']:.2f}" for name, values in providers["salute"].items())
+        print(f"  Provider FX: {providers['ricerche']} ricerche, {providers['coperture']} coperture in parallelo, "
+              f"{providers['senza_esito']} senza esito (salute: {health})")
+    if "ocr_lotti" in summary:
+        batches = summary["ocr_lotti"]
+        print(f"  OCR a lotti: {batches['immagini']} immagini in {batches['chiamate']} chiamate, "
+              f"{batches['fallback']} lotti rielaborati singolarmente")
+    total = summary["totale_fasi"]
+    print(f"  Modello:     {int(total['chiamate'])} chiamate, "
+          f"{int(total['prompt_tokens'] + total['completion_tokens'])} token")
+    if total.get("richieste"):
+        print(f"  HTTP:        {int(total['richieste'])} richieste, {total['bytes'] / 2**20:.1f} MB inviati, "
+              f"{int(total['tentativi'])} ripetute dopo un errore")
+    if summary.get("openai"):
+        limits = summary["openai"]
+        print(f"  OpenAI:      {limits['attese']} attese per i limiti ({limits['secondi_attesa']:.1f} s), "
+              f"{limits['rate_limit']} risposte 429, {limits['tentativi']} tentativi, "
+              f"circuito {limits['circuito']} (aperto {limits['circuito_aperto']} volte)")
+
+
+def print_comparison(summaries: List[Dict]):
+    """Tabella latenza/token per fase, una colonna per modalità, con il risparmio sul totale."""
+    stages = []
+    for summary in summaries:
+        stages.extend(stage for stage in summary["fasi"] if stage not in stages)
+
+    def cell(values: Optional[Dict], completed: int) -> str:
+        if not values:
+            return "-"
+        tokens = values["prompt_tokens"] + values["completion_tokens"]
+        per_receipt = max(completed, 1)
+        return f"{values['secondi'] / per_receipt:6.2f}s {tokens / per_receipt:8.0f} tok"
+
+    header = "Fase".ljust(16) + "".join(s["modalita"].rjust(24) for s in summaries)
+    print("\nConfronto per scontrino (media)")
+    print(header)
+    print("-" * len(header))
+    for stage in stages + ["totale"]:
+        line = stage.ljust(16)
+        for summary in summaries:
+            values = summary["totale_fasi"] if stage == "totale" else summary["fasi"].get(stage)
+            line += cell(values, summary["completati"]).rjust(24)
+        print(line)
+
+    baseline, candidate = summaries[0], summaries[-1]
+    for key, label in (("secondi", "tempo di modello"), ("prompt_tokens", "token di prompt")):
+        before = baseline["totale_fasi"][key] / max(baseline["completati"], 1)
+        after = candidate["totale_fasi"][key] / max(candidate["completati"], 1)
+        if before:
+            print(f"Risparmio {label} ({candidate['modalita']} vs {baseline['modalita']}): "
+                  f"{(1 - after / before) * 100:.0f}%")
+
+
+def run_batch(args) -> int:
+    from .models.currency_manager import CurrencyConversionManager
+    from .models.receipt_store import ReceiptStore
+    from .services.async_runtime import AsyncRuntime
+    from .services.job_journal import JobJournal
+    from .services.receipt_analyzer import ReceiptAnalysisChain
+    from .services.result_cache import ResultCache
+    from .services.span_exporter import SpanExporter
+    from .utils.api_keys import get_openai_api_key
+
+    if not os.path.isdir(args.directory):
+        print(f"Cartella non trovata: {args.directory}", file=sys.stderr)
+        return 2
+    api_key = get_openai_api_key()
+    if api_key is None:
+        print("OPENAI_API_KEY non configurata (variabile d'ambiente, .env o api_key.txt)", file=sys.stderr)
+        return 2
+
+    paths = find_images(args.directory)
+    if not paths:
+        print(f"Nessuna immagine in {args.directory}")
+        return 0
+
+    logger = ConsoleLogger(args.verbose)
+    runtime = AsyncRuntime()
+    result_cache = None if args.no_cache else ResultCache(RESULT_CACHE_DB, RESULT_CACHE_MAX_BYTES)
+    store = ReceiptStore(args.db)
+    journal = None if args.no_journal else JobJournal(args.journal)
+    span_exporter = SpanExporter() if args.metrics else None
+    output = open(args.output, "a", encoding="utf-8") if args.output else None
+    client = runtime.openai_client(api_key)
+    vision_batcher = None
+    if args.ocr_batch > 1:
+        from .services.vision_batcher import VisionBatcher
+        vision_batcher = VisionBatcher(client, args.ocr_batch, args.ocr_window / 1000, logger.log_action,
+                                       runtime.openai_limiter)
+    try:
+        processor = BatchProcessor(
+            runtime=runtime,
+            analysis_chain=ReceiptAnalysisChain(runtime=runtime, api_key=api_key, logger=logger.log_action),
+            currency_manager=CurrencyConversionManager(logger, runtime=runtime, interactive=False),
+            store=store,
+            result_cache=result_cache,
+            client=client,
+            workers=args.workers,
+            output=output,
+            logger=logger,
+            mode=args.mode,
+            vision_batcher=vision_batcher,
+            journal=journal,
+            span_exporter=span_exporter
+        )
+        print(f"Elaborazione di {len(paths)} scontrini con {processor.workers} worker...")
+        summary = processor.run(paths)
+        print_summary(summary)
+        if args.excel:
+            store.export_excel(args.excel)
+            print(f"Excel esportato in {args.excel}")
+        return 1 if summary["falliti"] else 0
+    finally:
+        if output is not None:
+            output.close()
+        runtime.shutdown()
+        if result_cache is not None:
+            result_cache.close()
+        if journal is not None:
+            journal.close()
+        if span_exporter is not None:
+            span_exporter.close()
+        store.close()
+
+
+def run_compare(args) -> int:
+    """Elabora la cartella in entrambe le modalità, senza cache né archivio, e confronta le fasi."""
+    from .models.currency_manager import CurrencyConversionManager
+    from .services.async_runtime import AsyncRuntime
+    from .services.receipt_analyzer import ReceiptAnalysisChain
+    from .utils.api_keys import get_openai_api_key
+
+    api_key = get_openai_api_key()
+    if api_key is None:
+        print("OPENAI_API_KEY non configurata (variabile d'ambiente, .env o api_key.txt)", file=sys.stderr)
+        return 2
+    paths = find_images(args.directory) if os.path.isdir(args.directory) else []
+    if not paths:
+        print(f"Nessuna immagine in {args.directory}", file=sys.stderr)
+        return 2
+
+    logger = ConsoleLogger(args.verbose)
+    runtime = AsyncRuntime()
+    try:
+        analysis_chain = ReceiptAnalysisChain(runtime=runtime, api_key=api_key, logger=logger.log_action)
+        currency_manager = CurrencyConversionManager(logger, runtime=runtime, interactive=False)
+        summaries = []
+        for mode in EXTRACTION_MODES:
+            processor = BatchProcessor(runtime, analysis_chain, currency_manager, store=None,
+                                       client=runtime.openai_client(api_key), workers=args.workers,
+                                       logger=logger, mode=mode)
+            summaries.append(processor.run(paths))
+            print_summary(summaries[-1])
+        print_comparison(summaries)
+        return 0
+    finally:
+        runtime.shutdown()
+
+
+def run_cache(args) -> int:
+    from .services.result_cache import ResultCache
+
+    cache = ResultCache(RESULT_CACHE_DB, RESULT_CACHE_MAX_BYTES)
+    try:
+        if args.action == "list":
+            for entry in cache.list_entries(args.image):
+                print(json.dumps(entry, ensure_ascii=False))
+        else:
+            removed = cache.purge(args.image, args.stage)
+            print(f"Rimosse {removed} voci dalla cache")
+        return 0
+    finally:
+        cache.close()
+
+
+def run_bench(args) -> int:
+    """Benchmark offline contro servizi finti; il risultato è salvato e confrontato con il precedente."""
+    from .benchmark.harness import compare, latest_result, print_report, run_benchmark, save_result
+
+    try:
+        sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    except ValueError:
+        print(f"Dimensioni non valide: {args.sizes}", file=sys.stderr)
+        return 2
+    latency = {"openai": args.openai_ms / 1000, "fx": args.fx_ms / 1000, "geocoding": args.geocoding_ms / 1000}
+    results = run_benchmark(sizes, latency, jitter=args.jitter, error_rate=args.error_rate,
+                            workers=args.workers, mode=args.mode, seed=args.seed)
+    previous = latest_result(results["config"], args.output_dir)
+    changes = compare(results, previous[1]) if previous else None
+    print_report(results, changes)
+    if previous:
+        print(f"\nConfronto con {previous[0]}")
+    print(f"Risultati salvati in {save_result(results, args.output_dir)}")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="receipt_analyzer", description="Analizzatore Scontrini")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    batch = commands.add_parser("batch", help="Elabora tutti gli scontrini di una cartella")
+    batch.add_argument("directory", help="Cartella con le immagini degli scontrini")
+    batch.add_argument("--workers", type=int, default=MAX_CONCURRENT_WORKERS,
+                       help="Scontrini elaborati contemporaneamente")
+    batch.add_argument("--db", default=RECEIPTS_DB, help="Archivio SQLite in cui salvare le righe")
+    batch.add_argument("--output", help="File JSON Lines con i risultati completi")
+    batch.add_argument("--excel", help="Esporta l'archivio in Excel al termine")
+    batch.add_argument("--no-cache", action="store_true", help="Non usare la cache dei risultati")
+    batch.add_argument("--mode", choices=EXTRACTION_MODES, default=EXTRACTION_MODE,
+                       help="Pipeline a più fasi o estrazione in un solo passaggio")
+    batch.add_argument("--ocr-batch", type=int, default=VISION_BATCH_SIZE,
+                       help="Immagini per chiamata vision (1 = una chiamata per scontrino)")
+    batch.add_argument("--ocr-window", type=int, default=VISION_BATCH_WINDOW_MS,
+                       help="Millisecondi di attesa massima per completare un lotto OCR")
+    batch.add_argument("--journal", default=JOBS_DB,
+                       help="Giornale dei job: un batch interrotto riprende dalle fasi completate")
+    batch.add_argument("--no-journal", action="store_true", help="Non registrare le fasi completate")
+    batch.add_argument("--metrics", action="store_true",
+                       help="Esporta gli span delle fasi in data/metrics (JSON Lines e Prometheus)")
+    batch.add_argument("-v", "--verbose", action="store_true", help="Mostra i passaggi della pipeline")
+    batch.set_defaults(handler=run_batch)
+
+    compare = commands.add_parser("compare", help="Confronta latenza e token delle modalità di estrazione")
+    compare.add_argument("directory", help="Cartella con le immagini degli scontrini")
+    compare.add_argument("--workers", type=int, default=MAX_CONCURRENT_WORKERS,
+                         help="Scontrini elaborati contemporaneamente")
+    compare.add_argument("-v", "--verbose", action="store_true", help="Mostra i passaggi della pipeline")
+    compare.set_defaults(handler=run_compare)
+
+    cache = commands.add_parser("cache", help="Ispeziona o svuota la cache dei risultati")
+    cache.add_argument("action", choices=["list", "purge"])
+    cache.add_argument("--image", help="Hash dell'immagine")
+    cache.add_argument("--stage", help="Fase (ocr, analysis, validation, categorization)")
+    cache.set_defaults(handler=run_cache)
+
+    bench = commands.add_parser("bench", help="Benchmark offline della pipeline con servizi finti")
+    bench.add_argument("--sizes", default=",".join(str(size) for size in BENCHMARK_SIZES),
+                       help="Dimensioni dei corpus sintetici, separate da virgola")
+    bench.add_argument("--workers", type=int, default=MAX_CONCURRENT_WORKERS,
+                       help="Scontrini elaborati contemporaneamente")
+    bench.add_argument("--mode", choices=EXTRACTION_MODES, default=EXTRACTION_MODE,
+                       help="Pipeline a più fasi o estrazione in un solo passaggio")
+    bench.add_argument("--openai-ms", type=float, default=50, help="Latenza del finto OpenAI (ms)")
+    bench.add_argument("--fx-ms", type=float, default=20, help="Latenza dei finti provider di cambio (ms)")
+    bench.add_argument("--geocoding-ms", type=float, default=30, help="Latenza del finto Nominatim (ms)")
+    bench.add_argument("--jitter", type=float, default=0.2, help="Variazione relativa delle latenze")
+    bench.add_argument("--error-rate", type=float, default=0.0,
+                       help="Frazione di richieste a cui i servizi rispondono 500")
+    bench.add_argument("--seed", type=int, default=0, help="Seme di corpus ed errori")
+    bench.add_argument("--output-dir", default=BENCHMARK_DIR, help="Cartella dei risultati JSON")
+    bench.set_defaults(handler=run_bench)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
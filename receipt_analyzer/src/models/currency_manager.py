@@ -3,36 +3,49 @@ Automatically generated file from migration script.
 """
 
 
-import os
-
-from PyQt5.QtWidgets import (
-     QInputDialog, QMessageBox, QLineEdit
-)
-
-
-import requests
+import asyncio
+import weakref
 import time
-from forex_python.converter import CurrencyRates
+from datetime import date, timedelta
+from typing import Iterable, List, Optional
+
+from .rate_graph import RateGraph, fallback_graph
+from .rate_store import RateStore
+from ..services.async_runtime import http_session
+from ..services.fx_providers import FxProvider, HedgedRateLookup
+from ..utils.api_keys import EXCHANGE_KEY_FILE, get_exchange_api_key, get_fixer_api_key, is_valid_exchange_key
+from ..utils.config import (FX_RATES_DB, FX_BASE_CURRENCY, FX_CACHE_TTL, FX_HISTORY_URL,
+                            FX_BACKFILL_DAYS, FX_MAX_GAP_DAYS, FX_API_URL, FX_OPEN_URL,
+                            FX_FOREX_URL, FX_FIXER_URL)
 
 
 class CurrencyConversionManager:
     """Gestisce le conversioni di valuta usando multiple fonti."""
 
-    def __init__(self, processor):
-
-        self.conversion_rates = {}
-        self.sources = [
-            self.try_exchangerate_api,
-            self.try_forex_python,
-            self.try_fixer_io,
-            self.get_fallback_rate
-        ]
-        self.last_update = {}
-        self.update_interval = 3600  # 1 ora
+    def __init__(self, processor, runtime=None, rate_store: Optional[RateStore] = None,
+                 interactive: bool = True):
+
+        self.runtime = runtime
+        self._rate_store = rate_store
+        self._tables = {}  # (base, data) -> tabella in memoria
+        self._table_locks = weakref.WeakKeyDictionary()
+        self.cache_ttl = FX_CACHE_TTL
+        self.api_url = FX_API_URL
+        self.open_url = FX_OPEN_URL
+        self.history_url = FX_HISTORY_URL
+        self.forex_url = FX_FOREX_URL
+        self.fixer_url = FX_FIXER_URL
+        self.fixer_api_key = get_fixer_api_key()
+        self.cache_stats = {"hit": 0, "miss": 0, "fetch": 0}
+        # Provider interrogati in parallelo quando la tabella del giorno non basta
+        self.provider_lookup = HedgedRateLookup(log=lambda message: self.logger.log_action(message))
         self.logger = processor
         #self.logger.log_action("dajie")
         try:
-            self.exchange_api_key = self.load_or_get_exchange_api_key(processor, allow_skip=True)
+            # Senza interfaccia la chiave si legge solo da ambiente/configurazione
+            self.exchange_api_key = get_exchange_api_key()
+            if self.exchange_api_key is None and interactive:
+                self.exchange_api_key = self.load_or_get_exchange_api_key(processor, allow_skip=True)
             if self.exchange_api_key is None:
                 self.logger.log_action("Exchange Rate API key non configurata. Verranno usati i tassi di fallback.")
             else:
@@ -52,11 +65,10 @@ class CurrencyConversionManager:
         Returns:
             str: API key valida o None se saltato
         """
-        api_key_file = "exchange_api_key.txt"
+        from PyQt5.QtWidgets import QInputDialog, QMessageBox, QLineEdit
 
-        def is_valid_api_key(key):
-            """Verifica se l'API key ha il formato corretto"""
-            return len(key) >= 24
+        api_key_file = EXCHANGE_KEY_FILE
+        is_valid_api_key = is_valid_exchange_key
 
         def save_api_key(key):
             try:
@@ -67,14 +79,9 @@ class CurrencyConversionManager:
                 print(f"Errore nel salvare l'API key di Exchange: {str(e)}")
                 return False
 
-        try:
-            if os.path.exists(api_key_file):
-                with open(api_key_file, "r") as f:
-                    api_key = f.read().strip()
-                    if is_valid_api_key(api_key):
-                        return api_key
-        except Exception as e:
-            print(f"Errore nella lettura dell'API key di Exchange: {str(e)}")
+        api_key = get_exchange_api_key()
+        if api_key:
+            return api_key
 
         # Messaggio per chiedere se si vuole inserire la chiave
         if allow_skip:
@@ -119,35 +126,8 @@ class CurrencyConversionManager:
 
 
     def get_fallback_rate(self, from_currency, to_currency):
-        """Ottiene un tasso di fallback in caso di fallimento della richiesta online."""
-        fallback_rates = {
-            ('USD', 'EUR'): 0.85,
-            ('EUR', 'USD'): 1.18,
-            # Medio Oriente
-            ('USD', 'AED'): 3.67,  # Dirham degli Emirati Arabi Uniti
-            ('AED', 'USD'): 0.27,
-            ('USD', 'SAR'): 3.75,  # Riyal Saudita
-            ('SAR', 'USD'): 0.27,
-            ('USD', 'OMR'): 0.38,  # Rial omanita
-            ('OMR', 'USD'): 2.60,
-            # Indonesia
-            ('USD', 'IDR'): 14300.00,  # Rupia indonesiana
-            ('IDR', 'USD'): 0.000070,
-            # Asia Centrale
-            ('USD', 'KZT'): 425.50,  # Tenge kazaco
-            ('KZT', 'USD'): 0.0024,
-            ('USD', 'UZS'): 10500.00,  # Sum uzbeko
-            ('UZS', 'USD'): 0.000095,
-            # Altre conversioni utili
-            ('EUR', 'AED'): 4.32,
-            ('AED', 'EUR'): 0.23,
-            ('EUR', 'IDR'): 16900.00,
-            ('IDR', 'EUR'): 0.000059,
-            ('EUR', 'OMR'): 0.44,
-            ('OMR', 'EUR'): 2.27,
-        }
-
-        rate = fallback_rates.get((from_currency, to_currency))
+        """Tasso indicativo (FX_FALLBACK_RATES) in caso di fallimento delle richieste online."""
+        rate = fallback_graph().rate(from_currency, to_currency)
         if rate is not None:
             self.logger.log_action(f"Usato tasso di fallback: {rate} per {from_currency} a {to_currency}.")
         else:
@@ -155,74 +135,197 @@ class CurrencyConversionManager:
         return rate
 
 
-    def try_fixer_io(self, from_currency, to_currency):
-        """Tenta di ottenere il tasso di cambio da fixer.io."""
-        api_key = "api_key_fixer"  # Sostituisci con la tua chiave API
-        url = f"http://data.fixer.io/api/latest?access_key={api_key}&base={from_currency}&symbols={to_currency}"
+    def fixer_params(self, from_currency, to_currency) -> dict:
+        # Senza chiave configurata fixer.io risponde con un errore
+        return {"access_key": self.fixer_api_key or "api_key_fixer", "base": from_currency,
+                "symbols": to_currency}
+
+    @property
+    def rate_store(self) -> RateStore:
+        """Archivio persistente dei tassi, aperto al primo utilizzo."""
+        if self._rate_store is None:
+            self._rate_store = RateStore(FX_RATES_DB)
+        return self._rate_store
+
+    def _table_lock(self) -> asyncio.Lock:
+        """Lock per evitare che più scontrini scarichino la stessa tabella insieme."""
+        loop = asyncio.get_running_loop()
+        lock = self._table_locks.get(loop)
+        if lock is None:
+            lock = self._table_locks[loop] = asyncio.Lock()
+        return lock
+
+    async def fetch_rate_table(self, base: str = FX_BASE_CURRENCY) -> tuple:
+        """Scarica con una sola chiamata la tabella completa dei tassi per la valuta base."""
+        if self.exchange_api_key:
+            url = f"{self.api_url}/{self.exchange_api_key}/latest/{base}"
+            field, source_name = "conversion_rates", "ExchangeRate-API"
+        else:
+            # Endpoint pubblico dello stesso provider, non richiede chiave
+            url = f"{self.open_url}/latest/{base}"
+            field, source_name = "rates", "ExchangeRate-API (open)"
 
         try:
-            response = requests.get(url)
-            response.raise_for_status()  # Solleva un errore per risposte HTTP errate
-            data = response.json()
-
-            if data.get("success"):
-                rate = data['rates'][to_currency]
-                self.logger.log_action(f"Tasso ottenuto da fixer.io: {rate} per {from_currency} a {to_currency}.")
-                return rate
-            else:
-                self.logger.log_action("Errore nella risposta di fixer.io.")
+            async with http_session(self.runtime, "fx") as session:
+                async with session.get(url) as response:
+                    if response.status != 200:
+                        self.logger.log_action(f"Tabella tassi {base}: errore {response.status}")
+                        return None, None
+                    data = await response.json()
+                    rates = data.get(field)
+                    if rates:
+                        self.cache_stats["fetch"] += 1
+                        self.logger.log_action(f"Scaricata tabella tassi {base} ({len(rates)} valute) da {source_name}")
+                        return rates, source_name
         except Exception as e:
-            self.logger.log_action(f"Errore durante la richiesta a fixer.io: {str(e)}")
-        return None  # Ritorna None in caso di errore
+            self.logger.log_action(f"Errore nel download della tabella tassi {base}: {str(e)}")
+        return None, None
 
-    def convert_currency(self, amount, from_currency, to_currency):
-        """Converte la valuta usando il tasso appropriato."""
-        try:
-            rate = self.try_fixer_io(from_currency, to_currency)
-            if rate is None:
-                rate = self.get_fallback_rate(from_currency, to_currency)
-                self.logger.log_action(f"Usando tasso di fallback per {from_currency} a {to_currency}: {rate}")
-            else:
-                self.logger.log_action(f"Usando tasso da fixer.io per {from_currency} a {to_currency}: {rate}")
+    async def get_rate_table(self, base: str = FX_BASE_CURRENCY) -> tuple:
+        """
+        Restituisce la tabella dei tassi del giorno: memoria, poi disco, poi provider.
 
-            if rate is None:
-                self.logger.log_action(f"Nessun tasso di conversione disponibile per {from_currency} a {to_currency}")
-                return amount
+        Returns:
+            tuple: (tabella o None, True se servita dalla cache)
+        """
+        key = (base, time.strftime("%Y-%m-%d"))
+
+        def fresh(table):
+            return table is not None and time.time() - table["fetched_at"] < self.cache_ttl
+
+        if fresh(self._tables.get(key)):
+            return self._tables[key], True
+
+        async with self._table_lock():
+            # Un altro scontrino potrebbe averla scaricata mentre aspettavamo
+            if fresh(self._tables.get(key)):
+                return self._tables[key], True
+
+            table = self.rate_store.get_table(base, key[1], max_age=self.cache_ttl)
+            from_cache = table is not None
+            if table is None:
+                rates, source_name = await self.fetch_rate_table(base)
+                if not rates:
+                    return None, False
+                self.rate_store.save_table(base, rates, key[1], source_name)
+                table = {"rates": rates, "source": source_name, "fetched_at": time.time()}
+
+            self._tables[key] = table
+            return table, from_cache
+
+    @staticmethod
+    def rate_from_table(rates: dict, base: str, from_currency: str, to_currency: str) -> Optional[float]:
+        """Calcola il tasso from -> to da una tabella espressa rispetto alla valuta base."""
+        from_value = 1.0 if from_currency == base else rates.get(from_currency)
+        to_value = 1.0 if to_currency == base else rates.get(to_currency)
+        if not from_value or not to_value:
+            return None
+        return to_value / from_value
+
+    async def get_cached_rate(self, from_currency: str, to_currency: str = "EUR") -> tuple:
+        """Tasso dalla tabella del giorno condivisa da tutti gli scontrini del batch."""
+        table, from_cache = await self.get_rate_table(FX_BASE_CURRENCY)
+        rate = None
+        if table is not None:
+            # Tabella del giorno come array indicizzato per valuta, costruito una volta per tabella
+            if "graph" not in table:
+                table["graph"] = RateGraph(table["rates"], FX_BASE_CURRENCY)
+            rate = table["graph"].rate(from_currency, to_currency)
+
+        if rate is None:
+            self.cache_stats["miss"] += 1
+            return None, None
 
-            converted_amount = amount * rate
-            self.logger.log_action(
-                f"Conversione completata: {amount} {from_currency} = {converted_amount} {to_currency}")
-            return converted_amount
+        self.cache_stats["hit" if from_cache else "miss"] += 1
+        return rate, f"Cache FX ({table['source']})"
 
+    async def fetch_rate_series(self, start: str, end: str, base: str = FX_BASE_CURRENCY) -> dict:
+        """Scarica con una sola richiesta i tassi storici di tutte le date nell'intervallo."""
+        url = f"{self.history_url}/{start}..{end}"
+        try:
+            async with http_session(self.runtime, "fx") as session:
+                async with session.get(url, params={"from": base}) as response:
+                    if response.status != 200:
+                        self.logger.log_action(f"Serie storica {start}..{end}: errore {response.status}")
+                        return {}
+                    data = await response.json()
+                    self.cache_stats["fetch"] += 1
+                    return data.get("rates", {})
         except Exception as e:
-            self.logger.log_action(f"Errore nella conversione: {str(e)}")
-            return amount
+            self.logger.log_action(f"Errore nel download della serie storica {start}..{end}: {str(e)}")
+        return {}
+
+    async def backfill(self, dates: Iterable[str], base: str = FX_BASE_CURRENCY) -> int:
+        """
+        Riempie la tabella storica per tutte le date indicate con una sola richiesta
+        sull'intervallo che le copre.
+
+        Returns:
+            int: Numero di tabelle giornaliere salvate.
+        """
+        today = date.today().isoformat()
+        missing = sorted({d for d in dates if d and d < today
+                          and self.rate_store.find_table(base, d, FX_MAX_GAP_DAYS) is None})
+        if not missing:
+            return 0
+
+        # Qualche giorno in più prima della prima data copre weekend e festivi
+        start = (date.fromisoformat(missing[0]) - timedelta(days=FX_MAX_GAP_DAYS)).isoformat()
+        tables = await self.fetch_rate_series(start, missing[-1], base)
+        if tables:
+            self.rate_store.save_tables(base, tables, "BCE (Frankfurter)")
+            self.logger.log_action(f"Tassi storici salvati: {len(tables)} giorni ({start}..{missing[-1]})")
+        return len(tables)
+
+    async def get_historical_rate(self, from_currency: str, to_currency: str, rate_date: str) -> tuple:
+        """
+        Tasso alla data dello scontrino dalla tabella storica locale.
+
+        Se la data non è coperta scarica una finestra di FX_BACKFILL_DAYS giorni
+        intorno ad essa, così gli scontrini vicini non richiedono altre chiamate.
+
+        Returns:
+            tuple: (tasso, fonte, data della tabella usata) oppure (None, None, None).
+        """
+        base = FX_BASE_CURRENCY
+        table = self.rate_store.find_table(base, rate_date, FX_MAX_GAP_DAYS)
+        if table is None:
+            async with self._table_lock():
+                table = self.rate_store.find_table(base, rate_date, FX_MAX_GAP_DAYS)
+                if table is None:
+                    day = date.fromisoformat(rate_date)
+                    window = [(day + timedelta(days=offset)).isoformat()
+                              for offset in (-FX_BACKFILL_DAYS, 0, FX_BACKFILL_DAYS)]
+                    await self.backfill(window, base)
+                    table = self.rate_store.find_table(base, rate_date, FX_MAX_GAP_DAYS)
+                    self.cache_stats["miss"] += 1
+                else:
+                    self.cache_stats["hit"] += 1
+        else:
+            self.cache_stats["hit"] += 1
+
+        if table is None:
+            return None, None, None
+
+        rate = self.rate_from_table(table["rates"], base, from_currency.upper(), to_currency.upper())
+        if rate is None:
+            return None, None, None
+        return rate, f"Storico {table['date']} ({table['source']})", table["date"]
 
     async def get_conversion_rate(self, from_currency: str, to_currency: str = "EUR") -> tuple:
-        """Ottiene il tasso di conversione dalla fonte più affidabile disponibile."""
+        """
+        Ottiene il tasso di conversione dalla fonte più affidabile disponibile.
+
+        La cache è la tabella del giorno (memoria e RateStore); i tassi dei
+        provider e di fallback non sono memorizzati, così un provider tornato
+        disponibile è usato subito.
+        """
         try:
-            key = f"{from_currency}_{to_currency}"
-            current_time = time.time()
-
-            # Controlla se abbiamo un tasso recente
-            if (key in self.conversion_rates and
-                    current_time - self.last_update.get(key, 0) < self.update_interval):
-                return self.conversion_rates[key]
-
-            # Prova ogni fonte in ordine
-            for source in self.sources:
-                try:
-                    rate, source_name = await source(from_currency, to_currency)
-                    if rate:
-                        self.conversion_rates[key] = {
-                            "rate": rate,
-                            "source": source_name,
-                            "timestamp": current_time
-                        }
-                        self.last_update[key] = current_time
-                        return self.conversion_rates[key]
-                except:
-                    continue
+            rate, source_name = await self.get_cached_rate(from_currency, to_currency)
+            if not rate:
+                rate, source_name = await self.lookup_rate(from_currency, to_currency)
+            if rate:
+                return {"rate": rate, "source": source_name, "timestamp": time.time()}
 
             raise ValueError(f"Nessuna fonte disponibile per la conversione {from_currency} -> {to_currency}")
 
@@ -237,9 +340,8 @@ class CurrencyConversionManager:
             return None, None
 
         try:
-            import aiohttp
-            async with aiohttp.ClientSession() as session:
-                url = f"https://v6.exchangerate-api.com/v6/{self.exchange_api_key}/pair/{from_currency}/{to_currency}"
+            async with http_session(self.runtime, "fx") as session:
+                url = f"{self.api_url}/{self.exchange_api_key}/pair/{from_currency}/{to_currency}"
                 async with session.get(url) as response:
                     if response.status == 200:
                         data = await response.json()
@@ -254,13 +356,50 @@ class CurrencyConversionManager:
             self.logger.log_action(f"Errore ExchangeRate API: {str(e)}")
         return None, None
 
-    async def try_forex_python(self, from_currency: str, to_currency: str) -> tuple:
-        """Prova a usare Forex-Python."""
-        try:
+    def fx_providers(self) -> List[FxProvider]:
+        """Provider online utilizzabili con la configurazione corrente."""
+        providers = []
+        if self.exchange_api_key:
+            providers.append(FxProvider("ExchangeRate API", self.fetch_exchangerate_pair))
+        providers.append(FxProvider("Forex Python", self.fetch_forex_python))
+        if self.fixer_api_key:
+            providers.append(FxProvider("Fixer.io", self.fetch_fixer_io))
+        return providers
+
+    async def lookup_rate(self, from_currency: str, to_currency: str = "EUR") -> tuple:
+        """
+        Tasso dai provider online, interrogati in parallelo con scadenze
+        (HedgedRateLookup); se nessuno risponde in tempo, tasso di fallback.
 
-            c = CurrencyRates()
-            rate = c.get_rate(from_currency, to_currency)
-            return rate, "Forex-Pythonfrom langchain.prompts import PromptTemplate"
-        except:
-            return None, None
+        Returns:
+            tuple: (tasso, fonte) oppure (None, None).
+        """
+        rate, source_name = await self.provider_lookup.lookup(self.fx_providers(), from_currency, to_currency)
+        if rate:
+            return rate, source_name
+        rate = self.get_fallback_rate(from_currency, to_currency)
+        return (rate, "Fallback") if rate else (None, None)
+
+    async def fetch_exchangerate_pair(self, from_currency: str, to_currency: str) -> Optional[float]:
+        rate, _ = await self.try_exchangerate_api(from_currency, to_currency)
+        return rate
 
+    async def fetch_forex_python(self, from_currency: str, to_currency: str) -> Optional[float]:
+        """Tasso dalla sorgente di forex-python, con la sessione asincrona condivisa."""
+        async with http_session(self.runtime, "fx") as session:
+            params = {"base": from_currency, "symbols": to_currency, "rtype": "fpy"}
+            async with session.get(f"{self.forex_url}/latest", params=params) as response:
+                if response.status != 200:
+                    raise ValueError(f"errore {response.status}")
+                data = await response.json(content_type=None)
+        return (data.get("rates") or {}).get(to_currency)
+
+    async def fetch_fixer_io(self, from_currency: str, to_currency: str) -> Optional[float]:
+        async with http_session(self.runtime, "fx") as session:
+            params = self.fixer_params(from_currency, to_currency)
+            async with session.get(f"{self.fixer_url}/latest", params=params) as response:
+                response.raise_for_status()
+                data = await response.json(content_type=None)
+        if not data.get("success"):
+            raise ValueError("risposta non valida di fixer.io")
+        return data["rates"].get(to_currency)
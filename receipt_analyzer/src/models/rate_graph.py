@@ -0,0 +1,84 @@
+from functools import lru_cache
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence
+
+import numpy as np
+
+from ..utils.config import FX_FALLBACK_BASE, FX_FALLBACK_RATES
+
+# Codici non ISO letti sugli scontrini
+ALIASES = {"RO": "OMR", "RIAL": "OMR"}
+
+
+def normalize_code(currency: str) -> str:
+    code = str(currency or "").strip().upper()
+    return ALIASES.get(code, code)
+
+
+class RateGraph:
+    """
+    Tassi di tutte le valute rispetto a una valuta base, in un array numpy
+    indicizzato dal codice ISO.
+
+    `values[i]` sono le unità della valuta `codes[i]` per 1 unità della
+    base: il tasso A -> B è `values[B] / values[A]`, cioè la coppia è
+    triangolata attraverso la base (USD per i tassi indicativi, EUR per la
+    tabella del giorno), senza elencare le coppie.
+
+    `convert` serve dove gli importi arrivano già in blocco (import
+    dell'Excel). Gli scontrini della pipeline, anche nel batch da riga di
+    comando, arrivano uno alla volta e ciascuno col tasso della propria data:
+    lì basta `rate`, una lettura nell'array.
+    """
+
+    def __init__(self, table: Mapping[str, float], base: str = FX_FALLBACK_BASE):
+        self.base = normalize_code(base)
+        rates = {normalize_code(code): float(rate) for code, rate in table.items() if rate}
+        rates[self.base] = 1.0
+        self.codes: List[str] = sorted(rates)
+        self.index: Dict[str, int] = {code: i for i, code in enumerate(self.codes)}
+        # Ultima posizione NaN: le valute sconosciute (indice -1) producono NaN senza controlli
+        self._values = np.array([rates[code] for code in self.codes] + [np.nan], dtype=np.float64)
+
+    @property
+    def values(self) -> np.ndarray:
+        return self._values[:-1]
+
+    def __contains__(self, currency: str) -> bool:
+        return normalize_code(currency) in self.index
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def rate(self, from_currency: str, to_currency: str) -> Optional[float]:
+        """Tasso from -> to, o None se una delle due valute non è in tabella."""
+        source = self.index.get(normalize_code(from_currency))
+        target = self.index.get(normalize_code(to_currency))
+        if source is None or target is None:
+            return None
+        return float(self._values[target] / self._values[source])
+
+    def positions(self, currencies: Iterable[str]) -> np.ndarray:
+        """Indici nell'array dei codici dati (-1 se sconosciuti); ogni codice distinto è cercato una volta."""
+        unique, inverse = np.unique(np.asarray(list(currencies), dtype=object).astype(str), return_inverse=True)
+        lookup = np.array([self.index.get(normalize_code(code), -1) for code in unique], dtype=np.intp)
+        return lookup[inverse]
+
+    def convert(self, amounts: Sequence[float], currencies: Sequence[str],
+                to_currency: str = "EUR") -> np.ndarray:
+        """
+        Converte in `to_currency` un intero lotto di importi con una sola operazione vettoriale.
+
+        Returns:
+            np.ndarray: Importi convertiti; NaN dove la valuta non è in tabella.
+        """
+        amounts = np.asarray(amounts, dtype=np.float64)
+        if amounts.size == 0:
+            return amounts
+        target = self.index.get(normalize_code(to_currency), -1)
+        return amounts * (self._values[target] / self._values[self.positions(currencies)])
+
+
+@lru_cache(maxsize=1)
+def fallback_graph() -> RateGraph:
+    """Tabella dei tassi indicativi (FX_FALLBACK_RATES), condivisa e costruita una sola volta."""
+    return RateGraph(FX_FALLBACK_RATES, FX_FALLBACK_BASE)
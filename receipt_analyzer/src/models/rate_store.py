@@ -0,0 +1,130 @@
+import bisect
+import threading
+import time
+from datetime import date as date_cls
+from typing import Dict, Optional
+
+from ..utils.storage import open_database
+
+
+class RateStore:
+    """
+    Archivio persistente dei tassi di cambio, chiave (base, quote, data).
+
+    Ogni riga è il valore di 1 unità di `base` espresso in `quote`; una
+    tabella completa per una base e una data viene salvata in un'unica
+    transazione, così una sola chiamata al provider serve tutte le valute.
+    Le date disponibili per ogni base sono tenute in memoria in una lista
+    ordinata, così la tabella valida per una data qualsiasi si trova con
+    una ricerca binaria.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._dates = {}  # base -> lista ordinata delle date salvate
+        self._conn = open_database(db_path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS rates (
+                base TEXT NOT NULL,
+                quote TEXT NOT NULL,
+                date TEXT NOT NULL,
+                rate REAL NOT NULL,
+                source TEXT,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (base, quote, date)
+            )
+        """)
+        self._conn.commit()
+
+    def save_table(self, base: str, rates: Dict[str, float], date: str, source: str):
+        """Salva (o sostituisce) la tabella dei tassi di una base per una data."""
+        self.save_tables(base, {date: rates}, source)
+
+    def save_tables(self, base: str, tables: Dict[str, Dict[str, float]], source: str):
+        """Salva in un'unica transazione le tabelle di più date ({data: {quote: tasso}})."""
+        now = time.time()
+        rows = [(base, quote.upper(), date, float(rate), source, now)
+                for date, rates in tables.items()
+                for quote, rate in rates.items() if rate]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO rates (base, quote, date, rate, source, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+            dates = self._dates.get(base)
+            if dates is not None:
+                for date in tables:
+                    i = bisect.bisect_left(dates, date)
+                    if i == len(dates) or dates[i] != date:
+                        dates.insert(i, date)
+
+    def _series_dates(self, base: str) -> list:
+        """Date disponibili per una base, caricate dal database al primo accesso."""
+        with self._lock:
+            dates = self._dates.get(base)
+            if dates is None:
+                rows = self._conn.execute(
+                    "SELECT DISTINCT date FROM rates WHERE base = ? ORDER BY date", (base,)
+                ).fetchall()
+                dates = self._dates[base] = [row[0] for row in rows]
+            return dates
+
+    def find_table(self, base: str, date: str, max_gap_days: int) -> Optional[dict]:
+        """
+        Trova la tabella valida per una data: la più recente non successiva alla data
+        (i weekend e i festivi usano l'ultimo giorno lavorativo).
+
+        Returns:
+            dict: come `get_table`, con in più la chiave "date" della tabella usata.
+        """
+        dates = self._series_dates(base)
+        i = bisect.bisect_right(dates, date)
+        if i == 0:
+            return None
+
+        found = dates[i - 1]
+        gap = (date_cls.fromisoformat(date) - date_cls.fromisoformat(found)).days
+        if gap > max_gap_days:
+            return None
+
+        table = self.get_table(base, found)
+        if table is not None:
+            table["date"] = found
+        return table
+
+    def get_table(self, base: str, date: str, max_age: Optional[float] = None) -> Optional[dict]:
+        """
+        Restituisce la tabella salvata per (base, data).
+
+        Args:
+            max_age: Età massima in secondi; le tabelle più vecchie sono ignorate.
+
+        Returns:
+            dict: {"rates": {quote: tasso}, "source": ..., "fetched_at": ...} o None.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT quote, rate, source, fetched_at FROM rates WHERE base = ? AND date = ?",
+                (base, date)
+            ).fetchall()
+
+        if not rows:
+            return None
+
+        fetched_at = min(row[3] for row in rows)
+        if max_age is not None and time.time() - fetched_at > max_age:
+            return None
+
+        return {
+            "rates": {quote: rate for quote, rate, _, _ in rows},
+            "source": rows[0][2],
+            "fetched_at": fetched_at
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
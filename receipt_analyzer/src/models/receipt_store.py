@@ -0,0 +1,316 @@
+import os
+import re
+import threading
+import time
+from difflib import SequenceMatcher
+from typing import Callable, Dict, Iterator, List, Optional
+
+from ..agents.date_formatter import DateFormatterAgent
+from ..utils.config import MERCHANT_SIMILARITY
+from ..utils.storage import open_database
+
+# Colonne del database -> colonne dell'export Excel
+EXCEL_COLUMNS = {
+    "data": "Data",
+    "importo_originale": "Importo Originale",
+    "valuta": "Valuta",
+    "importo_eur": "Importo (EUR)",
+    "descrizione": "Descrizione",
+    "categoria": "Categoria",
+    "sottocategoria": "Sottocategoria",
+    "file": "File",
+}
+
+# Stessa chiave usata in passato da drop_duplicates sull'Excel
+UNIQUE_KEY = ("data", "importo_originale", "descrizione", "categoria", "sottocategoria")
+
+
+def result_to_row(data: Dict, file_path: str,
+                  convert: Optional[Callable[[float, str], float]] = None) -> Dict:
+    """
+    Risultato della pipeline -> riga della tabella (chiavi dell'interfaccia).
+
+    Args:
+        convert: Conversione in EUR usata se la pipeline non ha fornito `importo_eur`;
+            una riga alla volta, all'arrivo di ogni risultato.
+    """
+    # Estrazione dati base
+    raw_date = data.get("data") or data.get("date", "N/A")
+    formatted_date = DateFormatterAgent.format_date(raw_date)
+    valuta = data.get("valuta", "").upper().replace("RO", "OMR")
+
+    # Gestione importi
+    try:
+        importo = float(str(data.get("importo", 0)).replace(',', '.'))
+        # Usa la conversione fatta dalla pipeline; la tabella fissa resta come ripiego
+        if data.get("importo_eur") is not None:
+            importo_eur = round(float(data["importo_eur"]), 3)
+        elif convert is not None:
+            importo_eur = convert(importo, valuta)
+        else:
+            importo_eur = importo
+    except (ValueError, TypeError):
+        importo = 0.000
+        importo_eur = 0.000
+
+    # Gestione esercente e luogo
+    esercente = data.get("esercente", "")
+    luogo = data.get("luogo", "")
+    descrizione = f"{esercente} - {luogo}".strip(" -")
+
+    # Estrazione categoria e sottocategoria
+    categoria = "Altro"
+    sottocategoria = ""
+    if "categorization" in data and isinstance(data["categorization"], dict):
+        cat_data = data["categorization"].get("categoria", {})
+        if isinstance(cat_data, dict):
+            categoria = cat_data.get("categoria", "Altro")
+            sottocategoria = cat_data.get("sottocategoria", "")
+
+    return {
+        "Data": formatted_date,
+        "Importo": importo,
+        "Valuta": valuta,
+        "Importo (EUR)": importo_eur,
+        "Descrizione": descrizione,
+        "Categoria": categoria,
+        "Sottocategoria": sottocategoria,
+        "File": os.path.basename(file_path)
+    }
+
+
+def normalize_merchant(text: str) -> str:
+    """Descrizione confrontabile: minuscole, solo lettere e cifre, spazi singoli."""
+    return " ".join(re.sub(r"[^\w]+", " ", str(text).lower()).split())
+
+
+def merchant_similarity(a: str, b: str) -> float:
+    a, b = normalize_merchant(a), normalize_merchant(b)
+    if not a or not b:
+        return 0.0
+    return SequenceMatcher(None, a, b).ratio()
+
+
+class ReceiptStore:
+    """
+    Archivio append-only delle righe degli scontrini (fonte di verità).
+
+    Ogni inserimento è una singola transazione SQLite con costo costante;
+    i duplicati sono risolti dall'indice univoco invece che rileggendo e
+    riscrivendo tutto il file. L'Excel diventa un export generato su
+    richiesta.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = open_database(db_path)
+        self._conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS receipts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                data TEXT NOT NULL,
+                importo_originale REAL NOT NULL,
+                valuta TEXT,
+                importo_eur REAL NOT NULL,
+                descrizione TEXT NOT NULL DEFAULT '',
+                categoria TEXT NOT NULL DEFAULT '',
+                sottocategoria TEXT NOT NULL DEFAULT '',
+                file TEXT,
+                created_at REAL NOT NULL,
+                UNIQUE ({', '.join(UNIQUE_KEY)})
+            )
+        """)
+        # Ricerca dei duplicati sui dati estratti
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_receipts_lookup ON receipts (data, valuta, importo_originale)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _to_record(row: Dict) -> tuple:
+        """Converte una riga della tabella (chiavi dell'interfaccia) nei valori del database."""
+        def amount(value):
+            try:
+                return float(str(value).replace(',', '.'))
+            except (TypeError, ValueError):
+                return 0.0
+
+        return (
+            str(row.get("Data", "")),
+            amount(row.get("Importo", row.get("Importo Originale", 0))),
+            str(row.get("Valuta", "")),
+            amount(row.get("Importo (EUR)", 0)),
+            str(row.get("Descrizione", "") or ""),
+            str(row.get("Categoria", "") or ""),
+            str(row.get("Sottocategoria", "") or ""),
+            str(row.get("File", "") or ""),
+        )
+
+    def add(self, row: Dict) -> bool:
+        """
+        Aggiunge una riga. Se esiste già una riga con la stessa chiave, viene
+        aggiornata con i valori più recenti.
+
+        Returns:
+            bool: True se la riga è nuova, False se era un duplicato.
+        """
+        return self.add_many([row]) == 1
+
+    def add_many(self, rows: List[Dict]) -> int:
+        """Aggiunge più righe in un'unica transazione; restituisce quante erano nuove."""
+        inserted = 0
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                for row in rows:
+                    record = self._to_record(row)
+                    cursor = self._conn.execute(
+                        "INSERT OR IGNORE INTO receipts (data, importo_originale, valuta, importo_eur, "
+                        "descrizione, categoria, sottocategoria, file, created_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        record + (now,)
+                    )
+                    if cursor.rowcount:
+                        inserted += 1
+                    else:
+                        self._conn.execute(
+                            "UPDATE receipts SET valuta = ?, importo_eur = ?, file = ? "
+                            "WHERE data = ? AND importo_originale = ? AND descrizione = ? "
+                            "AND categoria = ? AND sottocategoria = ?",
+                            (record[2], record[3], record[7], record[0], record[1],
+                             record[4], record[5], record[6])
+                        )
+        return inserted
+
+    def find_similar(self, row: Dict, threshold: float = MERCHANT_SIMILARITY) -> Optional[Dict]:
+        """
+        Riga già archiviata che sembra lo stesso scontrino di `row`: stessi
+        data, valuta e importo (al centesimo) ed esercente simile almeno
+        `threshold`. La ricerca usa l'indice, non l'intero archivio.
+
+        Returns:
+            dict: La riga più simile (colonne dell'export), o None.
+        """
+        record = self._to_record(row)
+        data, importo, valuta, descrizione = record[0], record[1], record[2], record[4]
+        if not data or data == "N/A" or not importo:
+            return None
+        with self._lock:
+            candidates = self._conn.execute(
+                f"SELECT {', '.join(EXCEL_COLUMNS)} FROM receipts "
+                "WHERE data = ? AND valuta = ? AND importo_originale BETWEEN ? AND ?",
+                (data, valuta, importo - 0.005, importo + 0.005)
+            ).fetchall()
+
+        best, best_score = None, threshold
+        for candidate in candidates:
+            candidate = dict(zip(EXCEL_COLUMNS.values(), candidate))
+            score = merchant_similarity(descrizione, candidate["Descrizione"])
+            if score >= best_score:
+                best, best_score = candidate, score
+        return best
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM receipts").fetchone()[0]
+
+    def rows(self, offset: int = 0, limit: int = -1) -> List[Dict]:
+        """Righe in ordine di inserimento, con le colonne dell'export Excel."""
+        with self._lock:
+            cursor = self._conn.execute(
+                f"SELECT {', '.join(EXCEL_COLUMNS)} FROM receipts ORDER BY id LIMIT ? OFFSET ?",
+                (limit, offset)
+            )
+            return [dict(zip(EXCEL_COLUMNS.values(), record)) for record in cursor.fetchall()]
+
+    def iter_rows(self, chunk_size: int = 1000) -> Iterator[List[Dict]]:
+        """Restituisce le righe a blocchi, senza caricare l'intero archivio in memoria."""
+        offset = 0
+        while True:
+            chunk = self.rows(offset, chunk_size)
+            if not chunk:
+                return
+            yield chunk
+            offset += len(chunk)
+
+    def import_excel(self, excel_path: str) -> int:
+        """Importa le righe di un export Excel esistente (migrazione dal vecchio formato)."""
+        if not os.path.exists(excel_path):
+            return 0
+
+        import pandas as pd
+        df = pd.read_excel(excel_path)
+        df.columns = df.columns.str.strip()
+        self.fill_eur_amounts(df)
+        df = df.fillna("")
+        return self.add_many(df.to_dict(orient="records"))
+
+    @staticmethod
+    def fill_eur_amounts(df) -> int:
+        """
+        Converte in blocco, con i tassi indicativi, gli importi senza
+        controvalore in EUR (export parziali o modificati a mano).
+
+        Returns:
+            int: Numero di righe convertite.
+        """
+        if not {"Importo Originale", "Valuta"} <= set(df.columns):
+            return 0
+        import pandas as pd
+        from .rate_graph import fallback_graph
+
+        original = pd.to_numeric(df["Importo Originale"], errors="coerce")
+        eur = pd.to_numeric(df.get("Importo (EUR)", pd.Series(index=df.index, dtype=float)), errors="coerce")
+        missing = (eur.isna() & original.notna()).to_numpy()
+        if not missing.any():
+            return 0
+        # Una sola operazione vettoriale per tutto il foglio
+        converted = fallback_graph().convert(original.to_numpy()[missing],
+                                             df["Valuta"].fillna("").to_numpy()[missing], "EUR")
+        eur = eur.to_numpy(copy=True)
+        eur[missing] = converted.round(3)
+        df["Importo (EUR)"] = eur
+        return int((~pd.isna(converted)).sum())
+
+    def export_excel(self, excel_path: str, chunk_size: int = 5000) -> int:
+        """
+        Genera l'export Excel dall'archivio.
+
+        Returns:
+            int: Numero di righe esportate.
+        """
+        import xlsxwriter
+
+        os.makedirs(os.path.dirname(excel_path), exist_ok=True)
+        workbook = xlsxwriter.Workbook(excel_path, {"constant_memory": True})
+        worksheet = workbook.add_worksheet("Scontrini")
+
+        # Formati
+        header_format = workbook.add_format({'bold': True, 'border': 1})
+        money_format = workbook.add_format({'num_format': '#,##0.00'})
+        date_format = workbook.add_format({'num_format': 'dd/mm/yyyy'})
+
+        # Colonne
+        worksheet.set_column('A:A', 15, date_format)  # Data
+        worksheet.set_column('B:B', 15, money_format)  # Importo Originale
+        worksheet.set_column('C:C', 10)  # Valuta
+        worksheet.set_column('D:D', 15, money_format)  # Importo (EUR)
+        worksheet.set_column('E:E', 40)  # Descrizione
+        worksheet.set_column('F:F', 20)  # Categoria
+        worksheet.set_column('G:G', 25)  # Sottocategoria
+        worksheet.set_column('H:H', 25)  # file
+
+        worksheet.write_row(0, 0, list(EXCEL_COLUMNS.values()), header_format)
+
+        row_index = 1
+        for chunk in self.iter_rows(chunk_size):
+            for row in chunk:
+                worksheet.write_row(row_index, 0, list(row.values()))
+                row_index += 1
+
+        workbook.close()
+        return row_index - 1
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
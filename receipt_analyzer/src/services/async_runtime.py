@@ -0,0 +1,183 @@
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+import aiohttp
+import httpx
+
+from ..utils.config import HTTP_TOTAL_LIMIT, HTTP_LIMIT_PER_HOST, HTTP_TIMEOUT, OPENAI_BASE_URL
+from .rate_limiter import RateLimiter
+from .stage_metrics import record_request
+
+USER_AGENT = "AI_ricevute/1.0"
+
+
+def count_request(request: httpx.Request):
+    """Hook dei client httpx: byte inviati e tentativi (il client OpenAI numera i retry in un header)."""
+    size = len(str(request.url)) + int(request.headers.get("content-length") or 0)
+    record_request(size, retry=int(request.headers.get("x-stainless-retry-count") or 0) > 0)
+
+
+async def count_request_async(request: httpx.Request):
+    count_request(request)
+
+
+async def count_session_request(session, context, params):
+    """Hook delle sessioni aiohttp (FX, geocoding): richieste GET, conta l'URL."""
+    record_request(len(str(params.url)))
+
+
+class AsyncRuntime:
+    """
+    Event loop asyncio unico per tutta l'applicazione.
+
+    Il loop gira in un thread dedicato per l'intera vita dell'applicazione;
+    i worker gli sottomettono le coroutine con `run`. Le sessioni HTTP
+    (FX, geocoding, LLM) sono create una sola volta e riusano le connessioni
+    keep-alive, con un limite di connessioni per host.
+
+    Le chiamate OpenAI di tutti i worker passano da `openai_limiter`, che
+    legge i limiti del provider dalle risposte dei client HTTP condivisi;
+    i client OpenAI non ripetono da soli le richieste fallite.
+    """
+
+    def __init__(self, limit_per_host: int = HTTP_LIMIT_PER_HOST,
+                 total_limit: int = HTTP_TOTAL_LIMIT,
+                 timeout: float = HTTP_TIMEOUT):
+        self.limit_per_host = limit_per_host
+        self.total_limit = total_limit
+        self.timeout = timeout
+        self.openai_limiter = RateLimiter()
+
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+        self._openai_clients = {}
+        self._http_client: Optional[httpx.Client] = None
+        self._http_async_client: Optional[httpx.AsyncClient] = None
+        self._lock = threading.Lock()
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="AsyncRuntime", daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    @property
+    def is_running(self) -> bool:
+        return self.loop.is_running() and not self.loop.is_closed()
+
+    def run(self, coro, timeout: Optional[float] = None):
+        """Esegue una coroutine sul loop condiviso e attende il risultato (da un altro thread)."""
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        return future.result(timeout)
+
+    def session(self, name: str) -> aiohttp.ClientSession:
+        """
+        Restituisce la sessione aiohttp keep-alive del servizio indicato ("fx", "geocoding").
+
+        Va chiamato da una coroutine in esecuzione sul loop del runtime.
+        """
+        session = self._sessions.get(name)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.total_limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=300
+            )
+            trace = aiohttp.TraceConfig()
+            trace.on_request_start.append(count_session_request)
+            session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={"User-Agent": USER_AGENT},
+                trace_configs=[trace]
+            )
+            self._sessions[name] = session
+        return session
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.total_limit,
+            max_keepalive_connections=self.limit_per_host
+        )
+
+    @property
+    def http_client(self) -> httpx.Client:
+        """Client HTTP sincrono condiviso per le chiamate LLM fatte dai thread dei worker."""
+        with self._lock:
+            if self._http_client is None:
+                self._http_client = httpx.Client(limits=self._limits(), timeout=self.timeout,
+                                                 event_hooks={"request": [count_request],
+                                                              "response": [self._observe_limits]})
+            return self._http_client
+
+    @property
+    def http_async_client(self) -> httpx.AsyncClient:
+        """Client HTTP asincrono condiviso per le catene LangChain (usato solo su questo loop)."""
+        with self._lock:
+            if self._http_async_client is None:
+                self._http_async_client = httpx.AsyncClient(
+                    limits=self._limits(), timeout=self.timeout,
+                    event_hooks={"request": [count_request_async], "response": [self._observe_limits_async]}
+                )
+            return self._http_async_client
+
+    def _observe_limits(self, response: httpx.Response):
+        self.openai_limiter.observe_headers(response.headers)
+
+    async def _observe_limits_async(self, response: httpx.Response):
+        self.openai_limiter.observe_headers(response.headers)
+
+    def openai_client(self, api_key: str, base_url: Optional[str] = None):
+        """Restituisce un client OpenAI che riusa il pool di connessioni condiviso."""
+        import openai
+        base_url = base_url or OPENAI_BASE_URL
+        client = self._openai_clients.get((api_key, base_url))
+        if client is None:
+            # I tentativi sono gestiti da openai_limiter
+            client = openai.OpenAI(api_key=api_key, base_url=base_url, http_client=self.http_client,
+                                   max_retries=0)
+            self._openai_clients[(api_key, base_url)] = client
+        return client
+
+    async def _close_sessions(self):
+        for session in self._sessions.values():
+            if not session.closed:
+                await session.close()
+        self._sessions.clear()
+        if self._http_async_client is not None:
+            await self._http_async_client.aclose()
+            self._http_async_client = None
+
+    def shutdown(self, timeout: float = 10):
+        """Chiude le sessioni HTTP e ferma il loop. Da chiamare alla chiusura dell'applicazione."""
+        if self.loop.is_closed():
+            return
+        try:
+            self.run(self._close_sessions(), timeout)
+        except Exception as e:
+            print(f"Errore nella chiusura delle sessioni HTTP: {str(e)}")
+
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+        self.loop.close()
+
+        if self._http_client is not None:
+            self._http_client.close()
+            self._http_client = None
+        self._openai_clients.clear()
+
+
+@asynccontextmanager
+async def http_session(runtime: Optional[AsyncRuntime], name: str):
+    """
+    Fornisce la sessione condivisa del runtime, oppure una sessione temporanea
+    se il codice viene usato senza runtime (es. nei test).
+    """
+    if runtime is not None:
+        yield runtime.session(name)
+    else:
+        async with aiohttp.ClientSession(headers={"User-Agent": USER_AGENT}) as session:
+            yield session
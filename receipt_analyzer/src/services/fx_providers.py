@@ -0,0 +1,154 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from ..utils.config import FX_HEDGE_DELAY, FX_LOOKUP_DEADLINE, FX_PROVIDER_TIMEOUT
+
+# Peso dell'ultimo esito nelle medie mobili della salute dei provider
+HEALTH_WEIGHT = 0.3
+
+
+class FxProvider(NamedTuple):
+    name: str
+    # (valuta di partenza, valuta di arrivo) -> tasso, o None se non disponibile
+    fetch: Callable[[str, str], Awaitable[Optional[float]]]
+
+
+class ProviderHealth:
+    """
+    Salute di un provider: medie mobili esponenziali di esito e latenza.
+
+    Un provider mai interrogato parte con esito pieno e latenza nulla, così
+    viene provato; uno che fallisce o scade scende in fondo all'ordine ma
+    risale appena torna a rispondere. Uno annullato perché battuto da un
+    altro conta solo per il tempo già trascorso, limite inferiore della
+    sua latenza.
+    """
+
+    def __init__(self):
+        self.success = 1.0
+        self.latency = 0.0
+        self.calls = 0
+        self.failures = 0
+
+    def record(self, ok: bool, seconds: float):
+        self.calls += 1
+        self.failures += not ok
+        self.success += HEALTH_WEIGHT * ((1.0 if ok else 0.0) - self.success)
+        self.latency += HEALTH_WEIGHT * (seconds - self.latency)
+
+    def record_cancelled(self, seconds: float):
+        """Richiesta annullata dopo `seconds`: la latenza media può solo salire."""
+        self.calls += 1
+        if seconds > self.latency:
+            self.latency += HEALTH_WEIGHT * (seconds - self.latency)
+
+    @property
+    def score(self) -> float:
+        """Tra 0 e 1: probabilità di risposta, penalizzata dalla latenza (1 s dimezza il punteggio)."""
+        return self.success / (1.0 + self.latency)
+
+
+class HedgedRateLookup:
+    """
+    Cerca un tasso interrogando più provider in parallelo, con scadenze.
+
+    I provider sono ordinati per salute. Parte il primo; se entro
+    `hedge_delay` secondi non ha risposto (o ha già fallito) parte anche il
+    successivo, e così via: vince la prima risposta valida, le altre
+    richieste sono annullate. Ogni provider ha `timeout` secondi, l'intera
+    ricerca `deadline`. Va usato da un solo event loop.
+    """
+
+    def __init__(self, timeout: float = FX_PROVIDER_TIMEOUT, hedge_delay: float = FX_HEDGE_DELAY,
+                 deadline: float = FX_LOOKUP_DEADLINE, log: Optional[Callable[[str], None]] = None):
+        self.timeout = timeout
+        self.hedge_delay = hedge_delay
+        self.deadline = deadline
+        self.log = log or (lambda message: None)
+        self.health: Dict[str, ProviderHealth] = {}
+        self.stats = {"ricerche": 0, "coperture": 0, "senza_esito": 0}
+
+    def ordered(self, providers: Sequence[FxProvider]) -> List[FxProvider]:
+        """Provider dal più affidabile; a parità di punteggio resta l'ordine dato."""
+        return sorted(providers, key=lambda provider: -self._health(provider.name).score)
+
+    def _health(self, name: str) -> ProviderHealth:
+        return self.health.setdefault(name, ProviderHealth())
+
+    async def lookup(self, providers: Sequence[FxProvider], from_currency: str,
+                     to_currency: str) -> Tuple[Optional[float], Optional[str]]:
+        """
+        Returns:
+            tuple: (tasso, nome del provider) oppure (None, None) se nessuno risponde in tempo.
+        """
+        queue = self.ordered(providers)
+        if not queue:
+            return None, None
+        self.stats["ricerche"] += 1
+        loop = asyncio.get_running_loop()
+        end = loop.time() + self.deadline
+        pending = {}
+        expired = False
+
+        def launch():
+            provider = queue.pop(0)
+            task = asyncio.ensure_future(self._attempt(provider, from_currency, to_currency))
+            pending[task] = (provider, time.perf_counter())
+
+        launch()
+        try:
+            while pending:
+                remaining = end - loop.time()
+                if remaining <= 0:
+                    expired = True
+                    break
+                wait = min(self.hedge_delay, remaining) if queue else remaining
+                done, _ = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    provider, _ = pending.pop(task)
+                    rate = task.result()
+                    if rate:
+                        return rate, provider.name
+                if queue:
+                    # Risposta in ritardo o fallita: interroghiamo anche il successivo
+                    if not done:
+                        self.stats["coperture"] += 1
+                    launch()
+        finally:
+            now = time.perf_counter()
+            for task, (provider, started) in pending.items():
+                if task.done():
+                    continue  # Esito già registrato da `_attempt`
+                task.cancel()
+                if expired:
+                    self.log(f"{provider.name}: nessuna risposta entro la scadenza della ricerca")
+                    self._health(provider.name).record(False, now - started)
+                else:
+                    self._health(provider.name).record_cancelled(now - started)
+
+        self.stats["senza_esito"] += 1
+        return None, None
+
+    async def _attempt(self, provider: FxProvider, from_currency: str, to_currency: str) -> Optional[float]:
+        started = time.perf_counter()
+        try:
+            rate = await asyncio.wait_for(provider.fetch(from_currency, to_currency), self.timeout)
+        except asyncio.CancelledError:
+            # Battuto da un altro provider o scaduta la ricerca: la salute è registrata da `lookup`
+            raise
+        except asyncio.TimeoutError:
+            self.log(f"{provider.name}: nessuna risposta entro {self.timeout:.1f}s")
+            rate = None
+        except Exception as e:
+            self.log(f"Errore con {provider.name}: {str(e)}")
+            rate = None
+        self._health(provider.name).record(bool(rate), time.perf_counter() - started)
+        return rate
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        """Punteggio, esiti e latenza media di ogni provider, dal più affidabile."""
+        ranked = sorted(self.health.items(), key=lambda item: -item[1].score)
+        return {name: {"punteggio": round(health.score, 3), "chiamate": health.calls,
+                       "errori": health.failures, "latenza": round(health.latency, 3)}
+                for name, health in ranked}
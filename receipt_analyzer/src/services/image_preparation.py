@@ -0,0 +1,130 @@
+from typing import NamedTuple, Optional, Tuple
+
+from ..utils.config import (IMAGE_AUTO_CROP, IMAGE_FORMAT, IMAGE_GRAYSCALE, IMAGE_MAX_EDGE,
+                            IMAGE_QUALITY)
+from .result_cache import prompt_version
+
+# Cambia quando cambiano le impostazioni: invalida l'OCR in cache
+PREPARATION_VERSION = prompt_version(
+    str(IMAGE_MAX_EDGE), IMAGE_FORMAT, str(IMAGE_QUALITY), str(IMAGE_GRAYSCALE), str(IMAGE_AUTO_CROP)
+)
+
+# Il ritaglio è applicato solo se il contorno trovato è plausibile come scontrino
+MIN_CROP_AREA = 0.2
+CROP_MARGIN = 0.02
+
+
+class PreparedImage(NamedTuple):
+    data: bytes
+    mime: str
+    original_bytes: int
+    size: Optional[Tuple[int, int]]  # (larghezza, altezza) inviata, None se non decodificata
+    original_size: Optional[Tuple[int, int]]
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - len(self.data)
+
+
+def detect_mime(data: bytes) -> str:
+    """Tipo MIME dai primi byte del file (l'estensione non è affidabile)."""
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return "image/jpeg"
+
+
+def receipt_bounds(gray) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Rettangolo (x, y, w, h) dello scontrino: il contorno più grande dopo
+    la soglia di Otsu, di solito la carta chiara sullo sfondo.
+    """
+    import cv2
+
+    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+    _, mask = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    x, y, w, h = cv2.boundingRect(max(contours, key=cv2.contourArea))
+    height, width = gray.shape[:2]
+    if w * h < MIN_CROP_AREA * width * height or (w >= width and h >= height):
+        return None
+
+    margin_x, margin_y = int(width * CROP_MARGIN), int(height * CROP_MARGIN)
+    x0, y0 = max(0, x - margin_x), max(0, y - margin_y)
+    x1, y1 = min(width, x + w + margin_x), min(height, y + h + margin_y)
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def prepare_image(data: bytes, max_edge: int = IMAGE_MAX_EDGE, image_format: str = IMAGE_FORMAT,
+                  quality: int = IMAGE_QUALITY, grayscale: bool = IMAGE_GRAYSCALE,
+                  auto_crop: bool = IMAGE_AUTO_CROP) -> PreparedImage:
+    """
+    Prepara l'immagine per l'invio al modello vision: ritaglio sullo
+    scontrino, lato lungo ridotto a `max_edge`, scala di grigi e
+    ricompressione in JPEG o WebP.
+
+    Se l'immagine non si decodifica, o il risultato non è più piccolo
+    dell'originale, viene inviato l'originale con il suo tipo MIME.
+    """
+    original = PreparedImage(data, detect_mime(data), len(data), None, None)
+    try:
+        import cv2
+        import numpy as np
+
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            return original
+        height, width = image.shape[:2]
+        original = original._replace(size=(width, height), original_size=(width, height))
+
+        if grayscale:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        encoded, mime, size = encode_array(image, max_edge, image_format, quality, auto_crop)
+        if len(encoded) >= len(data):
+            return original
+        return PreparedImage(encoded, mime, len(data), size, original.original_size)
+    except Exception as e:
+        print(f"Errore nella preparazione dell'immagine: {str(e)}")
+        return original
+
+
+def encode_array(image, max_edge: int = IMAGE_MAX_EDGE, image_format: str = IMAGE_FORMAT,
+                 quality: int = IMAGE_QUALITY, auto_crop: bool = IMAGE_AUTO_CROP) -> Tuple[bytes, str, Tuple[int, int]]:
+    """
+    Ritaglio, riduzione e compressione di un'immagine già decodificata
+    (BGR o scala di grigi).
+
+    Returns:
+        tuple: (byte codificati, tipo MIME, (larghezza, altezza)).
+    """
+    import cv2
+
+    if auto_crop:
+        gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        bounds = receipt_bounds(gray)
+        if bounds is not None:
+            x, y, w, h = bounds
+            image = image[y:y + h, x:x + w]
+
+    height, width = image.shape[:2]
+    scale = max_edge / max(height, width)
+    if scale < 1:
+        image = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+
+    if image_format == "webp":
+        ok, encoded = cv2.imencode(".webp", image, [cv2.IMWRITE_WEBP_QUALITY, quality])
+        mime = "image/webp"
+    else:
+        ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        mime = "image/jpeg"
+    if not ok:
+        raise ValueError("Codifica dell'immagine non riuscita")
+
+    height, width = image.shape[:2]
+    return encoded.tobytes(), mime, (width, height)
@@ -0,0 +1,177 @@
+import json
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from ..utils.storage import open_database
+
+# Stati di un job oltre ai nomi delle fasi completate (ocr, analysis, fx, categorization, ...)
+QUEUED = "queued"
+PERSISTED = "persisted"
+FAILED = "failed"
+
+
+class Job(NamedTuple):
+    id: int
+    path: str
+    source: Optional[str]  # File originale, se `path` è la copia in archivio
+    priority: int
+    state: str
+
+
+class Enqueued(NamedTuple):
+    id: int
+    created: bool  # False se è stato riusato un job esistente
+    previous: Optional[Tuple[int, str, Optional[str]]] = None  # Priorità, stato ed errore del job riusato
+
+
+class JobJournal:
+    """
+    Giornale write-ahead dei job di ingestione.
+
+    Un job è registrato prima di entrare nella coda; ogni fase completata
+    ne salva il risultato e aggiorna lo stato, in una transazione SQLite.
+    Dopo una chiusura imprevista i job non conclusi (`unfinished`) vengono
+    ripresi: la pipeline riceve i risultati già salvati e non ripete quelle
+    fasi. A job salvato in archivio i risultati intermedi sono eliminati.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = open_database(db_path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                path TEXT NOT NULL,
+                source TEXT,
+                priority INTEGER NOT NULL DEFAULT 0,
+                state TEXT NOT NULL,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, path)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS stages (
+                job_id INTEGER NOT NULL,
+                stage TEXT NOT NULL,
+                value TEXT NOT NULL,
+                completed_at REAL NOT NULL,
+                PRIMARY KEY (job_id, stage)
+            )
+        """)
+        self._conn.commit()
+
+    def enqueue(self, path: str, priority: int = 0, source: Optional[str] = None) -> Enqueued:
+        """
+        Registra un job per `path`. Se per lo stesso file c'è già un job non
+        concluso (o fallito) viene riusato, con i risultati delle sue fasi.
+
+        Returns:
+            Enqueued: Id del job, se è stato creato ora e, per un job
+            riusato, lo stato precedente da ripristinare con `withdraw`.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT id, priority, state, error FROM jobs WHERE path = ? AND state != ? "
+                "ORDER BY id DESC LIMIT 1",
+                (path, PERSISTED)
+            ).fetchone()
+            if row is not None:
+                self._conn.execute(
+                    "UPDATE jobs SET state = CASE WHEN state = ? THEN ? ELSE state END, "
+                    "priority = ?, error = NULL, updated_at = ? WHERE id = ?",
+                    (FAILED, QUEUED, priority, now, row[0])
+                )
+                return Enqueued(row[0], False, tuple(row[1:]))
+            return Enqueued(self._conn.execute(
+                "INSERT INTO jobs (path, source, priority, state, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (path, source, priority, QUEUED, now, now)
+            ).lastrowid, True)
+
+    def active_job(self, path: str) -> Optional[int]:
+        """Job non concluso per `path`, se esiste."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE path = ? AND state NOT IN (?, ?) ORDER BY id DESC LIMIT 1",
+                (path, PERSISTED, FAILED)
+            ).fetchone()
+        return row[0] if row else None
+
+    def record_stage(self, job_id: int, stage: str, value: Any):
+        """Salva il risultato di una fase completata e aggiorna lo stato del job."""
+        payload = json.dumps(value, ensure_ascii=False, default=str)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO stages (job_id, stage, value, completed_at) VALUES (?, ?, ?, ?)",
+                (job_id, stage, payload, now)
+            )
+            self._conn.execute("UPDATE jobs SET state = ?, updated_at = ? WHERE id = ?", (stage, now, job_id))
+
+    def completed_stages(self, job_id: int) -> Dict[str, Any]:
+        """Risultati delle fasi già completate, nell'ordine in cui sono terminate."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT stage, value FROM stages WHERE job_id = ? ORDER BY completed_at", (job_id,)
+            ).fetchall()
+        return {stage: json.loads(value) for stage, value in rows}
+
+    def complete(self, job_id: int):
+        """Il risultato è nell'archivio: il job è concluso e i risultati intermedi non servono più."""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET state = ?, updated_at = ? WHERE id = ?",
+                               (PERSISTED, time.time(), job_id))
+            self._conn.execute("DELETE FROM stages WHERE job_id = ?", (job_id,))
+
+    def fail(self, job_id: int, error: str):
+        """Job terminato con errore; le fasi completate restano per un nuovo tentativo."""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET state = ?, error = ?, updated_at = ? WHERE id = ?",
+                               (FAILED, error, time.time(), job_id))
+
+    def discard(self, job_id: int):
+        """Rimuove un job mai entrato in coda."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM stages WHERE job_id = ?", (job_id,))
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def withdraw(self, entry: Enqueued):
+        """
+        Annulla un `enqueue` il cui file non è entrato in coda: il job appena
+        creato è rimosso, quello riusato torna com'era. Le fasi salvate nel
+        frattempo da un worker che lo sta elaborando non sono toccate.
+        """
+        if entry.created:
+            self.discard(entry.id)
+            return
+        priority, state, error = entry.previous
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET priority = ?, updated_at = ? WHERE id = ?",
+                               (priority, time.time(), entry.id))
+            self._conn.execute("UPDATE jobs SET state = ?, error = ? WHERE id = ? AND state = ? AND error IS NULL",
+                               (state, error, entry.id, QUEUED))
+
+    def move(self, job_id: int, path: str):
+        """Il job prosegue su un altro file (l'originale, se la copia in archivio manca)."""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET path = ?, updated_at = ? WHERE id = ?",
+                               (path, time.time(), job_id))
+
+    def unfinished(self) -> List[Job]:
+        """Job né salvati né falliti, in ordine di priorità e di arrivo."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, path, source, priority, state FROM jobs WHERE state NOT IN (?, ?) "
+                "ORDER BY priority, id",
+                (PERSISTED, FAILED)
+            ).fetchall()
+        return [Job(*row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,92 @@
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+
+def phash(gray) -> int:
+    """
+    Hash percettivo a 64 bit: segno delle basse frequenze della DCT
+    dell'immagine ridotta a 32x32 rispetto alla loro mediana. Resiste a
+    ricompressione, scala e piccole variazioni di luce.
+    """
+    import cv2
+    import numpy as np
+
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low[1:])
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def dhash(gray, margin: float = 1.0) -> int:
+    """
+    Hash delle differenze a 64 bit: più veloce di `phash`, meno robusto.
+    Le differenze sotto `margin` livelli di grigio contano come zero, così
+    le zone di carta bianca non producono bit casuali col rumore.
+    """
+    import cv2
+    import numpy as np
+
+    small = cv2.resize(gray.astype(np.float32), (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] - small[:, :-1] > margin).flatten()
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+class ImageSignature(NamedTuple):
+    """Impronta di uno scontrino per riconoscerlo fotografato di nuovo."""
+    phash: int
+    dhash: int
+    aspect: float  # Larghezza / altezza
+
+
+def signature(gray) -> ImageSignature:
+    height, width = gray.shape[:2]
+    return ImageSignature(phash(gray), dhash(gray), width / max(1, height))
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """
+    Albero BK sulla distanza di Hamming: la ricerca entro `max_distance`
+    visita solo i sottoalberi compatibili con la disuguaglianza
+    triangolare, non tutti gli hash memorizzati.
+    """
+
+    def __init__(self):
+        # Nodo: (hash, valore, figli per distanza dal padre)
+        self._root: Optional[Tuple[int, Any, Dict[int, tuple]]] = None
+        self.size = 0
+
+    def add(self, value: int, item: Any = None):
+        self.size += 1
+        if self._root is None:
+            self._root = (value, item, {})
+            return
+        node = self._root
+        while True:
+            distance = hamming(value, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value, item, {})
+                return
+            node = child
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, int, Any]]:
+        """Elementi entro `max_distance` da `value`: lista di (distanza, hash, valore), i più vicini prima."""
+        if self._root is None:
+            return []
+        found = []
+        pending = [self._root]
+        while pending:
+            node_value, item, children = pending.pop()
+            distance = hamming(value, node_value)
+            if distance <= max_distance:
+                found.append((distance, node_value, item))
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    pending.append(child)
+        return sorted(found, key=lambda match: match[0])
+
+    def __len__(self):
+        return self.size
@@ -0,0 +1,555 @@
+import asyncio
+import base64
+import contextvars
+import hashlib
+import json
+import os
+from datetime import date
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from ..agents.date_formatter import DateFormatterAgent
+from ..agents.ocr_agent import OCR_PREPROCESS_VERSION
+from ..models.receipt_store import result_to_row
+from ..utils.config import EXTRACTION_MODE
+from .image_preparation import PREPARATION_VERSION, prepare_image
+from .result_cache import ResultCache, prompt_version
+from .rate_limiter import estimate_tokens
+from .stage_graph import Stage, StageGraph
+from .stage_metrics import StageMetrics
+
+VISION_MODEL = "gpt-4o"
+VISION_PROMPT = """Analizza questo scontrino ed estrai:
+{
+    "data": "data scontrino",
+    "importo": numero,
+    "valuta": "codice valuta",
+    "esercente": "nome",
+    "luogo": "località"
+}
+Rispondi SOLO con il JSON."""
+OCR_VERSION = prompt_version(VISION_MODEL, VISION_PROMPT, PREPARATION_VERSION)
+
+# Modalità single_pass: estrazione, validazione e categorizzazione in una sola risposta
+SINGLE_PASS_PROMPT = """Analizza questo scontrino e restituisci un JSON con questa struttura esatta:
+{
+    "data": "YYYY-MM-DD",
+    "importo": numero,
+    "valuta": "codice valuta a 3 lettere",
+    "esercente": "nome dell'esercente",
+    "luogo": "località",
+    "validazione": {
+        "data_valida": boolean,
+        "importo_valido": boolean,
+        "valuta_valida": boolean,
+        "messaggi": ["lista di messaggi sui dati dubbi"]
+    },
+    "categoria": "una tra: Cibo e Ristorazione, Trasporti, Shopping, Servizi, Altro",
+    "sottocategoria": "descrizione più specifica",
+    "confidenza": numero,
+    "tags": ["lista", "di", "parole", "chiave"]
+}
+Rispondi SOLO con il JSON."""
+SINGLE_PASS_VERSION = prompt_version(VISION_MODEL, SINGLE_PASS_PROMPT, PREPARATION_VERSION)
+ANALYSIS_FIELDS = ("data", "importo", "valuta", "esercente", "luogo")
+
+
+def data_url(image_base64: str, mime: str = "image/jpeg") -> str:
+    return f"data:{mime};base64,{image_base64}"
+
+
+def vision_messages(prompt: str, image_urls: List[str]) -> List[Dict[str, Any]]:
+    """Messaggio utente con il testo del prompt seguito dalle immagini, nell'ordine dato."""
+    content = [{"type": "text", "text": prompt}]
+    for url in image_urls:
+        content.append({
+            "type": "image_url",
+            "image_url": {
+                "url": url
+            }
+        })
+    return [{"role": "user", "content": content}]
+
+
+class DuplicateReceipt(Exception):
+    """Lo scontrino estratto corrisponde a una riga già in archivio."""
+
+    def __init__(self, match: Dict[str, Any]):
+        self.match = match
+        super().__init__(
+            f"Possibile duplicato di {match.get('File') or 'una riga esistente'} "
+            f"({match.get('Data')}, {match.get('Importo Originale')} {match.get('Valuta')}, "
+            f"{match.get('Descrizione')})"
+        )
+
+
+class ReceiptPipeline:
+    """
+    Pipeline di elaborazione di uno scontrino, indipendente dall'interfaccia:
+    OCR -> analisi -> (validazione | conversione valuta | categorizzazione).
+
+    In modalità "single_pass" le fasi LLM sono sostituite da una sola
+    chiamata vision con risposta strutturata; restano la conversione valuta
+    e la stessa forma del risultato. Le metriche di ogni fase (latenza e
+    token) dell'ultimo scontrino sono in `metrics`.
+
+    È usata dal ProcessingWorker (insieme a QThread) e dalla modalità batch
+    da riga di comando. I messaggi passano da `log`, che le sottoclassi
+    possono ridefinire.
+    """
+
+    # Widget genitore per le richieste all'utente; None = nessun dialogo
+    dialog_parent = None
+
+    def __init__(self, client=None, analysis_chain=None, currency_manager=None,
+                 result_cache: Optional[ResultCache] = None, runtime=None,
+                 log: Optional[Callable[[str], None]] = None, mode: str = EXTRACTION_MODE,
+                 vision_batcher=None, receipt_store=None, **kwargs):
+        super().__init__(**kwargs)
+        self.mode = mode
+        # Se presente, l'OCR passa dal batcher condiviso (più scontrini per chiamata)
+        self.vision_batcher = vision_batcher
+        # Se presente, i duplicati sono fermati prima di conversione e categorizzazione
+        self.receipt_store = receipt_store
+        self.metrics = StageMetrics()
+        self.image_path = None
+        self.client = client
+        self.analysis_chain = analysis_chain
+        self.currency_manager = currency_manager
+        self.result_cache = result_cache
+        self.runtime = runtime
+        self.stage_keys = {}
+        self.image_mime = "image/jpeg"
+        self.image_stats = {}
+        # Immagine già elaborata in memoria (OptimizedImage): nessuna lettura da disco
+        self.preloaded_image = None
+        # Giornale dei job: ogni fase completata è salvata, le fasi in `resume_results` non sono ripetute
+        self.journal = None
+        self.job_id = None
+        self.resume_results: Dict[str, Any] = {}
+        # Se presente, gli span delle fasi di ogni scontrino sono esportati (JSONL / Prometheus)
+        self.span_exporter = None
+        self._log = log
+
+    def log(self, message: str):
+        if self._log is not None:
+            self._log(message)
+
+    async def process_receipt(self, image_path: Optional[str] = None) -> Dict[str, Any]:
+        """Elabora lo scontrino `image_path` e restituisce i dati estratti."""
+        if image_path is not None:
+            self.image_path = image_path
+        self.metrics = StageMetrics()
+
+        try:
+            with self.metrics.measure("prepare"):
+                # Decodifica e ricompressione sono CPU: fuori dal loop condiviso
+                image_base64 = await asyncio.get_running_loop().run_in_executor(None, self.encode_image)
+            inputs = {"image": image_base64, **self.resume_results}
+            if self.resume_results:
+                self.log(f"Ripresa del job: fasi già completate {', '.join(self.resume_results)}")
+            if self.mode == "single_pass":
+                self.log("Estrazione in un solo passaggio (dati, validazione e categoria)...")
+                results = await self.single_pass_graph().run(inputs, self.metrics, self.log, self.record_stage)
+                data = self.assemble_single_pass(results)
+            else:
+                data = await self.run_multi_stage(inputs)
+        finally:
+            # Anche gli scontrini falliti: lo span con esito "errore" indica la fase
+            self.export_spans()
+
+        self.log(f"Metriche ({self.mode}): {self.metrics.summary()}")
+        return data
+
+    def export_spans(self):
+        if self.span_exporter is None or not self.metrics.spans:
+            return
+        try:
+            self.span_exporter.export(self.metrics.spans, self.receipt_name(), self.mode)
+        except Exception as e:
+            self.log(f"Errore nell'esportazione delle metriche: {str(e)}")
+        # Gli span esportati non vanno ripetuti (es. persistence aggiunta dopo)
+        self.metrics.spans = []
+
+    def receipt_name(self) -> str:
+        return os.path.basename(self.image_path) if self.image_path else self.stage_keys.get("image", "")
+
+    async def run_in_thread(self, function, *args):
+        """Esegue `function` nel thread pool con il contesto corrente: le richieste HTTP restano attribuite alla fase."""
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(None, context.run, function, *args)
+
+    async def call_model(self, function, estimated_tokens: int = 1000):
+        """
+        Esegue una chiamata al modello (`function()` restituisce la coroutine)
+        attraverso il limitatore condiviso del runtime: limiti, tentativi e circuito.
+        """
+        limiter = getattr(self.runtime, "openai_limiter", None)
+        if limiter is None:
+            return await function()
+        return await limiter.call(function, estimated_tokens)
+
+    async def process_chains(self, text_content: str) -> Dict[str, Any]:
+        """Gestisce l'intero processo di analisi dello scontrino"""
+        return await self.run_multi_stage({"ocr": text_content})
+
+    async def run_multi_stage(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            results = await self.multi_stage_graph().run(inputs, self.metrics, self.log, self.record_stage)
+        except Exception as e:
+            self.log(f"Errore nel processo delle catene: {str(e)}")
+            raise
+
+        # La conversione lavora su una copia dell'analisi: ripartiamo dal suo risultato
+        analysis_data = results["fx"]
+        categorization = results["categorization"]
+        if categorization.get("esercente"):
+            analysis_data["esercente"] = categorization["esercente"]
+        return {
+            **analysis_data,
+            "validation": results["validation"],
+            "categorization": categorization["categorization"]
+        }
+
+    def record_stage(self, stage: str, value: Any):
+        if self.journal is not None and self.job_id is not None:
+            self.journal.record_stage(self.job_id, stage, value)
+
+    def multi_stage_graph(self) -> StageGraph:
+        """
+        OCR -> analisi, poi validazione, conversione valuta e categorizzazione
+        in parallelo: nessuna delle tre usa il risultato delle altre.
+        Conversione e categorizzazione aspettano il controllo dei duplicati.
+        """
+        return StageGraph([
+            Stage("ocr", self.stage_ocr, ("image",)),
+            Stage("analysis", self.stage_analysis, ("ocr",)),
+            Stage("dedup", self.stage_dedup, ("analysis",)),
+            Stage("validation", self.stage_validation, ("analysis",)),
+            Stage("fx", self.stage_fx, ("analysis", "dedup")),
+            Stage("categorization", self.stage_categorization, ("analysis", "dedup")),
+        ])
+
+    def single_pass_graph(self) -> StageGraph:
+        return StageGraph([
+            Stage("single_pass", self.stage_single_pass, ("image",)),
+            Stage("dedup", self.stage_dedup, ("single_pass",)),
+            Stage("fx", self.stage_fx, ("single_pass", "dedup")),
+        ])
+
+    async def stage_ocr(self, results: Dict[str, Any]) -> str:
+        key, analysis_text = self.cache_lookup("ocr", "image")
+        if analysis_text is None:
+            if self.vision_batcher is not None:
+                analysis_text = await self.vision_batcher.extract(results["image"], self.metrics,
+                                                                  self.image_mime)
+            else:
+                # Il client OpenAI è sincrono: la chiamata non deve bloccare il loop
+                analysis_text = await self.call_model(
+                    lambda: self.run_in_thread(self.extract_text_from_image, results["image"]),
+                    estimate_tokens(VISION_PROMPT, images=1)
+                )
+            self.cache_store("ocr", key, analysis_text)
+        self.log(f"Testo estratto: {analysis_text}")
+        return analysis_text
+
+    async def stage_analysis(self, results: Dict[str, Any]) -> Dict[str, Any]:
+        self.log("1. Primo Step: Iniziando l'analisi con la catena principale...")
+        key, analysis_data = self.cache_lookup("analysis", "ocr")
+        if analysis_data is None:
+            analysis_result = await self.call_model(
+                lambda: self.analysis_chain.analysis_chain.ainvoke(
+                    {"text": results["ocr"]}, config=self.metrics.callbacks("analysis")
+                ),
+                estimate_tokens(results["ocr"])
+            )
+            analysis_data = self.parse_json_result(analysis_result)
+            self.cache_store("analysis", key, analysis_data)
+        self.log(f"Questo è cio che è stato estratto: {json.dumps(analysis_data, ensure_ascii=False)}\n")
+        return analysis_data
+
+    async def stage_validation(self, results: Dict[str, Any]) -> Dict[str, Any]:
+        self.log("\n2. Secondo Step: Validazione in corso...")
+        key, validation_data = self.cache_lookup("validation", "analysis")
+        if validation_data is None:
+            payload = json.dumps(results["analysis"])
+            validation_result = await self.call_model(
+                lambda: self.analysis_chain.validation_chain.ainvoke(
+                    {"json": payload}, config=self.metrics.callbacks("validation")
+                ),
+                estimate_tokens(payload)
+            )
+            validation_data = self.parse_json_result(validation_result)
+            self.cache_store("validation", key, validation_data)
+        return validation_data
+
+    async def stage_dedup(self, results: Dict[str, Any]) -> None:
+        """
+        Cerca in archivio uno scontrino con gli stessi dati estratti.
+
+        Raises:
+            DuplicateReceipt: Se esiste; le fasi successive non vengono eseguite.
+        """
+        if self.receipt_store is None:
+            return None
+        source = results["analysis"] if "analysis" in results else results["single_pass"]
+        match = self.receipt_store.find_similar(result_to_row(source, self.image_path or ""))
+        if match is not None:
+            raise DuplicateReceipt(match)
+        return None
+
+    async def stage_fx(self, results: Dict[str, Any]) -> Dict[str, Any]:
+        self.log("\n3. Terzo Step: Sto convertendo...")
+        source = results["analysis"] if "analysis" in results else results["single_pass"]
+        analysis_data = {field: source[field] for field in ANALYSIS_FIELDS if field in source}
+        return await self.handle_currency_conversion(analysis_data)
+
+    async def stage_categorization(self, results: Dict[str, Any]) -> Dict[str, Any]:
+        self.log("\n4. Quarto step: Categorizzazione della spesa...")
+        key, cached = self.cache_lookup("categorization", "analysis")
+        if cached is not None:
+            return cached
+
+        # Copia: gli step intermedi arricchiscono l'esercente
+        analysis_data = dict(results["analysis"])
+        categorization_result = await self.analysis_chain.categorize_with_intermediate_steps(
+            analysis_data,
+            self.dialog_parent,
+            config=self.metrics.callbacks("categorization")
+        )
+        # Salviamo anche l'esercente arricchito dagli step intermedi
+        value = {
+            "categorization": categorization_result,
+            "esercente": analysis_data.get("esercente")
+        }
+        self.cache_store("categorization", key, value)
+        return value
+
+    async def stage_single_pass(self, results: Dict[str, Any]) -> Dict[str, Any]:
+        """Estrae, valida e categorizza lo scontrino con una sola chiamata al modello."""
+        key, extracted = self.cache_lookup("single_pass", "image")
+        if extracted is None:
+            raw = await self.call_model(
+                lambda: self.run_in_thread(
+                    self.vision_completion, results["image"], SINGLE_PASS_PROMPT, "single_pass",
+                    {"response_format": {"type": "json_object"}}
+                ),
+                estimate_tokens(SINGLE_PASS_PROMPT, images=1)
+            )
+            extracted = self.parse_json_result(raw)
+            self.cache_store("single_pass", key, extracted)
+        self.log(f"Questo è cio che è stato estratto: {json.dumps(extracted, ensure_ascii=False)}\n")
+        return extracted
+
+    @staticmethod
+    def assemble_single_pass(results: Dict[str, Any]) -> Dict[str, Any]:
+        """Risultato single_pass nella stessa forma della pipeline a più fasi."""
+        extracted, analysis_data = results["single_pass"], results["fx"]
+        esercente = analysis_data.get("esercente", "Esercente sconosciuto")
+        luogo = analysis_data.get("luogo", "Località sconosciuta")
+        description = (f"{esercente} situato a {luogo}. "
+                       f"Importo: {analysis_data.get('importo', 0)} {analysis_data.get('valuta', 'EUR')}.")
+        return {
+            **analysis_data,
+            "validation": extracted.get("validazione", {}),
+            "categorization": {
+                "descrizione": description,
+                "categoria": {
+                    "categoria": extracted.get("categoria", "Altro"),
+                    "sottocategoria": extracted.get("sottocategoria", ""),
+                    "confidenza": extracted.get("confidenza"),
+                    "tags": extracted.get("tags", [])
+                }
+            }
+        }
+
+    def stage_version(self, stage: str) -> str:
+        if stage == "ocr":
+            return OCR_VERSION
+        if stage == "single_pass":
+            return SINGLE_PASS_VERSION
+        return self.analysis_chain.stage_versions[stage]
+
+    def cache_lookup(self, stage: str, parent_stage: str) -> Tuple[Optional[str], Any]:
+        """
+        Cerca il risultato di una fase nella cache dei risultati.
+
+        Returns:
+            tuple: (chiave della fase, valore in cache o None). La chiave è None
+            se la cache non è attiva.
+        """
+        parent_key = self.stage_keys.get(parent_stage)
+        if self.result_cache is None or parent_key is None:
+            return None, None
+
+        key = ResultCache.stage_key(parent_key, stage, self.stage_version(stage))
+        self.stage_keys[stage] = key
+        value = self.result_cache.get(key)
+        if value is not None:
+            self.log(f"Fase '{stage}': risultato recuperato dalla cache, nessuna chiamata API")
+        return key, value
+
+    def cache_store(self, stage: str, key: Optional[str], value: Any):
+        if key is not None:
+            self.result_cache.put(key, self.stage_keys["image"], stage, self.stage_version(stage), value)
+
+    def parse_json_result(self, result: str) -> Dict[str, Any]:
+        """Gestisce il parsing del JSON con gestione errori migliorata"""
+        try:
+            if isinstance(result, dict):
+                return result
+
+            cleaned = self.clean_json_string(result)
+            return json.loads(cleaned)
+
+        except json.JSONDecodeError:
+            return self.extract_json_from_string(result)
+
+    def clean_json_string(self, text: str) -> str:
+        """Pulisce una stringa JSON da markup e caratteri non necessari"""
+        cleaned = text.strip()
+        if cleaned.startswith("```json"):
+            cleaned = cleaned[7:]
+        if cleaned.endswith("```"):
+            cleaned = cleaned[:-3]
+        return cleaned.strip()
+
+    def extract_json_from_string(self, text: str) -> Dict[str, Any]:
+        """Estrae JSON da una stringa con gestione errori"""
+        json_start = text.find('{')
+        json_end = text.rfind('}') + 1
+
+        if json_start >= 0 and json_end > json_start:
+            try:
+                return json.loads(text[json_start:json_end])
+            except json.JSONDecodeError:
+                raise ValueError("JSON non valido nel testo estratto")
+        raise ValueError("Nessun JSON trovato nel testo")
+
+    async def handle_currency_conversion(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Gestisce la conversione della valuta con fallback multipli"""
+        if not ('valuta' in data and 'importo' in data):
+            return data
+
+        currency = data['valuta']
+        amount = float(data['importo'])
+        receipt_date = self.receipt_date(data)
+        self.log(f"Valuta originale: {currency}, Importo: {amount}, Data: {receipt_date or 'n/d'}")
+
+        try:
+            rate, source = await self.get_conversion_rate(currency, receipt_date)
+            if rate:
+                # Tasso e fonte salvati per poter riprodurre la conversione
+                data['tasso_cambio'] = rate
+                data['fonte_tasso'] = source
+                data['importo_eur'] = round(amount * rate, 2)
+                self.log(
+                    f"Conversione: {amount} {currency} = {data['importo_eur']} EUR (Fonte: {source})"
+                )
+            else:
+                data['importo_eur'] = amount
+                self.log("Conversione non possibile, uso importo originale")
+
+        except Exception as e:
+            self.log(f"Errore conversione: {str(e)}")
+            data['importo_eur'] = amount
+
+        return data
+
+    @staticmethod
+    def receipt_date(data: Dict[str, Any]) -> Optional[str]:
+        """Data dello scontrino in formato AAAA-MM-GG, o None se non riconoscibile."""
+        formatted = DateFormatterAgent.format_date(data.get('data', ''))
+        try:
+            return date.fromisoformat(formatted).isoformat()
+        except (TypeError, ValueError):
+            return None
+
+    async def get_conversion_rate(self, currency: str,
+                                  receipt_date: Optional[str] = None) -> Tuple[Optional[float], Optional[str]]:
+        """Tasso verso l'euro: storico, tabella del giorno, poi provider online e fallback"""
+        manager = self.currency_manager
+        if manager is None:
+            return None, None
+
+        # Scontrini passati: tasso storico alla data dello scontrino
+        if receipt_date and receipt_date < date.today().isoformat():
+            rate, source, _ = await manager.get_historical_rate(currency, 'EUR', receipt_date)
+            if rate:
+                return rate, source
+
+        # Prima la tabella del giorno (una sola chiamata al provider per tutto il batch)
+        rate, source = await manager.get_cached_rate(currency, 'EUR')
+        stats = manager.cache_stats
+        self.log(
+            f"Cache FX: {stats['hit']} hit, {stats['miss']} miss, {stats['fetch']} chiamate al provider"
+        )
+        if rate:
+            return rate, source
+
+        # Provider online in parallelo, con scadenze; in ultimo i tassi di fallback
+        return await manager.lookup_rate(currency, 'EUR')
+
+    def run_async(self, coro):
+        """Esegue la coroutine sul loop condiviso dell'applicazione, se disponibile."""
+        if self.runtime is not None:
+            return self.runtime.run(coro)
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            loop.close()
+
+    def encode_image(self) -> str:
+        """Prepara l'immagine (ritaglio, riduzione, ricompressione) e la codifica in base64"""
+        if self.preloaded_image is not None:
+            return self.encode_preloaded_image()
+        with open(self.image_path, "rb") as image_file:
+            image_bytes = image_file.read()
+        # L'hash del file originale è la radice delle chiavi della cache dei risultati
+        self.stage_keys = {"image": hashlib.sha256(image_bytes).hexdigest()}
+
+        prepared = prepare_image(image_bytes)
+        self.image_mime = prepared.mime
+        self.image_stats = {
+            "bytes_originali": prepared.original_bytes,
+            "bytes_inviati": len(prepared.data),
+            "bytes_risparmiati": prepared.bytes_saved
+        }
+        if prepared.bytes_saved:
+            self.log(
+                f"Immagine preparata: {prepared.original_bytes / 1024:.0f} KB -> {len(prepared.data) / 1024:.0f} KB "
+                f"({prepared.original_size[0]}x{prepared.original_size[1]} -> {prepared.size[0]}x{prepared.size[1]}, "
+                f"{prepared.mime})"
+            )
+        return base64.b64encode(prepared.data).decode('utf-8')
+
+    def encode_preloaded_image(self) -> str:
+        """Codifica in base64 il buffer già preparato dal pool dell'OCRAgent."""
+        image = self.preloaded_image
+        # Stesso file, immagine diversa da quella di `prepare_image`: radice distinta per la cache
+        self.stage_keys = {"image": prompt_version(image.source_hash, OCR_PREPROCESS_VERSION)}
+        self.image_mime = image.mime
+        self.image_stats = {
+            "bytes_originali": image.original_bytes,
+            "bytes_inviati": len(image.data),
+            "bytes_risparmiati": image.original_bytes - len(image.data)
+        }
+        return base64.b64encode(image.data).decode('utf-8')
+
+    def extract_text_from_image(self, image_base64: str) -> str:
+        """Estrae il testo dall'immagine usando GPT-4 Vision"""
+        return self.vision_completion(image_base64, VISION_PROMPT, "ocr")
+
+    def vision_completion(self, image_base64: str, prompt: str, stage: str,
+                          options: Optional[Dict[str, Any]] = None) -> str:
+        """Chiamata vision con l'immagine e `prompt`; i token sono registrati nella fase `stage`."""
+        completion = self.client.chat.completions.create(
+            model=VISION_MODEL,
+            messages=vision_messages(prompt, [data_url(image_base64, self.image_mime)]),
+            max_tokens=1000,
+            **(options or {})
+        )
+        self.metrics.add_completion(stage, completion)
+        return completion.choices[0].message.content.strip()
@@ -0,0 +1,263 @@
+import asyncio
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional, TypeVar
+
+from ..utils.config import (OPENAI_BREAKER_COOLDOWN, OPENAI_BREAKER_THRESHOLD, OPENAI_MAX_CONCURRENT,
+                            OPENAI_MAX_RETRIES, OPENAI_REQUESTS_PER_MINUTE, OPENAI_RETRY_BASE,
+                            OPENAI_RETRY_MAX, OPENAI_TOKENS_PER_MINUTE)
+from .stage_metrics import record_retry
+
+T = TypeVar("T")
+
+# Stati HTTP per cui ha senso ripetere la richiesta
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+# Token stimati per immagine a dettaglio alto (come conteggiati da OpenAI per 1024 px)
+IMAGE_TOKENS = 765
+
+
+def estimate_tokens(text: str = "", images: int = 0, max_tokens: int = 1000) -> int:
+    """Token che una chiamata consumerà al massimo: circa 4 caratteri per token, più la risposta."""
+    return len(text) // 4 + images * IMAGE_TOKENS + max_tokens
+
+
+class ProviderUnavailable(Exception):
+    """Il circuito è aperto: il provider ha fallito troppe volte di seguito, la chiamata non parte."""
+
+
+class TokenBucket:
+    """
+    Secchio che si riempie di `capacity` unità al minuto, fino a `capacity`.
+
+    `reserve` preleva subito anche andando in debito e restituisce l'attesa
+    necessaria: le richieste concorrenti si mettono in fila senza polling.
+    Non è thread-safe da solo (lo protegge il RateLimiter).
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        self._refill(now)
+        self.level -= min(amount, self.capacity)
+        return 0.0 if self.level >= 0 else -self.level * 60 / self.capacity
+
+    def update(self, limit: Optional[float], remaining: Optional[float], now: float):
+        """Allinea capacità e disponibilità a quanto riportato dal provider."""
+        self._refill(now)
+        if limit:
+            self.capacity = float(limit)
+        if remaining is not None:
+            self.level = min(self.capacity, float(remaining))
+
+    def drain(self, now: float):
+        self._refill(now)
+        self.level = min(self.level, 0.0)
+
+
+class RateLimiter:
+    """
+    Limita, ripete e isola le chiamate a un provider (OpenAI).
+
+    - Due secchi, richieste e token al minuto, condivisi da tutte le
+      chiamate; capacità e disponibilità seguono gli header
+      `x-ratelimit-*` delle risposte (`observe_headers`).
+    - Al massimo `max_concurrent` chiamate contemporanee.
+    - Gli errori temporanei (429, 5xx, timeout, connessione) sono ripetuti
+      fino a `max_retries` volte con backoff esponenziale e jitter pieno,
+      rispettando Retry-After; un 429 svuota anche il secchio dei token.
+    - Dopo `breaker_threshold` errori consecutivi (esclusi i 429) il
+      circuito si apre: per `breaker_cooldown` secondi le chiamate falliscono
+      subito con ProviderUnavailable, poi una sola chiamata di prova decide
+      se richiuderlo.
+
+    Lo stato è protetto da un lock (gli header arrivano anche dai thread
+    dei worker); `call` va usata da un solo event loop.
+    """
+
+    def __init__(self, name: str = "OpenAI", requests_per_minute: float = OPENAI_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: float = OPENAI_TOKENS_PER_MINUTE, max_concurrent: int = OPENAI_MAX_CONCURRENT,
+                 max_retries: int = OPENAI_MAX_RETRIES, retry_base: float = OPENAI_RETRY_BASE,
+                 retry_max: float = OPENAI_RETRY_MAX, breaker_threshold: int = OPENAI_BREAKER_THRESHOLD,
+                 breaker_cooldown: float = OPENAI_BREAKER_COOLDOWN,
+                 log: Optional[Callable[[str], None]] = None):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.log = log or (lambda message: None)
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self._lock = threading.Lock()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self.stats = {"chiamate": 0, "attese": 0, "secondi_attesa": 0.0, "tentativi": 0,
+                      "rate_limit": 0, "circuito_aperto": 0, "rifiutate": 0}
+
+    async def call(self, function: Callable[[], Awaitable[T]], estimated_tokens: int = 1000) -> T:
+        """
+        Esegue `function()` (una nuova coroutine a ogni tentativo) entro i limiti.
+
+        Raises:
+            ProviderUnavailable: Se il circuito è aperto.
+            Exception: L'errore della chiamata, se non temporaneo o dopo l'ultimo tentativo.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        attempt = 0
+        while True:
+            probe = self._check_circuit()
+            try:
+                wait = self._reserve(estimated_tokens)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                try:
+                    async with self._semaphore:
+                        result = await function()
+                except Exception as e:
+                    delay = self._on_failure(e, attempt, probe)
+                    if delay is None:
+                        raise
+                    attempt += 1
+                    record_retry()
+                    await asyncio.sleep(delay)
+                    continue
+                self._on_success()
+                return result
+            finally:
+                if probe:
+                    # Prova senza esito (annullata, interrotta): il circuito resta aperto per un altro cooldown
+                    self._end_probe()
+
+    def _reserve(self, estimated_tokens: int) -> float:
+        now = time.monotonic()
+        with self._lock:
+            self.stats["chiamate"] += 1
+            wait = max(self.requests.reserve(1, now), self.tokens.reserve(estimated_tokens, now))
+            if wait > 0:
+                self.stats["attese"] += 1
+                self.stats["secondi_attesa"] += wait
+        return wait
+
+    def _check_circuit(self) -> bool:
+        """True se la chiamata è la prova del circuito mezzo aperto."""
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            remaining = self._opened_at + self.breaker_cooldown - time.monotonic()
+            if remaining <= 0 and not self._probing:
+                # Mezzo aperto: passa una sola chiamata di prova
+                self._probing = True
+                return True
+            self.stats["rifiutate"] += 1
+        raise ProviderUnavailable(
+            f"{self.name} non disponibile dopo {self.breaker_threshold} errori consecutivi, "
+            f"nuovo tentativo tra {max(remaining, 0):.0f}s"
+        )
+
+    def _on_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                self.log(f"{self.name} di nuovo disponibile: circuito chiuso")
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def _end_probe(self):
+        with self._lock:
+            if self._probing:
+                self._probing = False
+                self._opened_at = time.monotonic()
+
+    def _on_failure(self, error: Exception, attempt: int, probe: bool = False) -> Optional[float]:
+        """Attesa prima del prossimo tentativo, o None se l'errore va propagato."""
+        status = getattr(error, "status_code", None)
+        if not self.is_retryable(error, status):
+            if probe:
+                # Il provider ha risposto (es. 400 per una richiesta non valida): è di nuovo disponibile
+                self._on_success()
+            return None
+        now = time.monotonic()
+        with self._lock:
+            if status == 429:
+                # Limite del provider: nessun nuovo invio finché il secchio non si riempie
+                self.stats["rate_limit"] += 1
+                self.tokens.drain(now)
+                self.requests.drain(now)
+                if probe:
+                    # Prova respinta dal rate limit: il circuito riapre per un altro cooldown
+                    self._opened_at = now
+                    self._probing = False
+                    return None
+            else:
+                self._failures += 1
+                if probe or self._failures >= self.breaker_threshold:
+                    if self._opened_at is None or probe:
+                        self.stats["circuito_aperto"] += 1
+                        self.log(f"{self.name}: {self._failures} errori consecutivi, circuito aperto "
+                                 f"per {self.breaker_cooldown:.0f}s ({str(error)})")
+                        self._opened_at = now
+                        self._probing = False
+                    elif not self._probing:
+                        # Chiamata partita prima dell'apertura: il cooldown riparte, la prova altrui non si tocca
+                        self._opened_at = now
+                    return None
+            if attempt >= self.max_retries:
+                return None
+            self.stats["tentativi"] += 1
+        delay = random.uniform(0, min(self.retry_max, self.retry_base * 2 ** attempt))
+        return max(delay, self.retry_after(error) or 0.0)
+
+    @staticmethod
+    def is_retryable(error: Exception, status: Optional[int] = None) -> bool:
+        if status is not None:
+            return status in RETRYABLE_STATUS
+        import httpx
+        import openai
+        return isinstance(error, (openai.APIConnectionError, httpx.TransportError, asyncio.TimeoutError))
+
+    @staticmethod
+    def retry_after(error: Exception) -> Optional[float]:
+        """Attesa indicata dal provider negli header dell'errore (Retry-After, in ms o secondi)."""
+        headers = getattr(getattr(error, "response", None), "headers", None) or {}
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000
+            if headers.get("retry-after"):
+                return float(headers["retry-after"])
+        except ValueError:
+            return None
+        return None
+
+    def observe_headers(self, headers: Mapping[str, str]):
+        """Aggiorna i secchi con i limiti restituiti dal provider (hook delle risposte HTTP)."""
+        if "x-ratelimit-limit-requests" not in headers and "x-ratelimit-limit-tokens" not in headers:
+            return
+
+        def number(key: str) -> Optional[float]:
+            try:
+                return float(headers[key]) if key in headers else None
+            except ValueError:
+                return None
+
+        now = time.monotonic()
+        with self._lock:
+            self.requests.update(number("x-ratelimit-limit-requests"), number("x-ratelimit-remaining-requests"), now)
+            self.tokens.update(number("x-ratelimit-limit-tokens"), number("x-ratelimit-remaining-tokens"), now)
+
+    def state(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, "circuito": "aperto" if self._opened_at is not None else "chiuso",
+                    "limite_richieste": self.requests.capacity, "limite_token": self.tokens.capacity}
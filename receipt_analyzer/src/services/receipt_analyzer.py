@@ -5,9 +5,12 @@ Automatically generated file from migration script.
 import json
 import re
 from typing import Dict, Any
-from PyQt5.QtWidgets import QInputDialog
-from aiohttp import ClientSession
-from receipt_analyzer.src.workers.processing import ProcessingWorker
+from .async_runtime import http_session
+from .rate_limiter import estimate_tokens
+from .result_cache import prompt_version
+from .stage_metrics import nested_stage
+from ..utils.api_keys import get_openai_api_key
+from ..utils.config import GEOCODING_URL, OPENAI_BASE_URL
 
 class ReceiptAnalysisChain:
     """
@@ -20,21 +23,36 @@ class ReceiptAnalysisChain:
             Il modello, passa attraverso l'LLM e analizza il risultato in formati strutturati.
     """
 
-    def __init__(self, processor):
+    def __init__(self, processor=None, runtime=None, api_key=None, logger=None, base_url=None):
 
-        self.logger = processor.log_signal.emit
-        
-        api_openai = ProcessingWorker().load_or_get_api_key(self)
+        # Senza interfaccia (modalità batch) i messaggi vanno al logger passato
+        self.logger = logger or processor.log_signal.emit
+        self.runtime = runtime
+        self.geocoding_url = GEOCODING_URL
+
+        api_openai = api_key or get_openai_api_key()
+        if api_openai is None:
+            from ..workers.processing import ProcessingWorker
+            api_openai = ProcessingWorker().load_or_get_api_key(self)
 
         from langchain_openai import ChatOpenAI
         from langchain_core.prompts import ChatPromptTemplate
         from langchain_core.output_parsers import StrOutputParser
 
+        self.model_name = "gpt-4o"
         self.llm = ChatOpenAI(
             temperature=0,
             api_key = api_openai,
-            model="gpt-4o",
-            streaming=True
+            model=self.model_name,
+            base_url=base_url or OPENAI_BASE_URL,
+            streaming=True,
+            # Token riportati anche in streaming, per il confronto tra modalità
+            stream_usage=True,
+            # Pool di connessioni condiviso con il resto della pipeline
+            http_client=runtime.http_client if runtime else None,
+            http_async_client=runtime.http_async_client if runtime else None,
+            # Con il runtime i tentativi li gestisce il suo RateLimiter
+            max_retries=0 if runtime else None
         )
 
         output_parser = StrOutputParser()
@@ -93,6 +111,16 @@ class ReceiptAnalysisChain:
         """)
         self.categorization_chain = self.categorization_prompt | self.llm | output_parser
 
+        # Versione di ogni fase per la cache dei risultati: cambia con modello o prompt
+        self.stage_versions = {
+            name: prompt_version(self.model_name, prompt.messages[0].prompt.template)
+            for name, prompt in (
+                ("analysis", self.analysis_prompt),
+                ("validation", self.validation_prompt),
+                ("categorization", self.categorization_prompt),
+            )
+        }
+
     def get_conversion_info(self, currency: str) -> dict:
         """Ottiene informazioni sulla conversione utilizzata."""
         return {
@@ -126,29 +154,32 @@ class ReceiptAnalysisChain:
             return "Generico"
 
         try:
-            async with ClientSession() as session:
-                url = f"https://nominatim.openstreetmap.org/search"
-                params = {
-                    "format": "json",
-                    "q": luogo,
-                    "limit": 1
-                }
+            with nested_stage("geocode"):
+                return await self.geocode(luogo)
+        except Exception as e:
+            self.logger(f"Error in online search: {str(e)}")
+            return "Generico"
 
-                async with session.get(url, params=params) as response:
-                    if response.status != 200:
-                        self.logger(f"API call failed with status {response.status}")
-                        return "Generico"
+    async def geocode(self, luogo: str) -> str:
+        """Nome completo della località secondo Nominatim, o "Generico"."""
+        async with http_session(self.runtime, "geocoding") as session:
+            params = {
+                "format": "json",
+                "q": luogo,
+                "limit": 1
+            }
 
-                    data = await response.json()
+            async with session.get(self.geocoding_url, params=params) as response:
+                if response.status != 200:
+                    self.logger(f"API call failed with status {response.status}")
+                    return "Generico"
 
-                    if not data:
-                        return "Generico"
+                data = await response.json()
 
-                    return data[0].get("display_name", "Generico")
+                if not data:
+                    return "Generico"
 
-        except Exception as e:
-            self.logger(f"Error in online search: {str(e)}")
-            return "Generico"
+                return data[0].get("display_name", "Generico")
 
     async def process_intermediate_steps(self, analysis_result: Dict[str, Any], parent_widget=None) -> Dict[str, Any]:
         """Esegue gli step intermedi per l'analisi della categoria."""
@@ -191,13 +222,14 @@ class ReceiptAnalysisChain:
             self.logger(f"Errore processo categorizzazione: {str(e)}")
             raise
 
-    async def categorize_with_intermediate_steps(self, analysis_result, parent_widget=None):
+    async def categorize_with_intermediate_steps(self, analysis_result, parent_widget=None, config=None):
         """
         Esegue la categorizzazione con step intermedi per verificare e arricchire i dati.
 
         Args:
             analysis_result (dict): Dati analizzati contenenti esercente, luogo, importo e valuta.
             parent_widget: Widget genitore per dialoghi (se necessario).
+            config: Config LangChain per la chiamata (es. callback delle metriche).
 
         Returns:
             dict: Risultato della categorizzazione con i dettagli aggiuntivi.
@@ -214,7 +246,13 @@ class ReceiptAnalysisChain:
         description = f"{esercente} situato a {luogo}. Importo: {importo} {valuta}."
 
         # Passa la descrizione alla catena di categorizzazione
-        category_result_raw = await self.categorization_chain.ainvoke({"description": description})
+        def categorize():
+            return self.categorization_chain.ainvoke({"description": description}, config=config)
+
+        if self.runtime is not None:
+            category_result_raw = await self.runtime.openai_limiter.call(categorize, estimate_tokens(description))
+        else:
+            category_result_raw = await categorize()
 
         # Pulisci la stringa JSON
         self.logger(f"Risultato categorizzazione (raw): {category_result_raw}")
@@ -240,6 +278,7 @@ class ReceiptAnalysisChain:
             if parent_widget is None:
                 return "Generico"
 
+            from PyQt5.QtWidgets import QInputDialog
             category, ok = QInputDialog.getText(
                 parent_widget,
                 "Inserisci Categoria",
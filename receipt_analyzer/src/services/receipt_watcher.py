@@ -2,22 +2,193 @@
 Automatically generated file from migration script.
 """
 
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
 from watchdog.events import FileSystemEventHandler
 
-from receipt_analyzer.src.workers.processing import ProcessingWorker
+from ..utils.config import IMAGE_EXTENSIONS, WATCH_IGNORE_GRACE, WATCH_POLL_INTERVAL, WATCH_SETTLE_SECONDS
 
 
 class ReceiptWatcher(FileSystemEventHandler):
-    def __init__(self, processor):
-        self.processor = processor
+    """
+    Osserva la cartella degli scontrini e accoda i file nuovi.
+
+    Gli eventi di watchdog aggiornano solo l'elenco dei file in attesa:
+    un thread dedicato accoda un file quando per `settle` secondi non
+    arrivano altri eventi e dimensione e data di modifica non cambiano
+    (scrittura terminata). Più eventi sullo stesso file producono un solo
+    invio. Sono ignorati file non immagine, nascosti o temporanei, le copie
+    `_optimized` e i file scritti dall'applicazione stessa (`ignore`).
+
+    All'avvio la cartella viene scandita una volta: i file arrivati ad
+    applicazione chiusa passano dallo stesso controllo duplicati e dalla
+    stessa coda.
+
+    Dopo il controllo sul contenuto `near_duplicate` cerca lo stesso
+    scontrino fotografato di nuovo (percorso del file simile o None): nessuno
+    può confermare, quindi il file è saltato e segnalato nel log.
+    """
+
+    def __init__(self, watch_dir: str, submit: Callable[[str], bool],
+                 is_duplicate: Optional[Callable[[str], bool]] = None,
+                 log: Optional[Callable[[str], None]] = None,
+                 settle: float = WATCH_SETTLE_SECONDS, poll_interval: float = WATCH_POLL_INTERVAL,
+                 near_duplicate: Optional[Callable[[str], Optional[str]]] = None):
+        self.watch_dir = watch_dir
+        self.submit = submit
+        self.is_duplicate = is_duplicate or (lambda path: False)
+        self.near_duplicate = near_duplicate or (lambda path: None)
+        self.log = log or (lambda message: None)
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        # Percorso -> (ultimo evento, (dimensione, mtime) all'ultimo controllo, duplicati già controllati)
+        self._pending: Dict[str, Tuple[float, Optional[Tuple[int, int]], bool]] = {}
+        # File scritti dall'applicazione -> scadenza (None finché la scrittura non è conclusa)
+        self._ignored: Dict[str, Optional[float]] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def accepts(self, path: str) -> bool:
+        """Il file è un'immagine di scontrino da elaborare."""
+        name = os.path.basename(path)
+        stem, ext = os.path.splitext(name)
+        if name.startswith(".") or ext.lower() not in IMAGE_EXTENSIONS or stem.endswith("_optimized"):
+            return False
+        with self._lock:
+            return os.path.abspath(path) not in self._ignored
+
+    def ignore(self, path: str):
+        """Registra un file che l'applicazione sta per scrivere nella cartella."""
+        with self._lock:
+            self._ignored[os.path.abspath(path)] = None
+            self._pending.pop(os.path.abspath(path), None)
+
+    def release(self, path: str, grace: float = WATCH_IGNORE_GRACE):
+        """Scrittura conclusa: il file smette di essere ignorato dopo `grace` secondi."""
+        with self._lock:
+            if os.path.abspath(path) in self._ignored:
+                self._ignored[os.path.abspath(path)] = time.monotonic() + grace
 
     def on_created(self, event):
         if not event.is_directory:
-            worker = ProcessingWorker(event.src_path)
-            worker.finished.connect(lambda data: self.processor.handle_results(data, event.src_path))
-            worker.error.connect(self.processor.handle_error)
-            worker.progress.connect(lambda msg: self.processor.status_label.setText(msg))
+            self.touch(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.touch(event.src_path)
+
+    def on_moved(self, event):
+        # Rinomina da un file temporaneo: conta il nome finale
+        if not event.is_directory:
+            self.touch(event.dest_path)
+
+    def touch(self, path: str):
+        """Nuovo evento su `path`: riparte l'attesa (chiamato dal thread di watchdog)."""
+        if not self.accepts(path):
+            return
+        path = os.path.abspath(path)
+        with self._lock:
+            checked = self._pending.get(path, (None, None, False))[2]
+            self._pending[path] = (time.monotonic(), None, checked)
+
+    def start(self):
+        """Avvia il thread che esegue la scansione iniziale e accoda i file pronti."""
+        self._thread = threading.Thread(target=self._run, name="receipt-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        self.catch_up()
+        while not self._stop.wait(self.poll_interval):
+            self.poll()
+
+    def catch_up(self) -> int:
+        """
+        Accoda i file presenti nella cartella e non ancora visti (indice dei
+        duplicati), dal più vecchio.
+
+        Returns:
+            int: Numero di file accodati.
+        """
+        try:
+            names = os.listdir(self.watch_dir)
+        except OSError as e:
+            self.log(f"Scansione iniziale di {self.watch_dir} non riuscita: {str(e)}")
+            return 0
+        paths = [os.path.join(self.watch_dir, name) for name in names]
+        paths = sorted((p for p in paths if os.path.isfile(p) and self.accepts(p)), key=os.path.getmtime)
+
+        queued = 0
+        for path in paths:
+            if self._stop.is_set():
+                break
+            if self.is_duplicate(path) or self._skip_near_duplicate(path):
+                continue
+            if self._submit(path):
+                queued += 1
+        if queued:
+            self.log(f"Scansione iniziale: {queued} scontrini arrivati ad applicazione chiusa accodati")
+        return queued
+
+    def poll(self) -> int:
+        """Accoda i file la cui scrittura è terminata; restituisce quanti."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [path for path, until in self._ignored.items() if until is not None and until <= now]
+            for path in expired:
+                del self._ignored[path]
+            candidates = [(path, state) for path, state in self._pending.items()
+                          if now - state[0] >= self.settle]
+
+        ready = []
+        for path, (last_event, last_stat, checked) in candidates:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                with self._lock:
+                    self._pending.pop(path, None)
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            with self._lock:
+                if self._pending.get(path, (None,))[0] != last_event:
+                    continue  # Nuovo evento nel frattempo
+                if current != last_stat or stat.st_size == 0:
+                    # Va confermato al prossimo controllo
+                    self._pending[path] = (last_event, current, checked)
+                    continue
+                del self._pending[path]
+            ready.append((path, checked))
+
+        queued = 0
+        for path, checked in ready:
+            if not checked and self.is_duplicate(path):
+                self.log(f"File duplicato rilevato: {path}")
+            elif not checked and self._skip_near_duplicate(path):
+                continue
+            elif self._submit(path):
+                queued += 1
+        return queued
 
-            self.processor.current_workers.append(worker)
-            worker.start()
+    def _skip_near_duplicate(self, path: str) -> bool:
+        similar = self.near_duplicate(path)
+        if similar is None:
+            return False
+        self.log(f"Possibile duplicato di {os.path.basename(similar)}, file saltato: {path}")
+        return True
 
+    def _submit(self, path: str) -> bool:
+        if self.submit(path):
+            return True
+        # Coda piena: il file resta in attesa e viene riproposto
+        self.log(f"Coda piena, {os.path.basename(path)} sarà riproposto")
+        with self._lock:
+            self._pending[path] = (time.monotonic(), None, True)
+        return False
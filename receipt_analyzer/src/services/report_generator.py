@@ -0,0 +1,221 @@
+import os
+import time
+from functools import lru_cache
+from typing import Callable, Dict, Optional
+
+from fpdf import FPDF
+
+from ..agents.date_formatter import DateFormatterAgent
+from ..models.receipt_store import ReceiptStore
+
+FONT_PATH = "fonts/NotoSans-Regular.ttf"
+BOLD_FONT_PATH = "fonts/NotoSans-Bold.ttf"
+FONT_URL = "https://github.com/googlefonts/noto-fonts/raw/main/hinted/ttf/NotoSans/NotoSans-Regular.ttf"
+BOLD_FONT_URL = "https://github.com/googlefonts/noto-fonts/raw/main/hinted/ttf/NotoSans/NotoSans-Bold.ttf"
+
+# Stringhe ripetute (esercenti, categorie, date) sono elaborate una volta sola
+TEXT_CACHE_SIZE = 8192
+
+
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
+def shape_text(text: str) -> str:
+    """Applica reshaping arabo e algoritmo bidi al testo di una cella."""
+    try:
+        import arabic_reshaper
+        from bidi.algorithm import get_display
+        return get_display(arabic_reshaper.reshape(text))
+    except Exception:
+        return text
+
+
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
+def format_report_date(value: str) -> str:
+    return DateFormatterAgent.format_date(value)
+
+
+class ReportPDF(FPDF):
+    """Layout del report scontrini (A4 orizzontale, font Noto Sans)."""
+
+    def __init__(self):
+        super().__init__(orientation='L', unit='mm', format='A4')
+        self.col_widths = {
+            "Data": 25,
+            "Importo": 25,
+            "Valuta": 15,
+            "EUR": 25,
+            "Descrizione": 95,
+            "Categoria": 35,
+            "Sottocategoria": 35,
+            "File": 50
+        }
+        # Imposta il font predefinito
+        self.add_font("NotoSans", fname=FONT_PATH)
+        self.add_font("NotoSans", fname=BOLD_FONT_PATH, style="B")
+        self.set_auto_page_break(auto=True, margin=15)
+        # La misura delle stringhe dipende dal font corrente: cache per istanza
+        self.wrap_text = lru_cache(maxsize=TEXT_CACHE_SIZE)(self.multi_cell_planning)
+
+    def header(self):
+        self.set_font("NotoSans", "B", 16)
+        self.cell(0, 10, "Report Scontrini", align="C")
+        self.ln()
+        self.set_font("NotoSans", size=10)
+        self.cell(0, 5, f"Generato il: {time.strftime('%d/%m/%Y %H:%M:%S')}", align="R")
+        self.ln(10)
+
+        # Intestazione tabella
+        self.set_font("NotoSans", "B", 10)
+        self.set_fill_color(230, 230, 230)
+        x_pos = 10
+        for header, width in self.col_widths.items():
+            self.rect(x_pos, self.get_y(), width, 8, "DF")
+            self.set_xy(x_pos, self.get_y())
+            self.cell(width, 8, header, align="C")
+            x_pos += width
+        self.ln(8)
+
+    def footer(self):
+        self.set_y(-15)
+        self.set_font("NotoSans", size=8)
+        self.cell(0, 10, f'Pagina {self.page_no()}', align="C")
+
+    def add_row(self, data: Dict[str, str]):
+        self.set_font("NotoSans", size=9)
+
+        # Calcola l'altezza necessaria
+        max_height = 6
+        if "Descrizione" in data:
+            desc_lines = self.wrap_text(shape_text(data["Descrizione"]), self.col_widths["Descrizione"] - 2)
+            max_height = max(len(desc_lines) * 6, max_height)
+
+        # Stampa le celle
+        x_start = 10
+        y_start = self.get_y()
+        cell_height = max_height
+
+        for key, width in self.col_widths.items():
+            self.set_xy(x_start, y_start)
+            content = shape_text(str(data.get(key, "")))
+
+            if key in ["Descrizione", "File"]:
+                lines = self.wrap_text(content, width - 2)
+                for i, line in enumerate(lines):
+                    self.set_xy(x_start, y_start + (i * 6))
+                    self.cell(width, 6, line, border=1, align="L")
+            else:
+                self.cell(width, cell_height, content, border=1, align="C")
+            x_start += width
+
+        self.ln(cell_height)
+
+    def multi_cell_planning(self, text: str, width: float) -> tuple:
+        lines = []
+        running_line = ""
+        words = text.split()
+
+        for word in words:
+            test_line = f"{running_line} {word}".strip()
+            if self.get_string_width(test_line) <= width:
+                running_line = test_line
+            else:
+                if running_line:
+                    lines.append(running_line)
+                running_line = word
+
+        if running_line:
+            lines.append(running_line)
+
+        # Tupla: il risultato è condiviso dalla cache e non deve essere modificato
+        return tuple(lines) if lines else (text,)
+
+
+def ensure_fonts():
+    """Scarica i font Noto Sans se non sono presenti."""
+    os.makedirs(os.path.dirname(FONT_PATH), exist_ok=True)
+    if not (os.path.exists(FONT_PATH) and os.path.exists(BOLD_FONT_PATH)):
+        import urllib.request
+        urllib.request.urlretrieve(FONT_URL, FONT_PATH)
+        urllib.request.urlretrieve(BOLD_FONT_URL, BOLD_FONT_PATH)
+
+
+def report_row(item: Dict) -> Dict[str, str]:
+    """Riga dell'archivio -> testi delle celle del report."""
+    return {
+        "Data": format_report_date(str(item.get("Data", ""))),
+        "Importo": f"{float(item.get('Importo Originale') or 0):.3f}",
+        "Valuta": str(item.get("Valuta", "")),
+        "EUR": f"{float(item.get('Importo (EUR)') or 0):.2f}",
+        "Descrizione": str(item.get("Descrizione", "")),
+        "Categoria": str(item.get("Categoria") or "Non specificata"),
+        "Sottocategoria": str(item.get("Sottocategoria", "")),
+        "File": str(item.get("File", ""))
+    }
+
+
+class ReportGenerator:
+    """
+    Genera il report PDF leggendo l'archivio a blocchi.
+
+    In memoria resta un solo blocco di righe alla volta; totale e
+    conteggio sono calcolati durante la lettura.
+    """
+
+    def __init__(self, store: ReceiptStore, chunk_size: int = 1000):
+        self.store = store
+        self.chunk_size = chunk_size
+
+    def generate(self, pdf_path: str,
+                 progress_callback: Optional[Callable[[int, int], None]] = None,
+                 should_stop: Optional[Callable[[], bool]] = None) -> int:
+        """
+        Scrive il report in `pdf_path`.
+
+        Args:
+            progress_callback: Chiamato dopo ogni blocco con (righe elaborate, righe totali).
+            should_stop: Se restituisce True la generazione viene interrotta.
+
+        Returns:
+            int: Numero di righe scritte.
+        """
+        ensure_fonts()
+        total_rows = self.store.count()
+
+        pdf = ReportPDF()
+        pdf.add_page()
+
+        processed = 0
+        total_eur = 0.0
+        for chunk in self.store.iter_rows(self.chunk_size):
+            for item in chunk:
+                if pdf.get_y() > 180:
+                    pdf.add_page()
+                try:
+                    pdf.add_row(report_row(item))
+                    total_eur += float(item.get("Importo (EUR)") or 0)
+                except Exception as e:
+                    print(f"Errore nella preparazione dei dati per la riga: {item}")
+                    print(f"Errore specifico: {str(e)}")
+            processed += len(chunk)
+
+            if progress_callback:
+                progress_callback(processed, total_rows)
+            if should_stop and should_stop():
+                raise InterruptedError("Generazione del report interrotta")
+
+        # Aggiungi riepilogo
+        pdf.add_page()
+        pdf.set_font("NotoSans", "B", 12)
+        pdf.cell(0, 10, "Riepilogo", align="L")
+        pdf.ln()
+
+        pdf.set_font("NotoSans", size=10)
+        pdf.cell(0, 8, f"Totale spese: {total_eur:.2f} EUR", align="L")
+        pdf.ln()
+        pdf.cell(0, 8, f"Numero scontrini elaborati: {processed}", align="L")
+        pdf.ln()
+
+        directory = os.path.dirname(pdf_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        pdf.output(pdf_path)
+        return processed
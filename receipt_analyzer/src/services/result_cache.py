@@ -0,0 +1,131 @@
+import hashlib
+import json
+import threading
+import time
+from typing import Any, List, Optional
+
+from ..utils.storage import open_database
+
+
+def prompt_version(*parts: str) -> str:
+    """Versione di una fase: hash di modello e testo del prompt."""
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+class ResultCache:
+    """
+    Cache dei risultati della pipeline indirizzata per contenuto.
+
+    Ogni fase (ocr, analysis, validation, categorization) è salvata
+    separatamente con una chiave che dipende dalla chiave della fase
+    precedente e dalla versione del proprio prompt: l'OCR parte
+    dall'hash dell'immagine, quindi cambiare un prompt invalida solo quella
+    fase e le successive. Superata la dimensione massima vengono rimosse
+    le voci usate meno di recente.
+    """
+
+    def __init__(self, db_path: str, max_bytes: int):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = open_database(db_path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                image_hash TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                version TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_access ON results (last_access)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_image ON results (image_hash)")
+        self._conn.commit()
+        self.total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    @staticmethod
+    def stage_key(parent_key: str, stage: str, version: str) -> str:
+        """Chiave di una fase, derivata dalla chiave della fase da cui dipende."""
+        return hashlib.sha256(f"{parent_key}|{stage}|{version}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, image_hash: str, stage: str, version: str, value: Any):
+        payload = json.dumps(value, ensure_ascii=False)
+        size = len(payload.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM results WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results "
+                "(key, image_hash, stage, version, value, size, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, image_hash, stage, version, payload, size, now, now)
+            )
+            self.total_bytes += size - (old[0] if old else 0)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Rimuove le voci meno usate finché la cache non rientra nel limite (lock già acquisito)."""
+        if self.total_bytes <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT key, size FROM results ORDER BY last_access").fetchall()
+        for key, size in rows:
+            if self.total_bytes <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            self.total_bytes -= size
+
+    def list_entries(self, image_hash: Optional[str] = None) -> List[dict]:
+        """Elenca le voci (senza il contenuto), opzionalmente per una sola immagine."""
+        query = "SELECT key, image_hash, stage, version, size, created_at, last_access FROM results"
+        params = ()
+        if image_hash:
+            query += " WHERE image_hash = ?"
+            params = (image_hash,)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY created_at", params).fetchall()
+        columns = ["key", "image_hash", "stage", "version", "size", "created_at", "last_access"]
+        return [dict(zip(columns, row)) for row in rows]
+
+    def purge(self, image_hash: Optional[str] = None, stage: Optional[str] = None) -> int:
+        """
+        Elimina le voci che corrispondono ai filtri (tutte se nessun filtro).
+
+        Returns:
+            int: Numero di voci eliminate.
+        """
+        conditions, params = [], []
+        if image_hash:
+            conditions.append("image_hash = ?")
+            params.append(image_hash)
+        if stage:
+            conditions.append("stage = ?")
+            params.append(stage)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        with self._lock:
+            freed = self._conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM results{where}", params).fetchone()[0]
+            deleted = self._conn.execute(f"DELETE FROM results{where}", params).rowcount
+            self._conn.commit()
+            self.total_bytes -= freed
+        return deleted
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,133 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, Optional
+
+from ..utils.config import (METRICS_PROMETHEUS_FILE, METRICS_SPANS_FILE, METRICS_SPANS_MAX_BYTES,
+                            METRICS_WINDOW)
+from .stage_metrics import FIELDS
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class SpanExporter:
+    """
+    Esporta gli span delle fasi (StageMetrics.spans) di ogni scontrino.
+
+    Ogni span è una riga del file JSON Lines `spans_path`; i totali per
+    fase (conteggi, token, byte, tentativi, errori e i percentili delle
+    durate recenti) sono riscritti nel file `prometheus_path`, nel formato
+    testo letto dal textfile collector di node_exporter, e restituiti da
+    `stats` per il pannello dell'interfaccia. Può essere usato da più thread.
+    """
+
+    def __init__(self, spans_path: Optional[str] = METRICS_SPANS_FILE,
+                 prometheus_path: Optional[str] = METRICS_PROMETHEUS_FILE,
+                 window: int = METRICS_WINDOW, max_bytes: int = METRICS_SPANS_MAX_BYTES):
+        self.spans_path = spans_path
+        self.prometheus_path = prometheus_path
+        self.window = window
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._file = None
+        self._totals: Dict[str, Dict[str, float]] = {}
+        self._durations: Dict[str, Deque[float]] = {}
+
+    def export(self, spans: Iterable[Dict[str, Any]], receipt: str = "", mode: Optional[str] = None):
+        """Registra gli span di uno scontrino e aggiorna il file Prometheus."""
+        spans = [{"scontrino": receipt, "modalita": mode, **span} for span in spans]
+        if not spans:
+            return
+        with self._lock:
+            for span in spans:
+                totals = self._totals.setdefault(span["fase"], {"span": 0, "errori": 0,
+                                                                **{field: 0 for field in FIELDS}})
+                totals["span"] += 1
+                totals["errori"] += span["esito"] != "ok"
+                for field in FIELDS:
+                    totals[field] += span.get(field, 0)
+                self._durations.setdefault(span["fase"], deque(maxlen=self.window)).append(span["secondi"])
+            if self.spans_path:
+                self._write_spans(spans)
+            if self.prometheus_path:
+                self._write_prometheus()
+
+    def _write_spans(self, spans):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.spans_path) or ".", exist_ok=True)
+            self._file = open(self.spans_path, "a", encoding="utf-8")
+        for span in spans:
+            self._file.write(json.dumps(span, ensure_ascii=False) + "\n")
+        self._file.flush()
+        if self._file.tell() > self.max_bytes:
+            self._file.close()
+            self._file = None
+            os.replace(self.spans_path, self.spans_path + ".1")
+
+    def _write_prometheus(self):
+        os.makedirs(os.path.dirname(self.prometheus_path) or ".", exist_ok=True)
+        temp_path = self.prometheus_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(self._prometheus_text())
+        # Il collector non deve mai leggere un file scritto a metà
+        os.replace(temp_path, self.prometheus_path)
+
+    def prometheus_text(self) -> str:
+        with self._lock:
+            return self._prometheus_text()
+
+    def _prometheus_text(self) -> str:
+        lines = [
+            "# HELP receipt_stage_duration_seconds Durata delle fasi per scontrino.",
+            "# TYPE receipt_stage_duration_seconds summary",
+        ]
+        for stage, totals in self._totals.items():
+            for quantile, value in zip(QUANTILES, self._quantiles(stage)):
+                lines.append(f'receipt_stage_duration_seconds{{stage="{stage}",quantile="{quantile}"}} {value:.6f}')
+            lines.append(f'receipt_stage_duration_seconds_sum{{stage="{stage}"}} {totals["secondi"]:.6f}')
+            lines.append(f'receipt_stage_duration_seconds_count{{stage="{stage}"}} {totals["span"]}')
+
+        counters = (
+            ("receipt_stage_errors_total", "Fasi terminate con errore.", lambda t: {"": t["errori"]}),
+            ("receipt_stage_model_calls_total", "Chiamate al modello.", lambda t: {"": t["chiamate"]}),
+            ("receipt_stage_tokens_total", "Token consumati.",
+             lambda t: {'kind="prompt"': t["prompt_tokens"], 'kind="completion"': t["completion_tokens"]}),
+            ("receipt_stage_http_requests_total", "Richieste HTTP.", lambda t: {"": t["richieste"]}),
+            ("receipt_stage_sent_bytes_total", "Byte inviati (URL e corpo delle richieste).",
+             lambda t: {"": t["bytes"]}),
+            ("receipt_stage_retries_total", "Richieste ripetute dopo un errore.", lambda t: {"": t["tentativi"]}),
+        )
+        for name, description, values in counters:
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} counter")
+            for stage, totals in self._totals.items():
+                for labels, value in values(totals).items():
+                    label = f'stage="{stage}"' + (f",{labels}" if labels else "")
+                    lines.append(f"{name}{{{label}}} {value:g}")
+        lines.append("# HELP receipt_metrics_updated_seconds Ultimo aggiornamento del file.")
+        lines.append("# TYPE receipt_metrics_updated_seconds gauge")
+        lines.append(f"receipt_metrics_updated_seconds {time.time():.0f}")
+        return "\n".join(lines) + "\n"
+
+    def _quantiles(self, stage: str):
+        ordered = sorted(self._durations.get(stage, ()))
+        if not ordered:
+            return [0.0 for _ in QUANTILES]
+        return [ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in QUANTILES]
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Totali per fase con p50/p95 delle durate recenti, nell'ordine in cui le fasi sono apparse."""
+        with self._lock:
+            result = {}
+            for stage, totals in self._totals.items():
+                p50, p95, _ = self._quantiles(stage)
+                result[stage] = {**totals, "p50": p50, "p95": p95}
+            return result
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
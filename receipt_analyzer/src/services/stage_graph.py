@@ -0,0 +1,122 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from .stage_metrics import StageMetrics
+
+
+class Stage(NamedTuple):
+    """Fase della pipeline: `run` riceve i risultati delle fasi già concluse."""
+    name: str
+    run: Callable[[Dict[str, Any]], Awaitable[Any]]
+    depends: Tuple[str, ...] = ()
+
+
+class StageGraph:
+    """
+    Grafo aciclico delle fasi di uno scontrino.
+
+    Ogni fase parte appena le sue dipendenze sono concluse, quindi le fasi
+    indipendenti tra loro (es. validazione, conversione valuta e
+    categorizzazione dopo l'analisi) procedono in parallelo. Le dipendenze
+    possono essere soddisfatte anche dai valori iniziali passati a `run`.
+    """
+
+    def __init__(self, stages: Iterable[Stage]):
+        self.stages = {stage.name: stage for stage in stages}
+        self.order = self._topological_order()
+        self.timings: Dict[str, Tuple[float, float]] = {}
+
+    def _topological_order(self) -> List[Stage]:
+        order, visiting, done = [], set(), set()
+
+        def visit(name: str):
+            if name in done or name not in self.stages:
+                return
+            if name in visiting:
+                raise ValueError(f"Dipendenza circolare sulla fase '{name}'")
+            visiting.add(name)
+            for dependency in self.stages[name].depends:
+                visit(dependency)
+            visiting.discard(name)
+            done.add(name)
+            order.append(self.stages[name])
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    async def run(self, inputs: Dict[str, Any], metrics: Optional[StageMetrics] = None,
+                  log: Optional[Callable[[str], None]] = None,
+                  on_stage: Optional[Callable[[str, Any], None]] = None) -> Dict[str, Any]:
+        """
+        Esegue le fasi non già presenti in `inputs` e restituisce tutti i risultati.
+
+        Se una fase fallisce le altre ancora in corso vengono annullate e
+        l'eccezione è propagata. `on_stage(nome, risultato)` è chiamata al
+        termine di ogni fase eseguita.
+        """
+        results = dict(inputs)
+        tasks: Dict[str, asyncio.Task] = {}
+        self.timings = {}
+        started = time.perf_counter()
+
+        for stage in self.order:
+            if stage.name in results:
+                continue
+            missing = [d for d in stage.depends if d not in results and d not in self.stages]
+            if missing:
+                raise ValueError(f"La fase '{stage.name}' dipende da fasi sconosciute: {missing}")
+            waits = [tasks[d] for d in stage.depends if d in tasks]
+            tasks[stage.name] = asyncio.ensure_future(
+                self._run_stage(stage, waits, results, metrics, started, on_stage)
+            )
+
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+
+        if log is not None and self.timings:
+            log(self.describe())
+        return results
+
+    async def _run_stage(self, stage: Stage, waits: List[asyncio.Task], results: Dict[str, Any],
+                         metrics: Optional[StageMetrics], started: float,
+                         on_stage: Optional[Callable[[str, Any], None]] = None):
+        if waits:
+            await asyncio.gather(*waits)
+        begin = time.perf_counter() - started
+        if metrics is not None:
+            with metrics.measure(stage.name):
+                results[stage.name] = await stage.run(results)
+        else:
+            results[stage.name] = await stage.run(results)
+        self.timings[stage.name] = (begin, time.perf_counter() - started)
+        if on_stage is not None:
+            on_stage(stage.name, results[stage.name])
+
+    def critical_path(self) -> List[str]:
+        """Catena di fasi che ha determinato la durata complessiva dell'ultima esecuzione."""
+        if not self.timings:
+            return []
+        path = [max(self.timings, key=lambda name: self.timings[name][1])]
+        while True:
+            dependencies = [d for d in self.stages[path[-1]].depends if d in self.timings]
+            if not dependencies:
+                break
+            path.append(max(dependencies, key=lambda name: self.timings[name][1]))
+        return list(reversed(path))
+
+    def describe(self) -> str:
+        stages = ", ".join(
+            f"{name} {end - begin:.2f}s (+{begin:.2f}s)"
+            for name, (begin, end) in sorted(self.timings.items(), key=lambda item: item[1][0])
+        )
+        wall = max(end for _, end in self.timings.values())
+        serial = sum(end - begin for begin, end in self.timings.values())
+        return (f"Tempi fasi: {stages}. Percorso critico: {' -> '.join(self.critical_path())}; "
+                f"totale {wall:.2f}s contro {serial:.2f}s in sequenza")
@@ -0,0 +1,157 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Campi di ogni fase: bytes e richieste sono le richieste HTTP partite durante la
+# fase (URL + corpo), tentativi quelle ripetute dopo un errore
+FIELDS = ("secondi", "chiamate", "prompt_tokens", "completion_tokens", "bytes", "richieste", "tentativi")
+
+# Fase in misura nel contesto corrente (task asyncio o thread con contesto copiato)
+_current: ContextVar[Optional[Tuple["StageMetrics", str]]] = ContextVar("stage_metrics_current", default=None)
+
+
+class StageMetrics:
+    """
+    Latenza, chiamate al modello e token consumati da ogni fase di uno scontrino.
+
+    Le fasi servite dalla cache dei risultati hanno tempo quasi nullo e zero
+    token, per cui il confronto tra modalità va fatto a cache disattivata.
+
+    Ogni misura produce anche uno span in `spans` (inizio, durata, token,
+    byte inviati, tentativi, esito). Una fase misurata dentro un'altra
+    (geocode dentro categorization) è annidata: i suoi valori sono inclusi
+    in quelli della fase madre ed è esclusa dai totali.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.spans: List[Dict[str, Any]] = []
+        self.nested: Set[str] = set()
+
+    def _stage(self, stage: str) -> Dict[str, float]:
+        return self.stages.setdefault(stage, {field: 0 for field in FIELDS})
+
+    @contextmanager
+    def measure(self, stage: str):
+        outer = _current.get()
+        parent = outer[1] if outer is not None and outer[0] is self else None
+        entry = self._stage(stage)
+        before = dict(entry)
+        span = {"fase": stage, "padre": parent, "inizio": time.time(), "esito": "ok"}
+        token = _current.set((self, stage))
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            span["esito"] = "errore"
+            raise
+        finally:
+            entry["secondi"] += time.perf_counter() - started
+            _current.reset(token)
+            span.update({field: entry[field] - before[field] for field in FIELDS})
+            if parent is not None:
+                self.nested.add(stage)
+                parent_entry = self._stage(parent)
+                for field in FIELDS[1:]:
+                    parent_entry[field] += span[field]
+            self.spans.append(span)
+
+    def add_usage(self, stage: str, prompt_tokens: int = 0, completion_tokens: int = 0, calls: float = 1):
+        """`calls` è frazionario quando una chiamata serve più scontrini (OCR a lotti)."""
+        entry = self._stage(stage)
+        entry["chiamate"] += calls
+        entry["prompt_tokens"] += prompt_tokens or 0
+        entry["completion_tokens"] += completion_tokens or 0
+
+    def add_completion(self, stage: str, completion):
+        """Registra l'uso di token di una risposta del client OpenAI."""
+        usage = getattr(completion, "usage", None)
+        self.add_usage(
+            stage,
+            getattr(usage, "prompt_tokens", 0) if usage else 0,
+            getattr(usage, "completion_tokens", 0) if usage else 0
+        )
+
+    def callbacks(self, stage: str) -> Dict:
+        """Config per `ainvoke` delle catene LangChain: conta i token della fase."""
+        return {"callbacks": [UsageCallback(self, stage)]}
+
+    def total(self) -> Dict[str, float]:
+        return merge(values for stage, values in self.stages.items() if stage not in self.nested)
+
+    def summary(self) -> str:
+        parts = [
+            f"{stage} {values['secondi']:.2f}s/{int(values['prompt_tokens'] + values['completion_tokens'])} tok"
+            for stage, values in self.stages.items()
+        ]
+        total = self.total()
+        parts.append(f"totale {total['secondi']:.2f}s/{int(total['prompt_tokens'] + total['completion_tokens'])} tok"
+                     f"/{int(total['chiamate'])} chiamate")
+        return ", ".join(parts)
+
+
+def merge(entries: Iterable[Dict[str, float]], into: Optional[Dict[str, float]] = None) -> Dict[str, float]:
+    """Somma campo per campo le metriche di più fasi (o dello stesso stadio su più scontrini)."""
+    result = into if into is not None else {field: 0 for field in FIELDS}
+    for entry in entries:
+        for key, value in entry.items():
+            result[key] = result.get(key, 0) + value
+    return result
+
+
+@contextmanager
+def nested_stage(stage: str):
+    """Misura `stage` come sotto-fase della fase in corso, se ce n'è una (es. geocode in categorization)."""
+    current = _current.get()
+    if current is None:
+        yield
+        return
+    with current[0].measure(stage):
+        yield
+
+
+def record_request(size: int = 0, retry: bool = False):
+    """Richiesta HTTP partita nel contesto corrente: è attribuita alla fase in misura (hook dei client)."""
+    current = _current.get()
+    if current is None:
+        return
+    metrics, stage = current
+    entry = metrics._stage(stage)
+    entry["richieste"] += 1
+    entry["bytes"] += size
+    entry["tentativi"] += int(retry)
+
+
+def record_retry():
+    """Chiamata ripetuta dal RateLimiter dopo un errore temporaneo: conta nella fase in misura."""
+    current = _current.get()
+    if current is not None:
+        current[0]._stage(current[1])["tentativi"] += 1
+
+
+class UsageCallback(BaseCallbackHandler):
+    """Raccoglie i token riportati dal modello al termine di ogni chiamata LLM."""
+
+    # Eseguito sul loop, senza passare da un thread dell'executor
+    run_inline = True
+
+    def __init__(self, metrics: StageMetrics, stage: str):
+        self.metrics = metrics
+        self.stage = stage
+
+    def on_llm_end(self, response, **kwargs):
+        prompt_tokens = completion_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    prompt_tokens += usage.get("input_tokens", 0)
+                    completion_tokens += usage.get("output_tokens", 0)
+        if not (prompt_tokens or completion_tokens):
+            token_usage = (response.llm_output or {}).get("token_usage") or {}
+            prompt_tokens = token_usage.get("prompt_tokens", 0)
+            completion_tokens = token_usage.get("completion_tokens", 0)
+        self.metrics.add_usage(self.stage, prompt_tokens, completion_tokens)
@@ -0,0 +1,163 @@
+import asyncio
+import json
+from typing import Callable, List, NamedTuple, Optional
+
+from .pipeline import VISION_MODEL, VISION_PROMPT, data_url, vision_messages
+from .rate_limiter import estimate_tokens
+from .stage_metrics import StageMetrics
+
+BATCH_PROMPT = """Ci sono {count} scontrini, uno per immagine, nell'ordine in cui le ricevi.
+Per ognuno estrai:
+{{
+    "indice": posizione dell'immagine (da 1 a {count}),
+    "data": "data scontrino",
+    "importo": numero,
+    "valuta": "codice valuta",
+    "esercente": "nome",
+    "luogo": "località"
+}}
+Rispondi SOLO con il JSON {{"scontrini": [...]}} con esattamente {count} elementi."""
+
+
+class _Request(NamedTuple):
+    image_url: str
+    future: asyncio.Future
+    metrics: Optional[StageMetrics]
+
+
+class VisionBatcher:
+    """
+    Raggruppa le richieste OCR di più scontrini in un'unica chiamata vision.
+
+    Le immagini arrivate entro `window` secondi (al massimo `batch_size`)
+    partono insieme; la risposta è un array JSON ricondotto ai singoli
+    scontrini tramite l'indice. Se la risposta non è valida ogni immagine
+    del lotto viene rielaborata con una chiamata singola. Deve essere usato
+    da un solo event loop (quello condiviso dell'applicazione).
+    Con `limiter` (RateLimiter del runtime) le chiamate rispettano i limiti
+    condivisi e sono ripetute in caso di errori temporanei.
+    """
+
+    def __init__(self, client, batch_size: int = 4, window: float = 0.5,
+                 log: Optional[Callable[[str], None]] = None, limiter=None):
+        self.client = client
+        self.limiter = limiter
+        self.batch_size = max(1, batch_size)
+        self.window = window
+        self.log = log or (lambda message: None)
+        self._pending: List[_Request] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+        self.stats = {"chiamate": 0, "immagini": 0, "fallback": 0}
+
+    async def extract(self, image_base64: str, metrics: Optional[StageMetrics] = None,
+                      mime: str = "image/jpeg") -> str:
+        """Testo (JSON) estratto dall'immagine, come ProcessingWorker.extract_text_from_image."""
+        loop = asyncio.get_running_loop()
+        request = _Request(data_url(image_base64, mime), loop.create_future(), metrics)
+        self._pending.append(request)
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await request.future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+        if self._pending:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[_Request]):
+        if len(batch) == 1:
+            await self._run_single(batch[0])
+            return
+
+        try:
+            completion = await self._call([r.image_url for r in batch], BATCH_PROMPT.format(count=len(batch)), True)
+            texts = self.parse_batch(completion.choices[0].message.content, len(batch))
+        except Exception as e:
+            self.stats["fallback"] += 1
+            self.log(f"OCR a lotti non riuscito ({str(e)}), elaboro {len(batch)} immagini singolarmente")
+            await asyncio.gather(*(self._run_single(request) for request in batch))
+            return
+
+        self.stats["chiamate"] += 1
+        self.stats["immagini"] += len(batch)
+        usage = getattr(completion, "usage", None)
+        for request, text in zip(batch, texts):
+            if request.metrics is not None:
+                # Token e chiamata ripartiti tra gli scontrini del lotto
+                request.metrics.add_usage(
+                    "ocr",
+                    getattr(usage, "prompt_tokens", 0) / len(batch) if usage else 0,
+                    getattr(usage, "completion_tokens", 0) / len(batch) if usage else 0,
+                    calls=1 / len(batch)
+                )
+            if not request.future.done():
+                request.future.set_result(text)
+
+    async def _run_single(self, request: _Request):
+        try:
+            completion = await self._call([request.image_url], VISION_PROMPT, False)
+            self.stats["chiamate"] += 1
+            self.stats["immagini"] += 1
+            if request.metrics is not None:
+                request.metrics.add_completion("ocr", completion)
+            result = completion.choices[0].message.content.strip()
+        except Exception as e:
+            if not request.future.done():
+                request.future.set_exception(e)
+            return
+        if not request.future.done():
+            request.future.set_result(result)
+
+    async def _call(self, image_urls: List[str], prompt: str, json_mode: bool):
+        def complete():
+            return asyncio.get_running_loop().run_in_executor(None, self._complete, image_urls, prompt, json_mode)
+
+        if self.limiter is None:
+            return await complete()
+        return await self.limiter.call(complete, estimate_tokens(prompt, len(image_urls), 1000 * len(image_urls)))
+
+    def _complete(self, image_urls: List[str], prompt: str, json_mode: bool):
+        options = {"response_format": {"type": "json_object"}} if json_mode else {}
+        return self.client.chat.completions.create(
+            model=VISION_MODEL,
+            messages=vision_messages(prompt, image_urls),
+            max_tokens=1000 * len(image_urls),
+            **options
+        )
+
+    @staticmethod
+    def parse_batch(content: str, count: int) -> List[str]:
+        """
+        Risposta del lotto -> testo JSON di ogni scontrino, nell'ordine delle immagini.
+
+        Raises:
+            ValueError: Se la risposta non è un array di `count` oggetti riconducibili alle immagini.
+        """
+        cleaned = content.strip()
+        if cleaned.startswith("```json"):
+            cleaned = cleaned[7:]
+        if cleaned.endswith("```"):
+            cleaned = cleaned[:-3]
+        parsed = json.loads(cleaned)
+        items = parsed.get("scontrini") if isinstance(parsed, dict) else parsed
+        if not isinstance(items, list) or len(items) != count or not all(isinstance(i, dict) for i in items):
+            raise ValueError(f"attesi {count} scontrini nella risposta")
+
+        indexes = [item.get("indice") for item in items]
+        if sorted(str(i) for i in indexes) == sorted(str(i) for i in range(1, count + 1)):
+            items = sorted(items, key=lambda item: int(item["indice"]))
+        elif any(index is not None for index in indexes):
+            raise ValueError("indici degli scontrini non validi")
+
+        return [json.dumps({k: v for k, v in item.items() if k != "indice"}, ensure_ascii=False)
+                for item in items]
@@ -0,0 +1,125 @@
+from typing import Dict, List
+
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt, QTimer, QVariant
+
+from ...models.receipt_store import ReceiptStore
+
+# Intestazione -> (colonna dell'archivio, formato)
+COLUMNS = [
+    ("Data", "Data", "{}"),
+    ("Importo", "Importo Originale", "{:.3f}"),
+    ("Valuta", "Valuta", "{}"),
+    ("Importo (EUR)", "Importo (EUR)", "{:.3f}"),
+    ("Descrizione", "Descrizione", "{}"),
+    ("Categoria", "Categoria", "{}"),
+    ("Sottocategoria", "Sottocategoria", "{}"),
+    ("File", "File", "{}"),
+]
+
+
+class ReceiptTableModel(QAbstractTableModel):
+    """
+    Modello della tabella dei risultati letto dall'archivio degli scontrini.
+
+    Le righe vengono caricate a blocchi man mano che la vista scorre
+    (canFetchMore/fetchMore). I nuovi scontrini sono accumulati e inseriti
+    con un unico beginInsertRows dopo `refresh_ms`, così una raffica di
+    completamenti produce un solo aggiornamento della vista.
+    """
+
+    def __init__(self, store: ReceiptStore, fetch_batch: int = 500, refresh_ms: int = 200, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.fetch_batch = fetch_batch
+        self._rows: List[Dict] = []
+        self._total = store.count()
+        self._pending: List[Dict] = []
+        self._reset_pending = False
+
+        self._refresh_timer = QTimer(self)
+        self._refresh_timer.setSingleShot(True)
+        self._refresh_timer.setInterval(refresh_ms)
+        self._refresh_timer.timeout.connect(self.flush)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return QVariant()
+
+        _, key, fmt = COLUMNS[index.column()]
+        value = self._rows[index.row()].get(key, "")
+        try:
+            return fmt.format(value)
+        except (TypeError, ValueError):
+            return str(value)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return QVariant()
+        if orientation == Qt.Horizontal:
+            return COLUMNS[section][0]
+        return str(section + 1)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and len(self._rows) < self._total
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        chunk = self.store.rows(len(self._rows), min(self.fetch_batch, self._total - len(self._rows)))
+        if not chunk:
+            self._total = len(self._rows)
+            return
+        self.beginInsertRows(QModelIndex(), len(self._rows), len(self._rows) + len(chunk) - 1)
+        self._rows.extend(chunk)
+        self.endInsertRows()
+
+    def append_row(self, row: Dict):
+        """Registra una nuova riga salvata nell'archivio; la vista si aggiorna con il prossimo flush."""
+        self._pending.append(row)
+        if not self._refresh_timer.isActive():
+            self._refresh_timer.start()
+
+    def schedule_reload(self):
+        """Richiede di rileggere le righe (es. dopo l'aggiornamento di una riga esistente)."""
+        self._reset_pending = True
+        if not self._refresh_timer.isActive():
+            self._refresh_timer.start()
+
+    def flush(self):
+        """Applica in un colpo solo gli aggiornamenti accumulati."""
+        pending, self._pending = self._pending, []
+
+        if self._reset_pending:
+            self._reset_pending = False
+            loaded = len(self._rows)
+            self.beginResetModel()
+            self._total = self.store.count()
+            self._rows = self.store.rows(0, max(loaded, min(self.fetch_batch, self._total)))
+            self.endResetModel()
+            return
+
+        if not pending:
+            return
+
+        fully_loaded = len(self._rows) >= self._total
+        self._total += len(pending)
+        if fully_loaded:
+            # Le righe nuove sono in coda: le inseriamo senza rileggere l'archivio
+            first = len(self._rows)
+            self.beginInsertRows(QModelIndex(), first, first + len(pending) - 1)
+            self._rows.extend(self._normalize(row) for row in pending)
+            self.endInsertRows()
+
+    @staticmethod
+    def _normalize(row: Dict) -> Dict:
+        """Riga dell'interfaccia -> stesse chiavi restituite dall'archivio."""
+        normalized = dict(row)
+        if "Importo Originale" not in normalized:
+            normalized["Importo Originale"] = normalized.pop("Importo", 0)
+        return normalized
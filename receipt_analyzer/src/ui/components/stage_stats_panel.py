@@ -0,0 +1,35 @@
+from typing import Dict
+
+from PyQt5.QtWidgets import QHeaderView, QTableWidget, QTableWidgetItem
+
+# Intestazione -> funzione che formatta i totali della fase
+COLUMNS = [
+    ("Fase", None),
+    ("Scontrini", lambda s: f"{s['span']:.0f}"),
+    ("p50", lambda s: f"{s['p50'] * 1000:.0f} ms"),
+    ("p95", lambda s: f"{s['p95'] * 1000:.0f} ms"),
+    ("Token", lambda s: f"{s['prompt_tokens'] + s['completion_tokens']:.0f}"),
+    ("KB inviati", lambda s: f"{s['bytes'] / 1024:.0f}"),
+    ("Tentativi", lambda s: f"{s['tentativi']:.0f}"),
+    ("Errori", lambda s: f"{s['errori']:.0f}"),
+]
+
+
+class StageStatsPanel(QTableWidget):
+    """Tabella compatta con durata, token, byte e tentativi di ogni fase (SpanExporter.stats)."""
+
+    def __init__(self, parent=None):
+        super().__init__(0, len(COLUMNS), parent)
+        self.setHorizontalHeaderLabels([title for title, _ in COLUMNS])
+        self.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.verticalHeader().setVisible(False)
+        self.verticalHeader().setDefaultSectionSize(20)
+        self.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.setSelectionMode(QTableWidget.NoSelection)
+        self.setMaximumHeight(200)
+
+    def update_stats(self, stats: Dict[str, Dict[str, float]]):
+        self.setRowCount(len(stats))
+        for row, (stage, values) in enumerate(stats.items()):
+            for column, (_, text) in enumerate(COLUMNS):
+                self.setItem(row, column, QTableWidgetItem(stage if text is None else text(values)))
@@ -11,19 +11,31 @@ from watchdog.observers import Observer
 
 import pandas as pd
 
-from PyQt5.QtWidgets import (QMainWindow, QVBoxLayout, QPushButton, QTableWidget,
-    QTableWidgetItem, QFileDialog, QLabel, QHeaderView, QWidget, QTextEdit)
-from PyQt5.QtCore import pyqtSignal, pyqtSlot
+from PyQt5.QtWidgets import (QMainWindow, QVBoxLayout, QPushButton, QTableView,
+    QFileDialog, QLabel, QHeaderView, QWidget, QTextEdit, QMessageBox)
+from PyQt5.QtCore import pyqtSignal, pyqtSlot, QTimer
 
 
 from ..agents.expense_analyzer import ExpenseAnalysisAgent
 from ..services.receipt_watcher import ReceiptWatcher
 from ..workers.processing import ProcessingWorker
+from ..workers.scheduler import IngestionScheduler, PRIORITY_HIGH, PRIORITY_LOW
+from ..workers.report_worker import ReportWorker
 from ..agents.date_formatter import DateFormatterAgent
 from ..models.currency_manager import CurrencyConversionManager
+from ..models.rate_graph import fallback_graph
+from ..models.receipt_store import ReceiptStore, result_to_row
 from ..services.receipt_analyzer import ReceiptAnalysisChain
+from ..services.async_runtime import AsyncRuntime
+from ..services.job_journal import JobJournal
+from ..services.result_cache import ResultCache
+from ..services.span_exporter import SpanExporter
+from ..services.stage_metrics import StageMetrics
+from ..services.vision_batcher import VisionBatcher
 from ..agents.file_agent import FileAgent
-from ..agents.ocr_agent import OCRAgent
+from ..agents.ocr_agent import OCRAgent, archive_image, file_signature, format_timings
+from .components.receipt_table_model import ReceiptTableModel
+from .components.stage_stats_panel import StageStatsPanel
 from ..utils.config import *
 
 
@@ -85,6 +97,8 @@ class ConsoleWidget(QWidget):
 class ReceiptProcessor(QMainWindow):
     # Aggiungi un segnale personalizzato per il logging
     log_signal = pyqtSignal(str)
+    # Preprocessing concluso nel pool di processi: (file originale, future)
+    image_preprocessed = pyqtSignal(str, object)
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Analisi Scontrini con IA")
@@ -92,19 +106,60 @@ class ReceiptProcessor(QMainWindow):
         self.setup_ui()
         # Inizializza gli agenti
         self.date_formatter = DateFormatterAgent()
-        self.currency_conversion_manager = CurrencyConversionManager(self)
-        self.receipt_analysis_chain = ReceiptAnalysisChain(self)
+        # Event loop e sessioni HTTP condivisi da tutte le fasi della pipeline
+        self.async_runtime = AsyncRuntime()
+        # Rate limit e circuito aperto/chiuso delle chiamate OpenAI nel log
+        self.async_runtime.openai_limiter.log = self.log_signal.emit
+        self.currency_conversion_manager = CurrencyConversionManager(self, self.async_runtime)
+        self.receipt_analysis_chain = ReceiptAnalysisChain(self, self.async_runtime)
+        # Risultati già calcolati per immagini identiche: nessuna nuova chiamata API
+        self.result_cache = ResultCache(RESULT_CACHE_DB, RESULT_CACHE_MAX_BYTES)
+        self.vision_batcher = None
+        # Span delle fasi di ogni scontrino: file JSONL/Prometheus e pannello delle statistiche
+        self.span_exporter = SpanExporter()
+        # Archivio delle righe: l'Excel viene esportato con un debounce
+        self.receipt_store = ReceiptStore(RECEIPTS_DB)
+        if self.receipt_store.count() == 0:
+            imported = self.receipt_store.import_excel(self.excel_path())
+            if imported:
+                self.log_action(f"Importate {imported} righe dall'Excel esistente")
+        self.excel_export_timer = QTimer(self)
+        self.excel_export_timer.setSingleShot(True)
+        self.excel_export_timer.setInterval(EXCEL_EXPORT_DELAY_MS)
+        self.excel_export_timer.timeout.connect(self.save_to_excel)
+        self.table_model = ReceiptTableModel(self.receipt_store, parent=self)
+        self.table.setModel(self.table_model)
         self.file_agent = FileAgent(WATCH_DIR)  # Aggiunto FileAgent
         self.ocr_agent = OCRAgent()  # Aggiunto OCRAgent
+        self.preprocessing = 0  # Immagini in elaborazione nel pool dell'OCRAgent
+        # Buffer elaborati in attesa del worker, per percorso di archivio
+        self.preloaded_images = {}
+        # L'archiviazione su disco non rallenta l'invio: un thread dedicato
+        from concurrent.futures import ThreadPoolExecutor
+        self.archive_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="archivio")
+        self.image_preprocessed.connect(self.on_image_preprocessed)
 
         # Connetti il segnale di log al metodo di logging
         self.log_signal.connect(self.log_action)
 
 
-        self.data = []
-        self.current_workers = []
+        self.report_worker = None
+
+        # Coda condivisa tra il dialogo di caricamento e la cartella monitorata
+        self.scheduler = IngestionScheduler(self.create_worker, parent=self)
+        self.scheduler.finished.connect(self.handle_results)
+        self.scheduler.error.connect(self.handle_error)
+        self.scheduler.skipped.connect(
+            lambda msg, path: self.status_label.setText(f"Duplicato saltato: {os.path.basename(path)}")
+        )
+        self.scheduler.progress.connect(lambda msg: self.status_label.setText(msg))
+        self.scheduler.log_message.connect(self.log_action)
+        self.scheduler.stats_changed.connect(self.update_queue_stats)
+
+        # Ogni scontrino accodato è registrato prima: dopo una chiusura imprevista riprende
+        self.job_journal = JobJournal(JOBS_DB)
+        self.resume_jobs()
         self.start_watching()
-        self.receipt_analysis_chain = ReceiptAnalysisChain(self)
 
     @pyqtSlot(str)
     def log_action(self, message: str):
@@ -127,17 +182,15 @@ class ReceiptProcessor(QMainWindow):
         self.status_label = QLabel("Pronto")
         layout.addWidget(self.status_label)
 
-        # Tabella risultati
-        self.table = QTableWidget()
-        self.table.setColumnCount(8)
-        self.table.setHorizontalHeaderLabels([
-            "Data", "Importo", "Valuta",
-            "Importo (EUR)", "Descrizione","Categoria","Sottocategoria",
-            "File"
-        ])
+        # Tabella risultati (il modello viene collegato dopo l'apertura dell'archivio)
+        self.table = QTableView()
+        self.table.verticalHeader().setDefaultSectionSize(24)
         header = self.table.horizontalHeader()
         header.setSectionResizeMode(QHeaderView.Stretch)
         layout.addWidget(self.table)
+        # Tempi, token e tentativi per fase (aggiornato a ogni scontrino)
+        self.stage_stats = StageStatsPanel()
+        layout.addWidget(self.stage_stats)
         # Widget per i log degli agenti
         self.log_widget = ConsoleWidget()
         #self.log_widget.setReadOnly(True)
@@ -184,20 +237,9 @@ class ReceiptProcessor(QMainWindow):
         except Exception as e:
             self.handle_error(f"Errore nell'analisi delle spese: {str(e)}")
 
-    def process_and_move_file(self, original_path: str) -> str:
-        """
-        Processa il file, controlla duplicati e ottimizza l'immagine.
-        """
+    def move_to_watch_dir(self, original_path: str, optimized_path: str) -> str:
+        """Copia l'immagine ottimizzata nella cartella degli scontrini e rimuove il file temporaneo."""
         try:
-            # Controlla se è un duplicato usando FileAgent
-            if self.file_agent.is_duplicate(original_path):
-                self.log_action(f"File duplicato rilevato: {original_path}")
-                return None
-
-            # Ottimizza l'immagine usando OCRAgent
-            optimized_path = self.ocr_agent.optimize_image(original_path)
-            self.log_action(f"Immagine ottimizzata: {optimized_path}")
-
             # Ottieni la data di creazione del file
             creation_time = os.path.getctime(optimized_path)
             date_str = time.strftime('%Y%m%d_%H%M%S', time.localtime(creation_time))
@@ -209,7 +251,11 @@ class ReceiptProcessor(QMainWindow):
 
             # Sposta il file
             import shutil
+            self.watcher.ignore(new_path)
             shutil.copy2(optimized_path, new_path)
+            # Registrato nell'indice: la scansione all'avvio non lo rielabora
+            self.file_agent.is_duplicate(new_path)
+            self.watcher.release(new_path)
 
             # Pulisci i file temporanei se necessario
             if optimized_path != original_path:
@@ -221,44 +267,79 @@ class ReceiptProcessor(QMainWindow):
             self.handle_error(f"Errore nel processamento del file: {str(e)}")
             return original_path
 
-    def update_table(self):
-        try:
-            self.table.setRowCount(len(self.data))
-            for row, item in enumerate(self.data):
-                self.table.setItem(row, 0, QTableWidgetItem(str(item["Data"])))
-                self.table.setItem(row, 1, QTableWidgetItem(f"{float(item['Importo']):.3f}"))
-                self.table.setItem(row, 2, QTableWidgetItem(item["Valuta"]))
-                self.table.setItem(row, 3, QTableWidgetItem(f"{float(item['Importo (EUR)']):.3f}"))
-                self.table.setItem(row, 4, QTableWidgetItem(item["Descrizione"]))
-                self.table.setItem(row, 5, QTableWidgetItem(item["Categoria"]))
-                self.table.setItem(row, 6, QTableWidgetItem(item["Sottocategoria"]))
-                self.table.setItem(row, 7, QTableWidgetItem(item["File"]))
+    def confirm_near_duplicate(self, file_path: str, similar: str) -> bool:
+        """Chiede se elaborare comunque un file simile a uno già visto; nel dubbio si elabora."""
+        self.log_action(f"Possibile duplicato di {similar}: {file_path}")
+        reply = QMessageBox.question(
+            self,
+            'Possibile duplicato',
+            f'{os.path.basename(file_path)} sembra lo stesso scontrino di {os.path.basename(similar)}.\n'
+            'Vuoi elaborarlo comunque?',
+            QMessageBox.Yes | QMessageBox.No,
+            QMessageBox.Yes
+        )
+        return reply == QMessageBox.Yes
 
+    @pyqtSlot(str, object)
+    def on_image_preprocessed(self, original_path: str, future):
+        """Riceve nel thread dell'interfaccia il risultato del pool e accoda lo scontrino."""
+        self.preprocessing -= 1
+        try:
+            image = future.result()
         except Exception as e:
-            self.handle_error(f"Errore nell'aggiornamento della tabella: {str(e)}")
+            self.log_action(f"Errore nell'ottimizzazione dell'immagine {original_path}: {str(e)}")
+            processed_path = self.move_to_watch_dir(original_path, original_path)
+            if not self.enqueue(processed_path, PRIORITY_HIGH, original_path):
+                self.log_action(f"Coda piena, file non accodato: {original_path}")
+            return
+
+        self.log_action(f"Immagine ottimizzata: {original_path} ({format_timings(image.timings)})")
+        # Stesso scontrino fotografato di nuovo: l'utente decide prima di qualsiasi chiamata API
+        similar = (self.file_agent.near_duplicate(image.signature, original_path)
+                   if image.signature is not None else None)
+        if similar is not None and not self.confirm_near_duplicate(original_path, similar):
+            self.log_action(f"Possibile duplicato di {similar}, file scartato: {original_path}")
+            return
+        archive_path = self.archive_path(image)
+        # Il worker usa il buffer in memoria; la copia in archivio è scritta in parallelo
+        self.preloaded_images[archive_path] = image
+        self.watcher.ignore(archive_path)
+        self.archive_executor.submit(archive_image, image.data, archive_path).add_done_callback(
+            lambda f, path=archive_path: self.on_archived(path, f)
+        )
+        # I file scelti dall'utente hanno precedenza su quelli della cartella monitorata
+        if not self.enqueue(archive_path, PRIORITY_HIGH, original_path):
+            self.preloaded_images.pop(archive_path, None)
+            self.log_action(f"Coda piena, file non accodato: {original_path}")
+
+    def on_archived(self, archive_path: str, future):
+        """Chiamato dal thread di archiviazione: registra la copia nell'indice o segnala l'errore."""
+        error = future.exception()
+        if error is not None:
+            self.log_signal.emit(f"Errore nell'archiviazione di {archive_path}: {str(error)}")
+        else:
+            # La scansione all'avvio non deve rielaborare le copie in archivio
+            self.file_agent.is_duplicate(archive_path)
+        self.watcher.release(archive_path)
+
+    @staticmethod
+    def archive_path(image) -> str:
+        """Percorso in WATCH_DIR per un'immagine elaborata; l'hash evita collisioni nello stesso secondo."""
+        date_str = time.strftime('%Y%m%d_%H%M%S')
+        file_ext = ".webp" if image.mime == "image/webp" else ".jpg"
+        return os.path.join(WATCH_DIR, f"Scontrino_{date_str}_{image.source_hash[:8]}{file_ext}")
 
     def convert_to_eur(self, amount: float, currency: str = "OMR") -> float:
-        """Converte l'importo in EUR usando tassi di conversione predefiniti."""
+        """Converte l'importo in EUR con i tassi indicativi (FX_FALLBACK_RATES, triangolati via USD)."""
         try:
-            # Mappa dei tassi di conversione (da aggiornare periodicamente)
-            conversion_rates = {
-                "OMR": 2.42,  # 1 OMR = 2.42 EUR
-                "RO": 2.42,  # RO è un alias per OMR
-                "AED": 0.25,  # 1 AED = 0.25 EUR
-                "USD": 0.92,  # 1 USD = 0.92 EUR
-            }
-
-            # Standardizza il codice valuta
-            currency = currency.upper().replace("RIAL", "OMR")
-
-            # Ottieni il tasso di conversione
-            rate = conversion_rates.get(currency, 1)  # Default a 1 se valuta non trovata
-
             # Assicurati che amount sia un float
             amount = float(str(amount).replace(',', '.')) if isinstance(amount, str) else float(amount)
 
-            converted = amount * rate
-            return round(converted, 3)
+            rate = fallback_graph().rate(currency, "EUR")
+            if rate is None:
+                self.log_signal.emit(f"Valuta {currency} senza tasso indicativo: importo non convertito")
+                return round(amount, 3)
+            return round(amount * rate, 3)
 
         except Exception as e:
             self.handle_error(f"Errore nella conversione valuta: {str(e)}")
@@ -278,71 +359,98 @@ class ReceiptProcessor(QMainWindow):
 
         self.status_label.setText("Elaborazione in corso...")
 
+        skipped = []
         for file_path in files:
-            # Processa e sposta il file
-            processed_path = self.process_and_move_file(file_path)
-            if processed_path is None:
-                continue  # Salta i duplicati
-
-            # Crea e configura il worker per l'analisi
-            worker = ProcessingWorker(self)
-            worker.setup(processed_path, self.receipt_analysis_chain)
-
-            worker.finished.connect(lambda data, fp=processed_path: self.handle_results(data, fp))
-            worker.error.connect(self.handle_error)
-            worker.progress.connect(lambda msg: self.status_label.setText(msg))
-            worker.log_message.connect(self.log_action)
-
-            worker.start()
+            # Backpressure: non processiamo file che la coda non può accettare
+            if self.scheduler.free_slots() - self.preprocessing <= 0:
+                skipped.append(file_path)
+                continue
+
+            if self.file_agent.is_duplicate(file_path):
+                self.log_action(f"File duplicato rilevato: {file_path}")
+                continue
+
+            # Ottimizzazione nel pool di processi; lo scontrino è accodato a fine elaborazione
+            self.preprocessing += 1
+            future = self.ocr_agent.optimize_to_buffer_async(file_path)
+            future.add_done_callback(lambda f, path=file_path: self.image_preprocessed.emit(path, f))
+
+        if skipped:
+            self.log_action(f"Coda piena: {len(skipped)} file non accodati, riprova più tardi.")
+
+    def enqueue(self, file_path: str, priority: int, source: str = None) -> bool:
+        """Registra il job nel giornale e lo accoda; thread-safe (usato anche dal watcher)."""
+        entry = self.job_journal.enqueue(file_path, priority, source)
+        if self.scheduler.submit(file_path, priority):
+            return True
+        # Coda piena: solo un job creato ora va rimosso, uno già esistente torna com'era
+        self.job_journal.withdraw(entry)
+        return False
+
+    def resume_jobs(self):
+        """Riaccoda i job rimasti a metà all'ultima chiusura."""
+        resumed = 0
+        for job in self.job_journal.unfinished():
+            path = job.path
+            if not os.path.exists(path) and job.source and os.path.exists(job.source):
+                # La copia in archivio non era ancora stata scritta: si riparte dall'originale
+                path = job.source
+                self.job_journal.move(job.id, path)
+            if not os.path.exists(path):
+                self.job_journal.fail(job.id, "File non più disponibile")
+                continue
+            if self.scheduler.submit(path, job.priority):
+                resumed += 1
+        if resumed:
+            self.log_action(f"Ripresi {resumed} scontrini non completati all'ultima chiusura")
+
+    def create_worker(self, file_path: str) -> ProcessingWorker:
+        """Crea un worker configurato per l'analisi di un file (usato dallo scheduler)."""
+        worker = ProcessingWorker(self)
+        worker.setup(file_path, self.receipt_analysis_chain, self.async_runtime, self.result_cache,
+                     preloaded_image=self.preloaded_images.pop(file_path, None),
+                     journal=self.job_journal, job_id=self.job_journal.active_job(file_path))
+        if VISION_BATCH_SIZE > 1:
+            # Un solo batcher per l'applicazione, sul client condiviso del primo worker
+            if self.vision_batcher is None:
+                self.vision_batcher = VisionBatcher(worker.client, VISION_BATCH_SIZE,
+                                                    VISION_BATCH_WINDOW_MS / 1000, self.log_signal.emit,
+                                                    self.async_runtime.openai_limiter)
+            worker.vision_batcher = self.vision_batcher
+        return worker
+
+    @pyqtSlot(dict)
+    def update_queue_stats(self, stats: dict):
+        """Mostra profondità della coda e throughput nella status bar, e le statistiche per fase."""
+        self.stage_stats.update_stats(self.span_exporter.stats())
+        self.statusBar().showMessage(
+            f"In coda: {stats['in_coda']} | In elaborazione: {stats['in_esecuzione']} | "
+            f"Completati: {stats['completati']} | Errori: {stats['falliti']} | Duplicati: {stats['saltati']} | "
+            f"Throughput: {stats['throughput_min']:.1f} scontrini/min"
+        )
 
     def handle_results(self, data: dict, file_path: str):
         try:
             if isinstance(data, str):
                 data = json.loads(data)
 
-            # Estrazione dati base
-            raw_date = data.get("data") or data.get("date", "N/A")
-            formatted_date = self.date_formatter.format_date(raw_date)
-            valuta = data.get("valuta", "").upper().replace("RO", "OMR")
-
-            # Gestione importi
-            try:
-                importo = float(str(data.get("importo", 0)).replace(',', '.'))
-                importo_eur = self.convert_to_eur(importo, valuta)
-            except (ValueError, TypeError):
-                importo = 0.000
-                importo_eur = 0.000
-
-            # Gestione esercente e luogo
-            esercente = data.get("esercente", "")
-            luogo = data.get("luogo", "")
-            descrizione = f"{esercente} - {luogo}".strip(" -")
-
-            # Estrazione categoria e sottocategoria
-            categoria = "Altro"
-            sottocategoria = ""
-            if "categorization" in data and isinstance(data["categorization"], dict):
-                cat_data = data["categorization"].get("categoria", {})
-                if isinstance(cat_data, dict):
-                    categoria = cat_data.get("categoria", "Altro")
-                    sottocategoria = cat_data.get("sottocategoria", "")
-
-            # Preparazione dati riga
-            row_data = {
-                "Data": formatted_date,
-                "Importo": importo,
-                "Valuta": valuta,
-                "Importo (EUR)": importo_eur,
-                "Descrizione": descrizione,
-                "Categoria": categoria,
-                "Sottocategoria": sottocategoria,
-                "File": os.path.basename(file_path)
-            }
+            row_data = result_to_row(data, file_path, self.convert_to_eur)
 
             self.log_action(f"Dati processati: {row_data}")
-            self.data.append(row_data)
-            self.update_table()
-            self.save_to_excel()
+            metrics = StageMetrics()
+            with metrics.measure("persistence"):
+                added = self.receipt_store.add(row_data)
+            self.span_exporter.export(metrics.spans, os.path.basename(file_path))
+            self.stage_stats.update_stats(self.span_exporter.stats())
+            if added:
+                self.table_model.append_row(row_data)
+            else:
+                self.log_action(f"Riga già presente nell'archivio, aggiornata: {row_data['Descrizione']}")
+                self.table_model.schedule_reload()
+            job_id = self.job_journal.active_job(file_path)
+            if job_id is not None:
+                self.job_journal.complete(job_id)
+            self.schedule_excel_export()
 
         except Exception as e:
             self.handle_error(f"Errore nell'elaborazione dei risultati: {str(e)}")
@@ -353,75 +461,21 @@ class ReceiptProcessor(QMainWindow):
         self.status_label.setText(f"Errore: {error_msg}")
         print(f"Errore: {error_msg}")
 
+    def excel_path(self) -> str:
+        reports_dir = os.path.join(os.getcwd(), "Reports")
+        return os.path.join(reports_dir, EXCEL_FILE)
+
+    def schedule_excel_export(self):
+        """Riprogramma l'export: più scontrini ravvicinati producono una sola scrittura."""
+        self.excel_export_timer.start()
+
     def save_to_excel(self):
+        """Esporta in Excel l'archivio degli scontrini."""
         try:
-            reports_dir = os.path.join(os.getcwd(), "Reports")
-            os.makedirs(reports_dir, exist_ok=True)
-            excel_path = os.path.join(reports_dir, EXCEL_FILE)
-
-            formatted_data = []
-            for item in self.data:
-                try:
-                    importo_originale = float(str(item['Importo']).replace(',', '.'))
-                    importo_eur = float(str(item['Importo (EUR)']).replace(',', '.'))
-                except ValueError as e:
-                    self.logger.log_action(f"Errore conversione importo: {str(e)}")
-                    importo_originale = 0.0
-                    importo_eur = 0.0
-
-
-
-                formatted_item = {
-                    'Data': item['Data'],
-                    'Importo Originale': importo_originale,
-                    'Valuta': item['Valuta'],
-                    'Importo (EUR)': importo_eur,
-                    'Descrizione': item.get('Descrizione', ''),
-                    'Categoria': item.get('Categoria', ''),
-                    'Sottocategoria': item.get('Sottocategoria', ''),
-
-                    'File': item['File']
-                }
-                formatted_data.append(formatted_item)
-
-            df = pd.DataFrame(formatted_data)
-
-            if os.path.exists(excel_path):
-                existing_df = pd.read_excel(excel_path)
-                existing_df['Importo Originale'] = pd.to_numeric(existing_df['Importo Originale'], errors='coerce')
-                existing_df['Importo (EUR)'] = pd.to_numeric(existing_df['Importo (EUR)'], errors='coerce')
-
-                combined_df = pd.concat([existing_df, df])
-                combined_df = combined_df.drop_duplicates(
-                    subset=['Data', 'Importo Originale', 'Descrizione','Categoria','Sottocategoria'],
-                    keep='last'
-                )
-                df = combined_df
-
-            writer = pd.ExcelWriter(excel_path, engine='xlsxwriter')
-            df.to_excel(writer, index=False, sheet_name='Scontrini')
-
-            workbook = writer.book
-            worksheet = writer.sheets['Scontrini']
-
-            # Formati
-            money_format = workbook.add_format({'num_format': '#,##0.00'})
-            date_format = workbook.add_format({'num_format': 'dd/mm/yyyy'})
-            percent_format = workbook.add_format({'num_format': '0.00%'})
-
-            # Colonne
-            worksheet.set_column('A:A', 15, date_format)  # Data
-            worksheet.set_column('B:B', 15, money_format)  # Importo Originale
-            worksheet.set_column('C:C', 10)  # Valuta
-            worksheet.set_column('D:D', 15, money_format)  # Importo (EUR)
-            worksheet.set_column('E:E', 40)  # Descrizione
-            worksheet.set_column('F:F', 20)  # Categoria
-            worksheet.set_column('G:G', 25)  # Sottocategoria
-            worksheet.set_column('H:H', 25)  # file
-
-
-            writer.close()
-            self.status_label.setText(f"Dati salvati in: {excel_path}")
+            self.excel_export_timer.stop()
+            excel_path = self.excel_path()
+            exported = self.receipt_store.export_excel(excel_path)
+            self.status_label.setText(f"Dati salvati in: {excel_path} ({exported} righe)")
 
         except Exception as e:
             self.status_label.setText(f"Errore nel salvataggio Excel: {str(e)}")
@@ -430,246 +484,70 @@ class ReceiptProcessor(QMainWindow):
             traceback.print_exc()
 
     def export_to_pdf(self):
-        """Esporta i dati in PDF con supporto Unicode usando FPDF2."""
-        from fpdf import FPDF
-        import arabic_reshaper
-        from bidi.algorithm import get_display
-
-        class PDF(FPDF):
-            def __init__(self):
-                super().__init__(orientation='L', unit='mm', format='A4')
-                self.col_widths = {
-                    "Data": 25,
-                    "Importo": 25,
-                    "Valuta": 15,
-                    "EUR": 25,
-                    "Descrizione": 95,
-                    "Categoria": 35,
-                    "Sottocategoria":35,
-                    "File": 50
-                }
-                # Imposta il font predefinito
-                self.add_font("NotoSans", fname="fonts/NotoSans-Regular.ttf")
-                self.add_font("NotoSans", fname="fonts/NotoSans-Bold.ttf", style="B")
-                self.set_auto_page_break(auto=True, margin=15)
-
-            def header(self):
-                self.set_font("NotoSans", "B", 16)
-                self.cell(0, 10, "Report Scontrini", align="C")
-                self.ln()
-                self.set_font("NotoSans", size=10)
-                self.cell(0, 5, f"Generato il: {time.strftime('%d/%m/%Y %H:%M:%S')}", align="R")
-                self.ln(10)
-
-                # Intestazione tabella
-                self.set_font("NotoSans", "B", 10)
-                self.set_fill_color(230, 230, 230)
-                x_pos = 10
-                for header, width in self.col_widths.items():
-                    self.rect(x_pos, self.get_y(), width, 8, "DF")
-                    self.set_xy(x_pos, self.get_y())
-                    self.cell(width, 8, header, align="C")
-                    x_pos += width
-                self.ln(8)
-
-            def footer(self):
-                self.set_y(-15)
-                self.set_font("NotoSans", size=8)
-                self.cell(0, 10, f'Pagina {self.page_no()}', align="C")
-
-            def add_row(self, data):
-                self.set_font("NotoSans", size=9)
-
-                # Calcola l'altezza necessaria
-                max_height = 6
-                desc_lines = []
-
-                def process_text(text):
-                    try:
-                        text = arabic_reshaper.reshape(str(text))
-                        text = get_display(text)
-                        return text
-                    except:
-                        return str(text)
-
-                # Prepara il testo della descrizione
-                if "Descrizione" in data:
-                    desc_text = process_text(data["Descrizione"])
-                    desc_lines = self.multi_cell_planning(desc_text,
-                                                          self.col_widths["Descrizione"] - 2)
-                    max_height = max(len(desc_lines) * 6, max_height)
-
-                # Stampa le celle
-                x_start = 10
-                y_start = self.get_y()
-                cell_height = max_height
-
-                for key, width in self.col_widths.items():
-                    self.set_xy(x_start, y_start)
-                    content = str(data.get(key, ""))
-
-                    if key in ["Descrizione", "File"]:
-                        content = process_text(content)
-                        lines = self.multi_cell_planning(content, width - 2)
-                        for i, line in enumerate(lines):
-                            self.set_xy(x_start, y_start + (i * 6))
-                            self.cell(width, 6, line, border=1, align="L")
-                    else:
-                        self.cell(width, cell_height, process_text(content),
-                                  border=1, align="C")
-                    x_start += width
-
-                self.ln(cell_height)
-
-            def multi_cell_planning(self, text, width):
-                lines = []
-                running_line = ""
-                words = text.split()
-
-                for word in words:
-                    test_line = f"{running_line} {word}".strip()
-                    if self.get_string_width(test_line) <= width:
-                        running_line = test_line
-                    else:
-                        if running_line:
-                            lines.append(running_line)
-                        running_line = word
-
-                if running_line:
-                    lines.append(running_line)
-
-                return lines if lines else [text]
-
-        try:
-            # Verifica se la cartella fonts esiste, altrimenti creala
-            if not os.path.exists('fonts'):
-                os.makedirs('fonts')
-
-            # Verifica se il font è presente, altrimenti scaricalo
-            font_path = "fonts/NotoSans-Regular.ttf"
-            bold_font_path = "fonts/NotoSans-Bold.ttf"
-
-            if not (os.path.exists(font_path) and os.path.exists(bold_font_path)):
-                self.status_label.setText("Scaricamento font in corso...")
-                import urllib.request
-
-                # URLs per i font Noto Sans (questi sono esempi, usa URLs corrette)
-                font_url = "https://github.com/googlefonts/noto-fonts/raw/main/hinted/ttf/NotoSans/NotoSans-Regular.ttf"
-                bold_font_url = "https://github.com/googlefonts/noto-fonts/raw/main/hinted/ttf/NotoSans/NotoSans-Bold.ttf"
-
-                urllib.request.urlretrieve(font_url, font_path)
-                urllib.request.urlretrieve(bold_font_url, bold_font_path)
-
-                self.status_label.setText("Font scaricati con successo")
-
-            # Leggi i dati e prepara il PDF
-            data = self.read_excel_data()
-            self.data = self.prepare_data(data)
-
-            pdf = PDF()
-            pdf.add_page()
-
-            # Aggiungi le righe
-            for item in self.data:
-                if pdf.get_y() > 180:
-                    pdf.add_page()
-
-                row_data = {
-                    "Data": str(item.get("Data", "")),
-                    "Importo": f"{float(item.get('Importo Originale', 0)):.3f}",
-                    "Valuta": str(item.get("Valuta", "")),
-                    "EUR": f"{float(item.get('Importo (EUR)', 0)):.2f}",
-                    "Descrizione": str(item.get("Descrizione", "")),
-                    "Categoria": str(item.get("Categoria", "Non specificata")),
-                    "File": str(item.get("File", ""))
-                }
-                pdf.add_row(row_data)
-
-            # Aggiungi riepilogo
-            pdf.add_page()
-            pdf.set_font("NotoSans", "B", 12)
-            pdf.cell(0, 10, "Riepilogo", align="L")
-            pdf.ln()
-
-            total_eur = sum(float(item.get("Importo (EUR)", 0)) for item in self.data)
-            pdf.set_font("NotoSans", size=10)
-            pdf.cell(0, 8, f"Totale spese: {total_eur:.2f} EUR", align="L")
-            pdf.ln()
-            pdf.cell(0, 8, f"Numero scontrini elaborati: {len(self.data)}", align="L")
-            pdf.ln()
-
-            # Salva il PDF
-            timestamp = time.strftime("%Y%m%d_%H%M%S")
-            pdf_filename = f"report_scontrini_{timestamp}.pdf"
-            pdf_path = os.path.join("Reports", pdf_filename)
-            pdf.output(pdf_path)
-
-            self.status_label.setText(f"PDF esportato con successo: {pdf_filename}")
-
-        except Exception as e:
-            self.status_label.setText(f"Errore nell'esportazione PDF: {str(e)}")
-            print(f"Errore nell'esportazione PDF: {str(e)}")
-            import traceback
-            traceback.print_exc()
-
-    def read_excel_data(self):
-        try:
-            # Costruisci il percorso assoluto al file Excel
-            report_dir = os.path.join(os.getcwd(), "Reports")
-            excel_file_path = os.path.join(report_dir, "pagamenti.xlsx")
+        """Esporta i dati in PDF in un thread separato, leggendo l'archivio a blocchi."""
+        if self.report_worker is not None and self.report_worker.isRunning():
+            self.status_label.setText("Generazione PDF già in corso...")
+            return
 
-            # Leggi i dati dall'Excel
-            df = pd.read_excel(excel_file_path)
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        pdf_filename = f"report_scontrini_{timestamp}.pdf"
+        pdf_path = os.path.join("Reports", pdf_filename)
 
-            # Rimuove gli spazi dai nomi delle colonne
-            df.columns = df.columns.str.strip()
+        self.report_worker = ReportWorker(self.receipt_store, pdf_path, self)
+        self.report_worker.progress.connect(
+            lambda done, total: self.status_label.setText(f"Generazione PDF: {done}/{total} righe")
+        )
+        self.report_worker.finished.connect(
+            lambda path: self.status_label.setText(f"PDF esportato con successo: {os.path.basename(path)}")
+        )
+        self.report_worker.error.connect(self.handle_error)
+        self.export_button.setEnabled(False)
+        self.report_worker.finished.connect(lambda _: self.export_button.setEnabled(True))
+        self.report_worker.error.connect(lambda _: self.export_button.setEnabled(True))
 
-            # Gestisce valori nulli riempiendoli con stringa vuota
-            df.fillna("", inplace=True)
+        self.status_label.setText("Generazione PDF in corso...")
+        self.report_worker.start()
 
-            # Converti il DataFrame in una lista di dizionari
-            return df.to_dict(orient="records")
-        except Exception as e:
-            print(f"Errore nella lettura del file Excel: {str(e)}")
-            return []
-
-    def prepare_data(self, data):
-        prepared_data = []
-        for item in data:
-            try:
-                # Formatta la data
-                date_str = self.date_formatter.format_date(item.get("Data", ""))
-
-                # Assicurati che tutti i campi necessari esistano
-                prepared_item = {
-                    "Data": date_str,
-                    "Importo Originale": float(item.get("Importo Originale", 0)),
-                    "Valuta": str(item.get("Valuta", "")),
-                    "Importo (EUR)": float(item.get("Importo (EUR)", 0)),
-                    "Descrizione": str(item.get("Descrizione", "")),
-                    "Categoria": str(item.get("Categoria", "Non specificata")),
-                    "File": str(item.get("File", "")),
-                    "Percorso Completo": str(item.get("Percorso Completo", ""))
-                }
-                prepared_data.append(prepared_item)
-            except Exception as e:
-                print(f"Errore nella preparazione dei dati per la riga: {item}")
-                print(f"Errore specifico: {str(e)}")
-        return prepared_data
+    def watched_near_duplicate(self, file_path: str):
+        """Scontrino già visto simile a un file della cartella monitorata (thread del watcher)."""
+        perceptual = file_signature(file_path)
+        return self.file_agent.near_duplicate(perceptual, file_path) if perceptual is not None else None
 
     def start_watching(self):
+        # Chiamati dal thread del watcher: scheduler, FileAgent e log_signal sono thread-safe
+        self.watcher = ReceiptWatcher(
+            WATCH_DIR,
+            submit=lambda path: self.enqueue(path, PRIORITY_LOW),
+            is_duplicate=self.file_agent.is_duplicate,
+            log=self.log_signal.emit,
+            near_duplicate=self.watched_near_duplicate
+        )
         self.observer = Observer()
-        handler = ReceiptWatcher(self)
-        self.observer.schedule(handler, WATCH_DIR, recursive=False)
+        self.observer.schedule(self.watcher, WATCH_DIR, recursive=False)
         self.observer.start()
+        self.watcher.start()
 
     def closeEvent(self, event):
         """Handle cleanup when closing the window."""
         try:
             self.observer.stop()
             self.observer.join()
-            for worker in self.current_workers:
-                worker.wait()
+            self.watcher.stop()
+            self.scheduler.shutdown()
+            self.ocr_agent.shutdown()
+            self.archive_executor.shutdown(wait=True)
+            self.file_agent.close()
+            if self.report_worker is not None:
+                self.report_worker.requestInterruption()
+                self.report_worker.wait()
+            self.async_runtime.shutdown()
+            self.result_cache.close()
+            # Export finale se c'erano scontrini in attesa del debounce
+            if self.excel_export_timer.isActive():
+                self.save_to_excel()
+            self.receipt_store.close()
+            self.job_journal.close()
+            self.span_exporter.close()
         except:
             pass
         super().closeEvent(event)
@@ -0,0 +1,72 @@
+import os
+from typing import Optional
+
+OPENAI_KEY_FILE = "api_key.txt"
+EXCHANGE_KEY_FILE = "exchange_api_key.txt"
+FIXER_KEY_FILE = "fixer_api_key.txt"
+ENV_FILE = ".env"
+
+
+def is_valid_openai_key(key: str) -> bool:
+    """Verifica se l'API key di OpenAI ha il formato corretto"""
+    return bool(key) and key.startswith("sk-proj-") and len(key) > 20
+
+
+def is_valid_exchange_key(key: str) -> bool:
+    """Verifica se l'API key di Exchange Rate ha il formato corretto"""
+    return bool(key) and len(key) >= 24
+
+
+def is_valid_fixer_key(key: str) -> bool:
+    """Verifica se l'API key di Fixer.io ha il formato corretto (32 caratteri alfanumerici)"""
+    return bool(key) and len(key) == 32 and key.isalnum()
+
+
+def read_env_file(path: str = ENV_FILE) -> dict:
+    """Legge un file .env (righe CHIAVE=valore, commenti con #)."""
+    values = {}
+    try:
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line or line.startswith("#") or "=" not in line:
+                        continue
+                    name, value = line.split("=", 1)
+                    values[name.strip()] = value.strip().strip('"').strip("'")
+    except Exception as e:
+        print(f"Errore nella lettura di {path}: {str(e)}")
+    return values
+
+
+def read_key_file(path: str) -> Optional[str]:
+    try:
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                return f.read().strip()
+    except Exception as e:
+        print(f"Errore nella lettura dell'API key da {path}: {str(e)}")
+    return None
+
+
+def find_api_key(env_name: str, key_file: str, validator) -> Optional[str]:
+    """
+    Cerca una API key senza interazione: variabile d'ambiente, file .env,
+    infine il file in cui l'interfaccia salva la chiave inserita.
+    """
+    for candidate in (os.environ.get(env_name), read_env_file().get(env_name), read_key_file(key_file)):
+        if candidate and validator(candidate.strip()):
+            return candidate.strip()
+    return None
+
+
+def get_openai_api_key() -> Optional[str]:
+    return find_api_key("OPENAI_API_KEY", OPENAI_KEY_FILE, is_valid_openai_key)
+
+
+def get_exchange_api_key() -> Optional[str]:
+    return find_api_key("EXCHANGE_RATE_API_KEY", EXCHANGE_KEY_FILE, is_valid_exchange_key)
+
+
+def get_fixer_api_key() -> Optional[str]:
+    return find_api_key("FIXER_API_KEY", FIXER_KEY_FILE, is_valid_fixer_key)
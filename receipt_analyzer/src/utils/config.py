@@ -9,15 +9,130 @@ REPORTS_DIR = os.path.join(DATA_DIR, "Reports")
 # File names
 EXCEL_FILE = "pagamenti.xlsx"
 PDF_REPORT = "report_pagamenti.pdf"
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
 
-# Tassi di cambio di fallback
-FALLBACK_RATES = {
-    ('USD', 'EUR'): 0.85,
-    ('EUR', 'USD'): 1.18,
-    ('EUR', 'OMR'): 0.44,
-    ('OMR', 'EUR'): 2.27,
+# Cartella monitorata: un file è accodato dopo WATCH_SETTLE_SECONDS senza eventi
+# e con dimensione invariata tra due controlli (scrittura terminata)
+WATCH_SETTLE_SECONDS = 1.0
+WATCH_POLL_INTERVAL = 0.25
+# Dopo la scrittura, per quanti secondi i file dell'applicazione restano ignorati
+# (gli ultimi eventi di watchdog possono arrivare in ritardo)
+WATCH_IGNORE_GRACE = 10.0
+
+# Coda di ingestione
+MAX_CONCURRENT_WORKERS = 4  # Scontrini elaborati contemporaneamente
+MAX_QUEUE_SIZE = 500  # Oltre questa soglia la coda rifiuta nuovi file
+THROUGHPUT_WINDOW = 60  # Secondi usati per calcolare il throughput
+
+# Connessioni HTTP condivise (FX, geocoding, LLM)
+HTTP_TOTAL_LIMIT = 32  # Connessioni aperte in totale per sessione
+HTTP_LIMIT_PER_HOST = 8  # Connessioni keep-alive verso lo stesso host
+HTTP_TIMEOUT = 30  # Secondi
+
+# Limiti delle chiamate OpenAI, condivisi da tutti i worker: i valori iniziali sono
+# corretti dagli header x-ratelimit-* delle risposte
+OPENAI_REQUESTS_PER_MINUTE = 500
+OPENAI_TOKENS_PER_MINUTE = 200000
+OPENAI_MAX_CONCURRENT = 8  # Chiamate contemporanee
+# Errori temporanei (429, 5xx, rete): tentativi con backoff esponenziale e jitter
+OPENAI_MAX_RETRIES = 5
+OPENAI_RETRY_BASE = 0.5  # Secondi, raddoppiati a ogni tentativo
+OPENAI_RETRY_MAX = 30
+# Dopo tanti errori consecutivi le chiamate falliscono subito per BREAKER_COOLDOWN secondi
+OPENAI_BREAKER_THRESHOLD = 5
+OPENAI_BREAKER_COOLDOWN = 30
+
+# Cache persistente dei tassi di cambio
+FX_RATES_DB = os.path.join(DATA_DIR, "fx_rates.sqlite3")
+FX_BASE_CURRENCY = "EUR"  # Valuta base della tabella scaricata dai provider
+FX_CACHE_TTL = 6 * 3600  # Validità della tabella del giorno (secondi)
+FX_HISTORY_URL = "https://api.frankfurter.app"  # Serie storiche BCE, una richiesta per intervallo
+FX_API_URL = "https://v6.exchangerate-api.com/v6"  # Tabella del giorno, con API key
+FX_OPEN_URL = "https://open.er-api.com/v6"  # Tabella del giorno, endpoint pubblico
+FX_BACKFILL_DAYS = 30  # Giorni scaricati prima e dopo la data di uno scontrino mancante
+FX_MAX_GAP_DAYS = 5  # Distanza massima (weekend, festivi) dalla tabella più vicina
+# Provider interrogati quando la tabella del giorno non ha la valuta: partono in ordine di
+# affidabilità, il successivo anche se il precedente non ha risposto entro FX_HEDGE_DELAY
+FX_FOREX_URL = "https://theratesapi.com/api"  # Sorgente usata da forex-python
+FX_FIXER_URL = "http://data.fixer.io/api"
+FX_PROVIDER_TIMEOUT = 4.0  # Secondi concessi a ogni provider
+FX_HEDGE_DELAY = 0.3  # Secondi prima di interrogare anche il provider successivo
+FX_LOOKUP_DEADLINE = 6.0  # Secondi massimi per l'intera ricerca
+# Tassi indicativi (unità di valuta per 1 USD) usati quando nessun provider risponde:
+# ogni coppia è ricavata per triangolazione attraverso l'USD (RateGraph)
+FX_FALLBACK_BASE = "USD"
+FX_FALLBACK_RATES = {
+    "EUR": 0.92, "GBP": 0.79, "CHF": 0.88, "SEK": 10.6, "NOK": 10.9, "DKK": 6.86, "PLN": 4.0,
+    "CZK": 23.3, "HUF": 365.0, "RON": 4.58, "TRY": 34.3, "RUB": 96.0,
+    "CAD": 1.37, "MXN": 19.8, "BRL": 5.6, "ARS": 980.0,
+    "JPY": 150.0, "CNY": 7.12, "HKD": 7.77, "KRW": 1370.0, "INR": 84.0, "THB": 33.8, "SGD": 1.32,
+    "MYR": 4.35, "IDR": 15700.0, "PHP": 57.5, "VND": 25300.0, "AUD": 1.5, "NZD": 1.65,
+    "AED": 3.6725, "SAR": 3.75, "OMR": 0.3845, "QAR": 3.64, "KWD": 0.307, "BHD": 0.376,
+    "JOD": 0.709, "ILS": 3.75, "EGP": 48.5, "MAD": 9.9, "ZAR": 17.8,
+    "KZT": 485.0, "UZS": 12800.0, "GEL": 2.72, "AMD": 387.0, "AZN": 1.7,
 }
 
+# Endpoint dei servizi esterni (il benchmark li sostituisce con server locali)
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL")  # None = API OpenAI
+GEOCODING_URL = "https://nominatim.openstreetmap.org/search"
+
+# Benchmark offline (python -m receipt_analyzer bench): risultati salvati per il confronto
+BENCHMARK_DIR = os.path.join(DATA_DIR, "benchmarks")
+BENCHMARK_SIZES = (10, 1000, 10000)  # Scontrini sintetici per corpus
+
+# Cache dei risultati della pipeline (OCR, analisi, validazione, categorizzazione)
+RESULT_CACHE_DB = os.path.join(DATA_DIR, "result_cache.sqlite3")
+RESULT_CACHE_MAX_BYTES = 50 * 1024 * 1024
+
+# Indice dei duplicati esatti: i file sono letti a blocchi
+FILE_HASH_CHUNK = 1024 * 1024
+# Quasi duplicati (stesso scontrino fotografato di nuovo): bit diversi ammessi
+# tra gli hash a 64 bit. Devono coincidere phash, dhash e proporzioni; anche
+# così il file non è scartato, è l'utente a confermare.
+PHASH_MAX_DISTANCE = 3
+DHASH_MAX_DISTANCE = 3
+ASPECT_TOLERANCE = 0.05  # Scarto relativo ammesso tra i rapporti larghezza/altezza
+# Duplicati sui dati estratti: stessi data, importo e valuta, esercente simile
+MERCHANT_SIMILARITY = 0.85  # Rapporto minimo di somiglianza (0-1) tra le descrizioni
+
+# Giornale dei job: fasi completate di ogni scontrino, per riprendere dopo una chiusura
+JOBS_DB = os.path.join(DATA_DIR, "jobs.sqlite3")
+
+# Span delle fasi di ogni scontrino: JSON Lines (uno per fase) e metriche aggregate
+# in formato testo Prometheus, riscritte dopo ogni scontrino
+METRICS_DIR = os.path.join(DATA_DIR, "metrics")
+METRICS_SPANS_FILE = os.path.join(METRICS_DIR, "spans.jsonl")
+METRICS_SPANS_MAX_BYTES = 20 * 1024 * 1024  # Oltre, il file è ruotato in spans.jsonl.1
+METRICS_PROMETHEUS_FILE = os.path.join(METRICS_DIR, "receipt_analyzer.prom")
+METRICS_WINDOW = 1000  # Durate recenti per fase usate per i percentili
+
+# Archivio delle righe; l'Excel è un export
+RECEIPTS_DB = os.path.join(DATA_DIR, "receipts.sqlite3")
+EXCEL_EXPORT_DELAY_MS = 5000  # Attesa dopo l'ultimo scontrino prima dell'export
+
+# Estrazione: "multi_stage" (vision + analisi + validazione + categorizzazione)
+# oppure "single_pass" (una sola chiamata vision con risposta strutturata)
+EXTRACTION_MODE = os.environ.get("RECEIPT_EXTRACTION_MODE", "multi_stage")
+EXTRACTION_MODES = ("multi_stage", "single_pass")
+
+# OCR a lotti: fino a VISION_BATCH_SIZE immagini per chiamata vision (1 = disattivato),
+# attendendo al massimo VISION_BATCH_WINDOW_MS dal primo scontrino del lotto
+VISION_BATCH_SIZE = 1
+VISION_BATCH_WINDOW_MS = 500
+
+# Preparazione delle immagini prima dell'invio al modello vision
+IMAGE_MAX_EDGE = 1600  # Pixel del lato lungo
+IMAGE_FORMAT = "jpeg"  # "jpeg" oppure "webp"
+IMAGE_QUALITY = 80
+IMAGE_GRAYSCALE = True
+IMAGE_AUTO_CROP = True
+
+# Preprocessing OCRAgent (in un pool di processi)
+OCR_MAX_EDGE = 2000  # Lato lungo della copia elaborata
+OCR_PROCESS_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+OCR_NOISE_THRESHOLD = 4.0  # Sotto questa stima del rumore il denoise è saltato
+OCR_CONTRAST_THRESHOLD = 50.0  # Sopra questo contrasto RMS il CLAHE è saltato
+
 # Assicurati che le directory esistano
 os.makedirs(WATCH_DIR, exist_ok=True)
 os.makedirs(REPORTS_DIR, exist_ok=True)
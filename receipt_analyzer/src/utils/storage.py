@@ -0,0 +1,20 @@
+import os
+import sqlite3
+
+
+def open_database(db_path: str) -> sqlite3.Connection:
+    """
+    Apre (creandolo se serve) un database SQLite locale.
+
+    La connessione può essere usata da più thread: chi la usa deve
+    serializzare gli accessi con un proprio lock. Il journal WAL permette
+    letture concorrenti durante le scritture e rende i commit atomici.
+    """
+    directory = os.path.dirname(db_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
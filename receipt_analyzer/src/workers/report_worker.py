@@ -0,0 +1,27 @@
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from ..services.report_generator import ReportGenerator
+
+
+class ReportWorker(QThread):
+    """Genera il report PDF fuori dal thread dell'interfaccia."""
+
+    progress = pyqtSignal(int, int)  # righe elaborate, righe totali
+    finished = pyqtSignal(str)  # percorso del PDF
+    error = pyqtSignal(str)
+
+    def __init__(self, store, pdf_path: str, parent=None):
+        super().__init__(parent)
+        self.generator = ReportGenerator(store)
+        self.pdf_path = pdf_path
+
+    def run(self):
+        try:
+            self.generator.generate(
+                self.pdf_path,
+                progress_callback=self.progress.emit,
+                should_stop=self.isInterruptionRequested
+            )
+            self.finished.emit(self.pdf_path)
+        except Exception as e:
+            self.error.emit(f"Errore nell'esportazione PDF: {str(e)}")
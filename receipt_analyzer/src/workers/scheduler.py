@@ -0,0 +1,181 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Any, Set
+
+from PyQt5.QtCore import QObject, QThread, pyqtSignal, pyqtSlot
+
+from ..utils.config import MAX_CONCURRENT_WORKERS, MAX_QUEUE_SIZE, THROUGHPUT_WINDOW
+
+# Priorità: valori più bassi vengono elaborati prima
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+PRIORITY_LOW = 20
+
+
+class IngestionScheduler(QObject):
+    """
+    Coda di ingestione condivisa per gli scontrini.
+
+    Mantiene una coda a priorità dei file da elaborare e avvia al massimo
+    `max_concurrent` worker alla volta. Quando la coda è piena `submit`
+    restituisce False (backpressure) e il chiamante decide se riprovare.
+    Un file già in coda o in elaborazione non viene accodato una seconda
+    volta. I segnali dei worker vengono inoltrati con gli stessi nomi.
+    """
+
+    finished = pyqtSignal(dict, str)  # risultati, percorso del file
+    error = pyqtSignal(str)
+    skipped = pyqtSignal(str, str)  # motivo, percorso del file (duplicato già in archivio)
+    progress = pyqtSignal(str)
+    log_message = pyqtSignal(str)
+    stats_changed = pyqtSignal(dict)
+
+    # Segnale interno: le richieste da altri thread vengono accodate nel thread dello scheduler
+    _wakeup = pyqtSignal()
+
+    def __init__(self, worker_factory: Callable[[str], QThread],
+                 max_concurrent: int = MAX_CONCURRENT_WORKERS,
+                 max_queue_size: int = MAX_QUEUE_SIZE,
+                 parent=None):
+        super().__init__(parent)
+        self.worker_factory = worker_factory
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue_size = max_queue_size
+
+        self._queue = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._running = {}
+        self._held: Set[str] = set()  # File in coda o in elaborazione
+        self._retired = []
+        self._accepting = True
+
+        self.completed = 0
+        self.failed = 0
+        self.skipped_count = 0
+        self._completion_times = deque()
+
+        self._wakeup.connect(self._dispatch)
+
+    def submit(self, file_path: str, priority: int = PRIORITY_NORMAL) -> bool:
+        """
+        Accoda un file da elaborare. Può essere chiamato da qualsiasi thread.
+
+        Returns:
+            bool: False se la coda è piena o lo scheduler è stato fermato;
+            True anche se il file era già in coda o in elaborazione.
+        """
+        key = os.path.abspath(file_path)
+        with self._lock:
+            if not self._accepting:
+                return False
+            if key in self._held:
+                return True
+            if len(self._queue) >= self.max_queue_size:
+                return False
+            self._held.add(key)
+            heapq.heappush(self._queue, (priority, next(self._counter), file_path))
+
+        self._wakeup.emit()
+        return True
+
+    def free_slots(self) -> int:
+        """Numero di file che la coda può ancora accettare."""
+        with self._lock:
+            return max(0, self.max_queue_size - len(self._queue))
+
+    def queue_depth(self) -> int:
+        with self._lock:
+            return len(self._queue)
+
+    def running_count(self) -> int:
+        return len(self._running)
+
+    def throughput(self) -> float:
+        """Scontrini completati al minuto nella finestra di osservazione."""
+        now = time.monotonic()
+        while self._completion_times and now - self._completion_times[0] > THROUGHPUT_WINDOW:
+            self._completion_times.popleft()
+        return len(self._completion_times) * 60.0 / THROUGHPUT_WINDOW
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_coda": self.queue_depth(),
+            "in_esecuzione": self.running_count(),
+            "completati": self.completed,
+            "falliti": self.failed,
+            "saltati": self.skipped_count,
+            "throughput_min": round(self.throughput(), 2)
+        }
+
+    @pyqtSlot()
+    def _dispatch(self):
+        """Avvia nuovi worker finché ci sono slot liberi e file in coda."""
+        self._retired = [w for w in self._retired if w.isRunning()]
+
+        while len(self._running) < self.max_concurrent:
+            with self._lock:
+                if not self._queue:
+                    break
+                _, job_id, file_path = heapq.heappop(self._queue)
+
+            try:
+                worker = self.worker_factory(file_path)
+            except Exception as e:
+                self.failed += 1
+                with self._lock:
+                    self._held.discard(os.path.abspath(file_path))
+                self.error.emit(f"Impossibile avviare l'elaborazione di {file_path}: {str(e)}")
+                continue
+
+            worker.finished.connect(lambda data, j=job_id, fp=file_path: self._on_finished(j, data, fp))
+            worker.error.connect(lambda msg, j=job_id, fp=file_path: self._on_error(j, msg, fp))
+            worker.skipped.connect(lambda msg, j=job_id, fp=file_path: self._on_skipped(j, msg, fp))
+            worker.progress.connect(self.progress)
+            worker.log_message.connect(self.log_message)
+
+            self._running[job_id] = worker
+            worker.start()
+
+        self.stats_changed.emit(self.stats())
+
+    def _release(self, job_id: int, file_path: str):
+        with self._lock:
+            self._held.discard(os.path.abspath(file_path))
+        worker = self._running.pop(job_id, None)
+        if worker is not None:
+            # Il thread potrebbe non essere ancora terminato: manteniamo il riferimento
+            self._retired.append(worker)
+        self._completion_times.append(time.monotonic())
+
+    def _on_finished(self, job_id: int, data: dict, file_path: str):
+        self.completed += 1
+        self._release(job_id, file_path)
+        self.finished.emit(data, file_path)
+        self._dispatch()
+
+    def _on_skipped(self, job_id: int, message: str, file_path: str):
+        self.skipped_count += 1
+        self._release(job_id, file_path)
+        self.skipped.emit(message, file_path)
+        self._dispatch()
+
+    def _on_error(self, job_id: int, message: str, file_path: str):
+        self.failed += 1
+        self._release(job_id, file_path)
+        self.error.emit(message)
+        self._dispatch()
+
+    def shutdown(self, timeout_ms: int = 30000):
+        """Svuota la coda e attende la fine dei worker in esecuzione."""
+        with self._lock:
+            self._accepting = False
+            self._queue.clear()
+            self._held.clear()
+
+        for worker in list(self._running.values()) + self._retired:
+            worker.wait(timeout_ms)
@@ -1,4 +1,7 @@
+import hashlib
+import threading
 import unittest
+from unittest.mock import patch
 
 import tempfile
 import shutil
@@ -7,6 +10,8 @@ import os
 # Aggiungi il percorso root del progetto al PYTHONPATH
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 from src.agents.file_agent import FileAgent
+from src.services.perceptual_hash import ImageSignature, signature
+from tests.receipt_images import make_receipt
 
 
 class TestFileAgent(unittest.TestCase):
@@ -17,8 +22,15 @@ class TestFileAgent(unittest.TestCase):
 
     def tearDown(self):
         # Pulisci dopo i test
+        self.agent.close()
         shutil.rmtree(self.test_dir)
 
+    def write(self, name, content):
+        path = os.path.join(self.test_dir, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
     def test_duplicate_detection(self):
         # Crea due file con lo stesso contenuto
         file1_path = os.path.join(self.test_dir, "test1.txt")
@@ -53,5 +65,98 @@ class TestFileAgent(unittest.TestCase):
         self.assertFalse(self.agent.is_duplicate(nonexistent_file))
 
 
+    def test_chunked_hash(self):
+        """L'hash a blocchi coincide con quello del file intero."""
+        agent = FileAgent(self.test_dir, chunk_size=7)
+        path = self.write("lungo.txt", "riga di scontrino\n" * 100)
+        with open(path, "rb") as f:
+            self.assertEqual(agent.file_hash(path), hashlib.md5(f.read()).hexdigest())
+        agent.close()
+
+    def test_known_file_not_rehashed(self):
+        """Stesso percorso, dimensione e data di modifica: nessuna rilettura."""
+        path = self.write("test.txt", "test content")
+        self.agent.is_duplicate(path)
+        with patch.object(self.agent, "file_hash", side_effect=AssertionError("riletto")):
+            self.assertTrue(self.agent.is_duplicate(path))
+
+        # Il contenuto cambia: il file viene riletto ed è nuovo
+        self.write("test.txt", "altro contenuto")
+        self.assertFalse(self.agent.is_duplicate(path))
+
+    def test_legacy_history_imported(self):
+        legacy_hash = hashlib.md5(b"vecchio").hexdigest()
+        self.agent.close()
+        with open(os.path.join(self.test_dir, ".file_history"), "w") as f:
+            f.write(legacy_hash)
+        self.agent = FileAgent(self.test_dir)
+
+        self.assertTrue(self.agent.is_duplicate(self.write("vecchio.txt", "vecchio")))
+        self.assertFalse(os.path.exists(os.path.join(self.test_dir, ".file_history")))
+
+    def test_concurrent_checks(self):
+        """Da più thread, di file identici uno solo risulta nuovo."""
+        paths = [self.write(f"copia{i}.txt", "stesso contenuto") for i in range(8)]
+        results = []
+        threads = [threading.Thread(target=lambda p=p: results.append(self.agent.is_duplicate(p)))
+                   for p in paths]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(False), 1)
+        self.assertEqual(self.agent.count(), 1)
+
+
+    def test_near_duplicate(self):
+        self.assertIsNone(self.agent.near_duplicate(ImageSignature(0xFFFF0000FFFF0000, 0xF0F0, 0.45), "primo.jpg"))
+        self.assertEqual(self.agent.near_duplicate(ImageSignature(0xFFFF0000FFFF0003, 0xF0F1, 0.46), "secondo.jpg"),
+                         "primo.jpg")
+        self.assertIsNone(self.agent.near_duplicate(ImageSignature(0x0000FFFF0000FFFF, 0xF0F0, 0.45), "altro.jpg"))
+
+        # Gli hash sono persistenti
+        new_agent = FileAgent(self.test_dir)
+        self.assertEqual(new_agent.near_duplicate(ImageSignature(0xFFFF0000FFFF0001, 0xF0F0, 0.45), "terzo.jpg"),
+                         "primo.jpg")
+        new_agent.close()
+
+    def test_near_duplicate_needs_every_hash(self):
+        """phash vicino non basta: dhash o proporzioni diversi non sono un duplicato."""
+        self.agent.near_duplicate(ImageSignature(0xFFFF0000FFFF0000, 0xF0F0, 0.45), "primo.jpg")
+        self.assertIsNone(self.agent.near_duplicate(ImageSignature(0xFFFF0000FFFF0000, 0x0F0F, 0.45), "dhash.jpg"))
+        self.assertIsNone(self.agent.near_duplicate(ImageSignature(0xFFFF0000FFFF0000, 0xF0F0, 0.9), "largo.jpg"))
+
+    def test_same_layout_different_receipt(self):
+        """Due scontrini dello stesso bar, con la stessa impaginazione ma importi diversi, non sono duplicati."""
+        first = make_receipt(["BAR CENTRALE", "CAFFE 1,20", "CORNETTO 1,50", "TOTALE 2,70"])
+        second = make_receipt(["BAR CENTRALE", "CAFFE 1,20", "CORNETTO 1,50", "TOTALE 2,80"], 1)
+        third = make_receipt(["BAR CENTRALE", "CAFFE 1,20", "BRIOCHE 1,80", "TOTALE 3,00"], 2)
+
+        self.assertIsNone(self.agent.near_duplicate(signature(first), "primo.jpg"))
+        self.assertIsNone(self.agent.near_duplicate(signature(second), "secondo.jpg"))
+        self.assertIsNone(self.agent.near_duplicate(signature(third), "terzo.jpg"))
+        # Lo stesso scontrino rifotografato più piccolo e ricompresso resta un duplicato
+        import cv2
+        again = cv2.resize(make_receipt(["BAR CENTRALE", "CAFFE 1,20", "CORNETTO 1,50", "TOTALE 2,70"], 3),
+                           (300, 675))
+        _, encoded = cv2.imencode(".jpg", again, [cv2.IMWRITE_JPEG_QUALITY, 60])
+        again = cv2.imdecode(encoded, cv2.IMREAD_GRAYSCALE)
+        self.assertEqual(self.agent.near_duplicate(signature(again), "di_nuovo.jpg"), "primo.jpg")
+
+    def test_old_index_migrated(self):
+        """Le righe salvate col solo phash non confermano più un duplicato."""
+        self.agent.close()
+        from src.utils.storage import open_database
+        path = os.path.join(self.test_dir, ".file_history.sqlite3")
+        os.remove(path)
+        conn = open_database(path)
+        conn.execute("CREATE TABLE perceptual (phash TEXT NOT NULL, path TEXT NOT NULL, created_at REAL NOT NULL)")
+        conn.execute("INSERT INTO perceptual VALUES ('ffff0000ffff0000', 'vecchio.jpg', 0)")
+        conn.commit()
+        conn.close()
+
+        self.agent = FileAgent(self.test_dir)
+        self.assertIsNone(self.agent.near_duplicate(ImageSignature(0xFFFF0000FFFF0000, 0xF0F0, 0.45), "nuovo.jpg"))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
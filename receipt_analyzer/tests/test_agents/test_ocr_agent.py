@@ -9,7 +9,7 @@ import os
 # Aggiungi il percorso root del progetto al PYTHONPATH
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
-from src.agents.ocr_agent import OCRAgent
+from src.agents.ocr_agent import OCRAgent, archive_image, estimate_noise, preprocess
 
 
 class TestOCRAgent(unittest.TestCase):
@@ -50,15 +50,47 @@ class TestOCRAgent(unittest.TestCase):
         # Verifica che l'immagine sia stata modificata
         self.assertFalse(np.array_equal(sharpened, self.test_img))
 
-    def test_optimize_image(self):
-        optimized_path = self.agent.optimize_image(self.test_image_path)
-        self.assertTrue(os.path.exists(optimized_path))
-        self.assertNotEqual(optimized_path, self.test_image_path)
+    def test_preprocess_downscaled_grayscale(self):
+        large = cv2.resize(self.test_img, (4000, 3000))
+        processed, timings = preprocess(large, max_edge=1000)
 
-        # Verifica che l'immagine ottimizzata sia diversa dall'originale
-        optimized_img = cv2.imread(optimized_path)
-        original_img = cv2.imread(self.test_image_path)
-        self.assertFalse(np.array_equal(optimized_img, original_img))
+        self.assertEqual(processed.shape, (750, 1000))
+        for step in ("resize", "grayscale", "stima_rumore", "sharpen"):
+            self.assertIn(step, timings)
+
+    def test_preprocess_skips_unneeded_steps(self):
+        """Immagine pulita e contrastata: niente CLAHE né denoise."""
+        _, timings = preprocess(self.test_img, noise_threshold=4.0, contrast_threshold=10.0)
+        self.assertIn("contrast_saltato", timings)
+        self.assertIn("denoise_saltato", timings)
+
+        rng = np.random.default_rng(0)
+        noisy = np.clip(np.full((200, 200), 128.0) + rng.normal(0, 20, (200, 200)), 0, 255).astype(np.uint8)
+        self.assertGreater(estimate_noise(noisy), 10)
+        _, timings = preprocess(noisy, noise_threshold=4.0)
+        self.assertIn("denoise", timings)
+
+    def test_optimize_to_buffer_async(self):
+        """Il buffer arriva dal pool senza file temporanei accanto all'originale."""
+        import hashlib
+        try:
+            image = self.agent.optimize_to_buffer_async(self.test_image_path).result(timeout=60)
+        finally:
+            self.agent.shutdown()
+        with open(self.test_image_path, "rb") as f:
+            self.assertEqual(image.source_hash, hashlib.sha256(f.read()).hexdigest())
+        self.assertEqual(os.listdir(self.temp_dir), ["test_image.jpg"])
+        decoded = cv2.imdecode(np.frombuffer(image.data, np.uint8), cv2.IMREAD_UNCHANGED)
+        self.assertEqual(decoded.ndim, 2)
+        self.assertIn("encode", image.timings)
+        self.assertIsNotNone(image.signature)
+
+    def test_archive_image(self):
+        path = os.path.join(self.temp_dir, "Scontrino.jpg")
+        self.assertEqual(archive_image(b"dati", path), path)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"dati")
+        self.assertFalse(os.path.exists(path + ".tmp"))
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
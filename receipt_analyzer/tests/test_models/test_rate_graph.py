@@ -0,0 +1,73 @@
+# tests/test_models/test_rate_graph.py
+import math
+import shutil
+import tempfile
+import unittest
+import sys
+import os
+# Aggiungi il percorso root del progetto al PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+import pandas as pd
+
+from src.models.rate_graph import RateGraph, fallback_graph
+from src.models.receipt_store import ReceiptStore
+
+
+class TestRateGraph(unittest.TestCase):
+    def setUp(self):
+        # Tabella con base EUR, come quella del giorno scaricata dal provider
+        self.graph = RateGraph({"USD": 1.08, "GBP": 0.86, "JPY": 162.0}, "EUR")
+
+    def test_triangulated_pairs(self):
+        """Ogni coppia si ricava dalla sola tabella della base."""
+        self.assertEqual(self.graph.rate("EUR", "EUR"), 1.0)
+        self.assertAlmostEqual(self.graph.rate("USD", "EUR"), 1 / 1.08)
+        self.assertAlmostEqual(self.graph.rate("GBP", "JPY"), 162.0 / 0.86)
+        self.assertIsNone(self.graph.rate("XXX", "EUR"))
+
+    def test_codes_normalized(self):
+        self.assertAlmostEqual(fallback_graph().rate(" ro ", "omr"), 1.0)
+        self.assertIn("usd", self.graph)
+
+    def test_vectorized_batch(self):
+        """Un lotto di importi in valute diverse è convertito in una volta; NaN per le valute sconosciute."""
+        converted = self.graph.convert([108.0, 86.0, 10.0, 5.0], ["USD", "GBP", "EUR", "XXX"], "EUR")
+        self.assertEqual(converted[:3].round(6).tolist(), [100.0, 100.0, 10.0])
+        self.assertTrue(math.isnan(converted[3]))
+        self.assertEqual(len(self.graph.convert([], [])), 0)
+
+    def test_fallback_covers_unlisted_pairs(self):
+        """Coppie che la vecchia tabella di coppie non conteneva (KZT, UZS -> EUR)."""
+        graph = fallback_graph()
+        for currency in ("KZT", "UZS", "OMR", "AED"):
+            with self.subTest(currency):
+                self.assertGreater(graph.rate(currency, "EUR"), 0)
+
+
+class TestExcelImport(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.store = ReceiptStore(os.path.join(self.test_dir, "receipts.sqlite3"))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_missing_eur_amounts_converted(self):
+        excel_path = os.path.join(self.test_dir, "pagamenti.xlsx")
+        pd.DataFrame([
+            {"Data": "2024-01-05", "Importo Originale": 10.0, "Valuta": "OMR", "Importo (EUR)": None,
+             "Descrizione": "Bar"},
+            {"Data": "2024-01-06", "Importo Originale": 20.0, "Valuta": "EUR", "Importo (EUR)": 20.0,
+             "Descrizione": "Hotel"},
+        ]).to_excel(excel_path, index=False)
+
+        self.assertEqual(self.store.import_excel(excel_path), 2)
+        rows = {row["Descrizione"]: row for chunk in self.store.iter_rows() for row in chunk}
+        self.assertAlmostEqual(rows["Bar"]["Importo (EUR)"], round(10.0 * 0.92 / 0.3845, 3))
+        self.assertEqual(rows["Hotel"]["Importo (EUR)"], 20.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+# tests/test_models/test_rate_store.py
+import asyncio
+import shutil
+import tempfile
+import time
+import unittest
+from unittest.mock import Mock, AsyncMock
+import sys
+import os
+# Aggiungi il percorso root del progetto al PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+from src.models.rate_store import RateStore
+from src.models.currency_manager import CurrencyConversionManager
+
+
+class TestRateStore(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.test_dir, "rates.sqlite3")
+        self.store = RateStore(self.db_path)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_save_and_get_table(self):
+        self.store.save_table("EUR", {"USD": 1.1, "OMR": 0.42}, "2024-01-16", "test")
+        table = self.store.get_table("EUR", "2024-01-16")
+
+        self.assertEqual(table["rates"], {"USD": 1.1, "OMR": 0.42})
+        self.assertEqual(table["source"], "test")
+        self.assertIsNone(self.store.get_table("EUR", "2024-01-17"))
+
+    def test_persistence(self):
+        """La tabella sopravvive alla riapertura del database."""
+        self.store.save_table("EUR", {"USD": 1.1}, "2024-01-16", "test")
+        self.store.close()
+
+        self.store = RateStore(self.db_path)
+        self.assertEqual(self.store.get_table("EUR", "2024-01-16")["rates"], {"USD": 1.1})
+
+    def test_find_table_uses_previous_business_day(self):
+        """Per un sabato viene usata la tabella del venerdì precedente."""
+        self.store.save_tables("EUR", {
+            "2024-01-04": {"USD": 1.09},
+            "2024-01-05": {"USD": 1.10},
+            "2024-01-08": {"USD": 1.11},
+        }, "test")
+
+        table = self.store.find_table("EUR", "2024-01-06", max_gap_days=5)
+        self.assertEqual(table["date"], "2024-01-05")
+        self.assertEqual(table["rates"], {"USD": 1.10})
+
+        self.assertEqual(self.store.find_table("EUR", "2024-01-08", 5)["date"], "2024-01-08")
+        self.assertIsNone(self.store.find_table("EUR", "2024-01-01", 5))
+        self.assertIsNone(self.store.find_table("EUR", "2024-02-01", 5))
+
+    def test_ttl(self):
+        self.store.save_table("EUR", {"USD": 1.1}, "2024-01-16", "test")
+        self.assertIsNotNone(self.store.get_table("EUR", "2024-01-16", max_age=60))
+
+        # Simula una tabella scaricata due ore fa
+        self.store._conn.execute("UPDATE rates SET fetched_at = ?", (time.time() - 7200,))
+        self.assertIsNone(self.store.get_table("EUR", "2024-01-16", max_age=3600))
+
+
+class TestCachedConversion(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.store = RateStore(os.path.join(self.test_dir, "rates.sqlite3"))
+        self.mock_processor = Mock()
+        self.manager = CurrencyConversionManager(self.mock_processor, rate_store=self.store)
+        self.manager.fetch_rate_table = AsyncMock(return_value=({"USD": 1.25, "OMR": 0.5}, "test"))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_one_fetch_for_whole_batch(self):
+        """Tutti gli scontrini del batch usano la stessa tabella scaricata una volta."""
+        async def batch():
+            return await asyncio.gather(*[
+                self.manager.get_cached_rate(currency, "EUR")
+                for currency in ["USD", "OMR", "USD", "EUR", "OMR"]
+            ])
+
+        results = asyncio.run(batch())
+
+        self.assertEqual(self.manager.fetch_rate_table.await_count, 1)
+        self.assertAlmostEqual(results[0][0], 0.8)
+        self.assertAlmostEqual(results[1][0], 2.0)
+        self.assertAlmostEqual(results[3][0], 1.0)
+        self.assertEqual(self.manager.cache_stats["hit"], 4)
+        self.assertEqual(self.manager.cache_stats["miss"], 1)
+
+    def test_table_reused_after_restart(self):
+        """Un nuovo manager legge la tabella dal disco senza chiamare il provider."""
+        asyncio.run(self.manager.get_cached_rate("USD"))
+
+        manager = CurrencyConversionManager(self.mock_processor, rate_store=self.store)
+        manager.fetch_rate_table = AsyncMock(return_value=(None, None))
+        rate, _ = asyncio.run(manager.get_cached_rate("USD"))
+
+        self.assertAlmostEqual(rate, 0.8)
+        manager.fetch_rate_table.assert_not_awaited()
+        self.assertEqual(manager.cache_stats["hit"], 1)
+
+    def test_historical_rate_by_receipt_date(self):
+        """Scontrini di date diverse vicine tra loro usano una sola richiesta storica."""
+        self.manager.fetch_rate_series = AsyncMock(return_value={
+            "2023-03-01": {"USD": 1.06},
+            "2023-03-02": {"USD": 1.0},
+            "2023-03-03": {"USD": 1.25},
+        })
+
+        rate1, source, rate_date = asyncio.run(self.manager.get_historical_rate("USD", "EUR", "2023-03-02"))
+        rate2, _, rate_date2 = asyncio.run(self.manager.get_historical_rate("USD", "EUR", "2023-03-05"))
+
+        self.assertAlmostEqual(rate1, 1.0)
+        self.assertEqual(rate_date, "2023-03-02")
+        self.assertIn("2023-03-02", source)
+        self.assertAlmostEqual(rate2, 0.8)
+        self.assertEqual(rate_date2, "2023-03-03")
+        self.assertEqual(self.manager.fetch_rate_series.await_count, 1)
+
+    def test_backfill_single_request_per_range(self):
+        self.manager.fetch_rate_series = AsyncMock(return_value={"2023-01-10": {"USD": 1.07}})
+        dates = ["2023-01-10", "2023-02-15", "2023-01-20"]
+
+        asyncio.run(self.manager.backfill(dates))
+
+        self.manager.fetch_rate_series.assert_awaited_once_with("2023-01-05", "2023-02-15", "EUR")
+
+    def test_unknown_currency(self):
+        rate, source = asyncio.run(self.manager.get_cached_rate("XXX"))
+        self.assertIsNone(rate)
+        self.assertIsNone(source)
+
+
+if __name__ == '__main__':
+    unittest.main()
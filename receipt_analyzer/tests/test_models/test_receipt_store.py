@@ -0,0 +1,83 @@
+# tests/test_models/test_receipt_store.py
+import shutil
+import tempfile
+import unittest
+import sys
+import os
+# Aggiungi il percorso root del progetto al PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+from src.models.receipt_store import ReceiptStore
+
+
+def make_row(descrizione="Bar Centrale - Roma", importo=12.5, file="Scontrino_1.jpg"):
+    return {
+        "Data": "2024-01-16",
+        "Importo": importo,
+        "Valuta": "EUR",
+        "Importo (EUR)": importo,
+        "Descrizione": descrizione,
+        "Categoria": "Cibo e Ristorazione",
+        "Sottocategoria": "Bar",
+        "File": file
+    }
+
+
+class TestReceiptStore(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.store = ReceiptStore(os.path.join(self.test_dir, "receipts.sqlite3"))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_add_and_read(self):
+        self.assertTrue(self.store.add(make_row()))
+        rows = self.store.rows()
+
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["Importo Originale"], 12.5)
+        self.assertEqual(rows[0]["Descrizione"], "Bar Centrale - Roma")
+
+    def test_duplicate_keeps_last(self):
+        """Una riga con la stessa chiave aggiorna quella esistente invece di duplicarla."""
+        self.store.add(make_row(file="primo.jpg"))
+        self.assertFalse(self.store.add(make_row(file="secondo.jpg")))
+
+        self.assertEqual(self.store.count(), 1)
+        self.assertEqual(self.store.rows()[0]["File"], "secondo.jpg")
+
+    def test_iter_rows_in_chunks(self):
+        self.store.add_many([make_row(descrizione=f"Negozio {i}") for i in range(25)])
+
+        chunks = list(self.store.iter_rows(chunk_size=10))
+        self.assertEqual([len(c) for c in chunks], [10, 10, 5])
+        self.assertEqual(chunks[2][-1]["Descrizione"], "Negozio 24")
+
+    def test_excel_roundtrip(self):
+        """L'export Excel può essere reimportato in un archivio vuoto."""
+        self.store.add_many([make_row(descrizione=f"Negozio {i}", importo=i + 0.5) for i in range(3)])
+        excel_path = os.path.join(self.test_dir, "Reports", "pagamenti.xlsx")
+
+        self.assertEqual(self.store.export_excel(excel_path), 3)
+
+        other = ReceiptStore(os.path.join(self.test_dir, "other.sqlite3"))
+        try:
+            self.assertEqual(other.import_excel(excel_path), 3)
+            self.assertEqual(other.rows(), self.store.rows())
+        finally:
+            other.close()
+
+    def test_find_similar(self):
+        """Stessi data, importo e valuta con esercente letto in modo leggermente diverso."""
+        self.store.add(make_row())
+
+        match = self.store.find_similar(make_row(descrizione="BAR CENTRALE, Roma", file="altro.jpg"))
+        self.assertEqual(match["File"], "Scontrino_1.jpg")
+        self.assertIsNone(self.store.find_similar(make_row(descrizione="Farmacia Rossi - Roma")))
+        self.assertIsNone(self.store.find_similar(make_row(importo=12.6)))
+        self.assertIsNone(self.store.find_similar(dict(make_row(), Valuta="USD")))
+
+
+if __name__ == '__main__':
+    unittest.main()
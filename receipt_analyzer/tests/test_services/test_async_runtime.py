@@ -0,0 +1,65 @@
+# tests/test_services/test_async_runtime.py
+import asyncio
+import threading
+import unittest
+import sys
+import os
+# Aggiungi il percorso root del progetto al PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from src.services.async_runtime import AsyncRuntime
+
+
+class TestAsyncRuntime(unittest.TestCase):
+    def setUp(self):
+        self.runtime = AsyncRuntime()
+
+    def tearDown(self):
+        self.runtime.shutdown()
+
+    def test_run_coroutine(self):
+        """Le coroutine vengono eseguite sul loop condiviso."""
+        async def double(x):
+            await asyncio.sleep(0)
+            return x * 2
+
+        self.assertEqual(self.runtime.run(double(21)), 42)
+
+    def test_single_loop_across_threads(self):
+        """Worker diversi usano lo stesso event loop."""
+        loops = []
+
+        async def current_loop():
+            return asyncio.get_running_loop()
+
+        threads = [threading.Thread(target=lambda: loops.append(self.runtime.run(current_loop())))
+                   for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(set(map(id, loops))), 1)
+        self.assertIs(loops[0], self.runtime.loop)
+
+    def test_session_reuse(self):
+        """La sessione di un servizio viene creata una sola volta."""
+        async def sessions():
+            return self.runtime.session("fx"), self.runtime.session("fx"), self.runtime.session("geocoding")
+
+        fx1, fx2, geo = self.runtime.run(sessions())
+        self.assertIs(fx1, fx2)
+        self.assertIsNot(fx1, geo)
+
+    def test_shutdown_closes_sessions(self):
+        async def get_session():
+            return self.runtime.session("fx")
+
+        session = self.runtime.run(get_session())
+        self.runtime.shutdown()
+        self.assertTrue(session.closed)
+        self.assertTrue(self.runtime.loop.is_closed())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,222 @@
+# tests/test_services/test_batch_cli.py
+import base64
+import json
+import shutil
+import tempfile
+import unittest
+from unittest.mock import AsyncMock, Mock
+import sys
+import os
+# Aggiungi il percorso root del progetto al PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from src.cli import BatchProcessor, find_images
+from src.models.receipt_store import ReceiptStore
+from src.services.async_runtime import AsyncRuntime
+from src.services.result_cache import ResultCache
+
+
+def make_chain():
+    chain = Mock()
+    chain.stage_versions = {"analysis": "a1", "validation": "v1", "categorization": "c1"}
+    chain.analysis_chain.ainvoke = AsyncMock(side_effect=lambda inputs, **kwargs: json.dumps({
+        "data": "2024-01-16", "importo": 10, "valuta": "EUR",
+        "esercente": inputs["text"], "luogo": "Roma"
+    }))
+    chain.validation_chain.ainvoke = AsyncMock(return_value='{"valid": true}')
+    chain.categorize_with_intermediate_steps = AsyncMock(return_value={
+        "descrizione": "test", "categoria": {"categoria": "Cibo e Ristorazione", "sottocategoria": "Bar"}
+    })
+    return chain
+
+
+def make_client():
+    """
+    Client OpenAI finto: il testo 'estratto' è il contenuto del file; in
+    modalità single_pass restituisce la risposta strutturata completa.
+    """
+    client = Mock()
+
+    def create(**kwargs):
+        url = kwargs["messages"][0]["content"][1]["image_url"]["url"]
+        text = base64.b64decode(url.split(",", 1)[1]).decode()
+        if "response_format" in kwargs:
+            text = json.dumps({
+                "data": "2024-01-16", "importo": 10, "valuta": "EUR", "esercente": text, "luogo": "Roma",
+                "validazione": {"data_valida": True, "importo_valido": True, "valuta_valida": True},
+                "categoria": "Shopping", "sottocategoria": "Abbigliamento"
+            })
+        usage = Mock(prompt_tokens=800, completion_tokens=60)
+        return Mock(choices=[Mock(message=Mock(content=text))], usage=usage)
+
+    client.chat.completions.create = Mock(side_effect=create)
+    return client
+
+
+class TestBatchProcessor(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.images = os.path.join(self.test_dir, "scontrini")
+        os.makedirs(self.images)
+        merchants = {"a.jpg": "Bar Centrale", "b.png": "Farmacia Rossi", "c.JPEG": "Libreria Verdi",
+                     "a_optimized.jpg": "Bar Centrale", "note.txt": "appunti"}
+        for name, merchant in merchants.items():
+            with open(os.path.join(self.images, name), "w") as f:
+                f.write(merchant)
+        self.runtime = AsyncRuntime()
+        self.store = ReceiptStore(os.path.join(self.test_dir, "receipts.sqlite3"))
+        self.cache = ResultCache(os.path.join(self.test_dir, "cache.sqlite3"), 1024 * 1024)
+
+    def tearDown(self):
+        self.runtime.shutdown()
+        self.store.close()
+        self.cache.close()
+        shutil.rmtree(self.test_dir)
+
+    def make_processor(self, client, **kwargs):
+        return BatchProcessor(self.runtime, make_chain(), None, self.store,
+                              result_cache=self.cache, client=client, workers=2, **kwargs)
+
+    def test_find_images(self):
+        """Solo le immagini, senza le copie ottimizzate."""
+        names = [os.path.basename(p) for p in find_images(self.images)]
+        self.assertEqual(names, ["a.jpg", "b.png", "c.JPEG"])
+
+    def test_batch_stores_rows(self):
+        processor = self.make_processor(make_client())
+        summary = processor.run(find_images(self.images))
+
+        self.assertEqual(summary["completati"], 3)
+        self.assertEqual(summary["falliti"], 0)
+        self.assertEqual(self.store.count(), 3)
+        self.assertEqual(self.store.rows()[0]["Categoria"], "Cibo e Ristorazione")
+
+    def test_single_pass_mode(self):
+        """Una sola chiamata al modello per scontrino, nessuna catena testuale."""
+        client = make_client()
+        chain = make_chain()
+        processor = BatchProcessor(self.runtime, chain, None, self.store, client=client, mode="single_pass")
+        summary = processor.run(find_images(self.images))
+
+        self.assertEqual(client.chat.completions.create.call_count, 3)
+        chain.analysis_chain.ainvoke.assert_not_called()
+        chain.categorize_with_intermediate_steps.assert_not_called()
+        self.assertEqual(summary["totale_fasi"]["chiamate"], 3)
+        self.assertEqual(summary["totale_fasi"]["prompt_tokens"], 2400)
+        self.assertEqual(self.store.rows()[0]["Categoria"], "Shopping")
+
+    def test_stage_metrics(self):
+        """Ogni fase della pipeline a più passaggi ha le sue metriche."""
+        summary = self.make_processor(make_client()).run(find_images(self.images))
+
+        self.assertEqual(set(summary["fasi"]),
+                         {"prepare", "ocr", "analysis", "dedup", "validation", "fx", "categorization",
+                          "persistence"})
+        self.assertEqual(summary["fasi"]["ocr"]["chiamate"], 3)
+        self.assertEqual(summary["fasi"]["ocr"]["prompt_tokens"], 2400)
+
+    def test_second_run_uses_cache(self):
+        """Rielaborare la stessa cartella non chiama di nuovo il modello vision."""
+        paths = find_images(self.images)
+        self.make_processor(make_client()).run(paths)
+
+        client = make_client()
+        summary = self.make_processor(client).run(paths)
+
+        client.chat.completions.create.assert_not_called()
+        self.assertGreater(summary["cache_hit"], 0)
+
+    def test_spans_exported(self):
+        """Ogni fase di ogni scontrino, salvataggio compreso, finisce nel file degli span."""
+        from src.services.span_exporter import SpanExporter
+
+        spans_path = os.path.join(self.test_dir, "spans.jsonl")
+        exporter = SpanExporter(spans_path, os.path.join(self.test_dir, "metrics.prom"))
+        self.make_processor(make_client(), span_exporter=exporter).run(find_images(self.images))
+        exporter.close()
+
+        with open(spans_path, encoding="utf-8") as f:
+            spans = [json.loads(line) for line in f]
+        self.assertEqual(len([s for s in spans if s["fase"] == "persistence"]), 3)
+        self.assertEqual(exporter.stats()["ocr"]["prompt_tokens"], 2400)
+        self.assertEqual({s["scontrino"] for s in spans}, {"a.jpg", "b.png", "c.JPEG"})
+
+    def test_failures_are_counted(self):
+        client = make_client()
+        client.chat.completions.create = Mock(side_effect=RuntimeError("timeout"))
+
+        summary = self.make_processor(client).run(find_images(self.images))
+
+        self.assertEqual(summary["falliti"], 3)
+        self.assertEqual(self.store.count(), 0)
+
+    def test_jsonl_output(self):
+        output_path = os.path.join(self.test_dir, "results.jsonl")
+        with open(output_path, "w", encoding="utf-8") as output:
+            self.make_processor(make_client(), output=output).run(find_images(self.images))
+
+        with open(output_path, encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(len(lines), 3)
+        self.assertIn("Importo (EUR)", lines[0]["row"])
+
+    def test_semantic_duplicate_stops_before_fx(self):
+        """Stesso scontrino con l'esercente letto diversamente: niente categorizzazione."""
+        copy = os.path.join(self.images, "d.jpg")
+        with open(copy, "w") as f:
+            f.write("BAR CENTRALE.")
+        processor = self.make_processor(make_client())
+        processor.run(find_images(self.images)[:1])
+
+        processor = self.make_processor(make_client())
+        summary = processor.run([copy])
+
+        self.assertEqual(summary["duplicati"], 1)
+        self.assertEqual(summary["falliti"], 0)
+        self.assertEqual(self.store.count(), 1)
+        processor.analysis_chain.categorize_with_intermediate_steps.assert_not_called()
+
+    def test_interrupted_batch_resumes(self):
+        """Dopo un'interruzione le fasi già completate non sono ripetute."""
+        from src.services.job_journal import JobJournal
+
+        journal = JobJournal(os.path.join(self.test_dir, "jobs.sqlite3"))
+        path = find_images(self.images)[0]
+        client = make_client()
+        failing = make_chain()
+        failing.categorize_with_intermediate_steps = AsyncMock(side_effect=RuntimeError("chiusura"))
+        processor = BatchProcessor(self.runtime, failing, None, self.store, client=client, journal=journal)
+        self.assertEqual(processor.run([path])["falliti"], 1)
+        self.assertEqual(client.chat.completions.create.call_count, 1)
+
+        chain = make_chain()
+        processor = BatchProcessor(self.runtime, chain, None, self.store, client=client, journal=journal)
+        summary = processor.run([path])
+
+        self.assertEqual(summary["completati"], 1)
+        self.assertEqual(client.chat.completions.create.call_count, 1)  # OCR non ripetuto
+        chain.analysis_chain.ainvoke.assert_not_called()
+        chain.categorize_with_intermediate_steps.assert_called_once()
+        self.assertEqual(journal.unfinished(), [])
+        self.assertEqual(self.store.count(), 1)
+        journal.close()
+
+    def test_preloaded_image_skips_disk(self):
+        """Con il buffer già elaborato il file non viene letto (può non esistere ancora)."""
+        from src.agents.ocr_agent import OCR_PREPROCESS_VERSION, OptimizedImage
+        from src.services.result_cache import prompt_version
+
+        pipeline = self.make_processor(make_client()).pipeline()
+        pipeline.preloaded_image = OptimizedImage(b"Negozio in memoria", "image/jpeg", "abc123", 5000,
+                                                  (10, 10), {})
+        data = self.runtime.run(pipeline.process_receipt(os.path.join(self.test_dir, "assente.jpg")))
+
+        self.assertEqual(data["esercente"], "Negozio in memoria")
+        # La chiave non coincide con quella del percorso da file, che invia un'altra immagine
+        self.assertNotEqual(pipeline.stage_keys["image"], "abc123")
+        self.assertEqual(pipeline.stage_keys["image"], prompt_version("abc123", OCR_PREPROCESS_VERSION))
+        self.assertEqual(pipeline.image_stats["bytes_risparmiati"], 5000 - len(b"Negozio in memoria"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+# tests/test_services/test_benchmark.py
+import json
+import shutil
+import tempfile
+import unittest
+import sys
+import os
+# Aggiungi il percorso root del progetto al PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+import httpx
+import openai
+
+from src.benchmark.fake_services import FakeServices, receipt_fields
+from src.benchmark.harness import compare, latest_result, percentiles, run_benchmark, save_result
+from src.services.pipeline import VISION_PROMPT, vision_messages
+
+
+class TestFakeServices(unittest.TestCase):
+    def setUp(self):
+        self.services = FakeServices().start()
+
+    def tearDown(self):
+        self.services.stop()
+
+    def test_vision_completion(self):
+        """La risposta OCR dipende solo dall'immagine inviata."""
+        client = openai.OpenAI(api_key="sk-test", base_url=self.services.openai_url)
+        url = "data:image/jpeg;base64,AAAA"
+        completion = client.chat.completions.create(model="gpt-4o", messages=vision_messages(VISION_PROMPT, [url]))
+
+        self.assertEqual(json.loads(completion.choices[0].message.content), receipt_fields(url))
+        self.assertGreater(completion.usage.prompt_tokens, 765)
+        self.assertEqual(self.services.stats["openai"]["richieste"], 1)
+
+    def test_fx_and_geocoding(self):
+        table = httpx.get(f"{self.services.fx_api_url}/latest/EUR").json()["rates"]
+        self.assertEqual(table["USD"], 1.08)
+
+        history = httpx.get(f"{self.services.fx_history_url}/2024-01-05..2024-01-08").json()["rates"]
+        self.assertEqual(sorted(history), ["2024-01-05", "2024-01-08"])  # Niente weekend
+
+        places = httpx.get(self.services.geocoding_url, params={"q": "Roma"}).json()
+        self.assertEqual(places[0]["display_name"], "Roma, Italia")
+
+    def test_error_rate(self):
+        self.services.error_rate = 1.0
+        response = httpx.get(self.services.geocoding_url, params={"q": "Roma"})
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.services.stats["geocoding"]["errori"], 1)
+
+
+class TestHarness(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_percentiles(self):
+        values = [i / 100 for i in range(1, 101)]
+        self.assertEqual(percentiles(values), {"p50": 0.5, "p95": 0.95, "p99": 0.99})
+        self.assertEqual(percentiles([]), {"p50": 0.0, "p95": 0.0, "p99": 0.0})
+
+    def test_benchmark_run_and_comparison(self):
+        """Un corpus minimo attraversa tutta la pipeline; il secondo risultato è confrontato col primo."""
+        latency = {"openai": 0.0, "fx": 0.0, "geocoding": 0.0}
+        results = run_benchmark([3], latency, workers=2, isolate=False, log=lambda message: None)
+        result = results["corpus"]["3"]
+
+        self.assertEqual(result["completati"], 3)
+        self.assertEqual(result["falliti"], 0)
+        self.assertIn("ocr", result["fasi"])
+        self.assertEqual(set(result["fasi"]["ocr"]), {"p50", "p95", "p99"})
+        self.assertGreater(result["richieste"]["openai"]["richieste"], 0)
+
+        self.assertIsNone(latest_result(results["config"], self.test_dir))
+        save_result(results, self.test_dir)
+        path, previous = latest_result(results["config"], self.test_dir)
+        self.assertEqual(previous["corpus"]["3"]["completati"], 3)
+        self.assertEqual(compare(results, previous)["3"]["scontrini_al_secondo"], 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+# tests/test_services/test_fx_providers.py
+import asyncio
+import time
+import unittest
+from unittest.mock import AsyncMock, Mock
+import sys
+import os
+# Aggiungi il percorso root del progetto al PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from src.benchmark.fake_services import FakeServices
+from src.models.currency_manager import CurrencyConversionManager
+from src.services.fx_providers import FxProvider, HedgedRateLookup
+
+
+def provider(name, rate, delay=0.0, error=None, calls=None):
+    async def fetch(from_currency, to_currency):
+        if calls is not None:
+            calls.append(name)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            if calls is not None:
+                calls.append(f"{name} annullato")
+            raise
+        if error:
+            raise error
+        return rate
+    return FxProvider(name, fetch)
+
+
+def lookup(**kwargs):
+    options = {"timeout": 1.0, "hedge_delay": 0.05, "deadline": 2.0}
+    return HedgedRateLookup(**{**options, **kwargs})
+
+
+class TestHedgedRateLookup(unittest.TestCase):
+    def test_hedge_beats_slow_provider(self):
+        """Il provider lento non blocca: dopo hedge_delay parte il successivo e vince; il lento è annullato."""
+        calls = []
+        rates = lookup()
+        started = time.perf_counter()
+        result = asyncio.run(rates.lookup([provider("lento", 1.0, 5.0, calls=calls),
+                                           provider("veloce", 0.92, calls=calls)], "USD", "EUR"))
+
+        self.assertEqual(result, (0.92, "veloce"))
+        self.assertLess(time.perf_counter() - started, 0.5)
+        self.assertIn("lento annullato", calls)
+        self.assertEqual(rates.stats["coperture"], 1)
+
+    def test_failure_starts_next_immediately(self):
+        rates = lookup(hedge_delay=1.0)
+        started = time.perf_counter()
+        result = asyncio.run(rates.lookup([provider("rotto", None, error=ValueError("errore 500")),
+                                           provider("buono", 0.92)], "USD", "EUR"))
+        self.assertEqual(result, (0.92, "buono"))
+        self.assertLess(time.perf_counter() - started, 0.5)
+        self.assertEqual(rates.stats["coperture"], 0)
+
+    def test_health_reorders_providers(self):
+        """Un provider che scade o fallisce scende dopo quelli che rispondono."""
+        rates = lookup(timeout=0.05, hedge_delay=0.2)
+        providers = [provider("scade", 1.0, 1.0), provider("buono", 0.92)]
+        asyncio.run(rates.lookup(providers, "USD", "EUR"))
+
+        self.assertEqual([p.name for p in rates.ordered(providers)], ["buono", "scade"])
+        self.assertEqual(rates.report()["scade"]["errori"], 1)
+
+    def test_cancelled_provider_degrades(self):
+        """Il provider lento battuto ogni volta peggiora comunque: latenza salita, finisce dopo il veloce."""
+        rates = lookup(hedge_delay=0.05)
+        providers = [provider("lento", 1.0, 5.0), provider("veloce", 0.92, 0.01)]
+        for _ in range(2):
+            self.assertEqual(asyncio.run(rates.lookup(providers, "USD", "EUR")), (0.92, "veloce"))
+
+        report = rates.report()
+        self.assertEqual(report["lento"]["chiamate"], 1)
+        self.assertEqual(report["lento"]["errori"], 0)
+        self.assertGreater(report["lento"]["latenza"], 0)
+        self.assertEqual([p.name for p in rates.ordered(providers)], ["veloce", "lento"])
+
+    def test_deadline(self):
+        rates = lookup(deadline=0.2)
+        started = time.perf_counter()
+        result = asyncio.run(rates.lookup([provider("a", 1.0, 5.0), provider("b", 1.0, 5.0)], "USD", "EUR"))
+        self.assertEqual(result, (None, None))
+        self.assertLess(time.perf_counter() - started, 0.5)
+        self.assertEqual(rates.stats["senza_esito"], 1)
+        # Scaduti alla fine della ricerca: fallimenti
+        self.assertEqual(rates.report()["a"]["errori"], 1)
+        self.assertEqual(rates.report()["b"]["errori"], 1)
+
+
+class TestManagerProviders(unittest.TestCase):
+    def setUp(self):
+        self.services = FakeServices().start()
+        self.manager = CurrencyConversionManager(Mock(), interactive=False)
+        self.manager.exchange_api_key = None
+        self.manager.forex_url = self.services.forex_url
+        self.manager.fixer_url = self.services.fixer_url
+
+    def tearDown(self):
+        self.services.stop()
+
+    def test_lookup_rate_from_provider(self):
+        rate, source = asyncio.run(self.manager.lookup_rate("USD", "EUR"))
+        self.assertAlmostEqual(rate, 1 / 1.08, places=5)
+        self.assertEqual(source, "Forex Python")
+
+    def test_fallback_not_remembered(self):
+        """Dopo un tasso di fallback, un provider tornato disponibile è usato alla richiesta successiva."""
+        self.manager.get_cached_rate = AsyncMock(return_value=(None, None))
+        self.services.error_rate = 1.0
+        self.assertEqual(asyncio.run(self.manager.get_conversion_rate("USD", "EUR"))["source"], "Fallback")
+        self.services.error_rate = 0.0
+        self.assertEqual(asyncio.run(self.manager.get_conversion_rate("USD", "EUR"))["source"], "Forex Python")
+
+    def test_fetch_fixer_io(self):
+        self.assertAlmostEqual(asyncio.run(self.manager.fetch_fixer_io("USD", "EUR")), 1 / 1.08, places=5)
+        self.services.error_rate = 1.0
+        with self.assertRaises(Exception):
+            asyncio.run(self.manager.fetch_fixer_io("USD", "EUR"))
+
+    def test_fallback_when_providers_fail(self):
+        self.services.error_rate = 1.0
+        rate, source = asyncio.run(self.manager.lookup_rate("OMR", "EUR"))
+        self.assertAlmostEqual(rate, 0.92 / 0.3845)
+        self.assertEqual(source, "Fallback")
+
+
+if __name__ == '__main__':
+    unittest.main()
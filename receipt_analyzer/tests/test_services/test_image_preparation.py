@@ -0,0 +1,61 @@
+# tests/test_services/test_image_preparation.py
+import unittest
+import sys
+import os
+# Aggiungi il percorso root del progetto al PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+import cv2
+import numpy as np
+
+from src.services.image_preparation import detect_mime, prepare_image
+
+
+def make_photo(width=3000, height=2000, fmt=".png"):
+    """Foto finta: scontrino chiaro con righe di testo su un tavolo scuro e rumoroso."""
+    rng = np.random.default_rng(0)
+    image = rng.integers(20, 80, size=(height, width, 3), dtype=np.uint8)
+    x0, y0, x1, y1 = width // 3, height // 8, 2 * width // 3, 7 * height // 8
+    image[y0:y1, x0:x1] = 235
+    for y in range(y0 + 60, y1 - 60, 60):
+        cv2.putText(image, "TOTALE 12,50 EUR", (x0 + 40, y), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (20, 20, 20), 2)
+    ok, encoded = cv2.imencode(fmt, image)
+    return encoded.tobytes(), (x1 - x0, y1 - y0)
+
+
+class TestImagePreparation(unittest.TestCase):
+    def test_downscale_crop_and_recompress(self):
+        data, (receipt_w, receipt_h) = make_photo()
+        prepared = prepare_image(data, max_edge=1200, image_format="jpeg", quality=80)
+
+        self.assertEqual(prepared.mime, "image/jpeg")
+        self.assertEqual(prepared.original_size, (3000, 2000))
+        self.assertLessEqual(max(prepared.size), 1200)
+        self.assertGreater(prepared.bytes_saved, 0)
+        # Ritagliata sullo scontrino: proporzioni dello scontrino, non della foto
+        width, height = prepared.size
+        self.assertAlmostEqual(width / height, receipt_w / receipt_h, delta=0.15)
+
+        decoded = cv2.imdecode(np.frombuffer(prepared.data, np.uint8), cv2.IMREAD_UNCHANGED)
+        self.assertEqual(decoded.ndim, 2)  # scala di grigi
+
+    def test_webp(self):
+        data, _ = make_photo(1000, 800)
+        prepared = prepare_image(data, image_format="webp", auto_crop=False)
+        self.assertEqual(prepared.mime, "image/webp")
+        self.assertEqual(detect_mime(prepared.data), "image/webp")
+
+    def test_undecodable_kept_as_is(self):
+        prepared = prepare_image(b"non un'immagine")
+        self.assertEqual(prepared.data, b"non un'immagine")
+        self.assertEqual(prepared.bytes_saved, 0)
+
+    def test_detect_mime(self):
+        data, _ = make_photo(100, 100, ".png")
+        self.assertEqual(detect_mime(data), "image/png")
+        data, _ = make_photo(100, 100, ".jpg")
+        self.assertEqual(detect_mime(data), "image/jpeg")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+# tests/test_services/test_job_journal.py
+import shutil
+import tempfile
+import unittest
+import sys
+import os
+# Aggiungi il percorso root del progetto al PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from src.services.job_journal import FAILED, QUEUED, JobJournal
+
+
+class TestJobJournal(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.test_dir, "jobs.sqlite3")
+        self.journal = JobJournal(self.db_path)
+
+    def tearDown(self):
+        self.journal.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_stages_survive_restart(self):
+        job_id = self.journal.enqueue("a.jpg", priority=5, source="originale.jpg").id
+        self.journal.record_stage(job_id, "ocr", '{"importo": 3}')
+        self.journal.record_stage(job_id, "analysis", {"importo": 3, "valuta": "EUR"})
+        self.journal.close()
+
+        # Riapertura dopo una chiusura imprevista
+        self.journal = JobJournal(self.db_path)
+        [job] = self.journal.unfinished()
+        self.assertEqual((job.id, job.path, job.source, job.priority, job.state),
+                         (job_id, "a.jpg", "originale.jpg", 5, "analysis"))
+        self.assertEqual(self.journal.completed_stages(job_id),
+                         {"ocr": '{"importo": 3}', "analysis": {"importo": 3, "valuta": "EUR"}})
+
+    def test_complete_and_fail(self):
+        done = self.journal.enqueue("a.jpg").id
+        self.journal.record_stage(done, "ocr", "testo")
+        self.journal.complete(done)
+        failed = self.journal.enqueue("b.jpg").id
+        self.journal.record_stage(failed, "ocr", "testo")
+        self.journal.fail(failed, "timeout")
+
+        self.assertEqual(self.journal.unfinished(), [])
+        self.assertEqual(self.journal.completed_stages(done), {})
+        self.assertIsNone(self.journal.active_job("b.jpg"))
+
+        # Un nuovo tentativo sullo stesso file riusa il job e le sue fasi
+        self.assertEqual(self.journal.enqueue("b.jpg"), (failed, False, (0, FAILED, "timeout")))
+        self.assertEqual(self.journal.unfinished()[0].state, QUEUED)
+        self.assertEqual(self.journal.completed_stages(failed), {"ocr": "testo"})
+        # Un file già salvato riparte da zero
+        self.assertTrue(self.journal.enqueue("a.jpg").created)
+        self.assertNotEqual(self.journal.active_job("a.jpg"), done)
+
+    def test_enqueue_reuses_active_job(self):
+        job_id = self.journal.enqueue("a.jpg").id
+        self.journal.record_stage(job_id, "ocr", "testo")
+        self.assertEqual(self.journal.enqueue("a.jpg").id, job_id)
+        self.assertEqual(self.journal.unfinished()[0].state, "ocr")
+        self.assertNotEqual(self.journal.unfinished()[0].state, FAILED)
+
+    def test_discard_and_move(self):
+        job_id = self.journal.enqueue("copia.jpg", source="originale.jpg").id
+        self.journal.move(job_id, "originale.jpg")
+        self.assertEqual(self.journal.active_job("originale.jpg"), job_id)
+        self.journal.discard(job_id)
+        self.assertEqual(self.journal.unfinished(), [])
+
+    def test_withdraw_keeps_reused_jobs(self):
+        """Un file rifiutato dalla coda non cancella il job esistente né le sue fasi."""
+        running = self.journal.enqueue("a.jpg", priority=2).id
+        self.journal.record_stage(running, "ocr", "testo")
+        self.journal.withdraw(self.journal.enqueue("a.jpg", priority=0))
+        [job] = self.journal.unfinished()
+        self.assertEqual((job.id, job.priority, job.state), (running, 2, "ocr"))
+        self.assertEqual(self.journal.completed_stages(running), {"ocr": "testo"})
+
+        failed = self.journal.enqueue("b.jpg").id
+        self.journal.fail(failed, "timeout")
+        self.journal.withdraw(self.journal.enqueue("b.jpg"))
+        self.assertIsNone(self.journal.active_job("b.jpg"))
+        self.assertEqual(self.journal.enqueue("b.jpg").previous, (0, FAILED, "timeout"))
+
+        entry = self.journal.enqueue("c.jpg")
+        self.journal.withdraw(entry)
+        self.assertIsNone(self.journal.active_job("c.jpg"))
+
+
+if __name__ == '__main__':
+    unittest.main()
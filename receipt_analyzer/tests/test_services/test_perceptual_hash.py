@@ -0,0 +1,53 @@
+# tests/test_services/test_perceptual_hash.py
+import random
+import unittest
+import sys
+import os
+# Aggiungi il percorso root del progetto al PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+import cv2
+
+from src.services.perceptual_hash import BKTree, dhash, hamming, phash
+from tests.receipt_images import make_receipt
+
+
+class TestPerceptualHash(unittest.TestCase):
+    def test_same_receipt_photographed_again(self):
+        """Ricompressione, scala e luce diverse: hash vicini; scontrino diverso: lontani."""
+        original = make_receipt(["BAR CENTRALE", "CAFFE 1,20", "CORNETTO 1,50", "TOTALE 2,70"])
+        again = cv2.resize(make_receipt(["BAR CENTRALE", "CAFFE 1,20", "CORNETTO 1,50", "TOTALE 2,70"], 1),
+                           (300, 675))
+        again = cv2.convertScaleAbs(again, alpha=0.9, beta=10)
+        _, encoded = cv2.imencode(".jpg", again, [cv2.IMWRITE_JPEG_QUALITY, 60])
+        again = cv2.imdecode(encoded, cv2.IMREAD_GRAYSCALE)
+        other = make_receipt(["FARMACIA", "", "", "", "", "", "", "ASPIRINA 8,90", "", "", "TOTALE 8,90"])
+
+        self.assertLessEqual(hamming(phash(original), phash(again)), 6)
+        self.assertGreater(hamming(phash(original), phash(other)), 6)
+        self.assertEqual(dhash(original), dhash(original.copy()))
+        self.assertLess(dhash(original), 1 << 64)
+
+    def test_bktree_matches_linear_scan(self):
+        rng = random.Random(0)
+        values = [rng.getrandbits(64) for _ in range(2000)]
+        tree = BKTree()
+        for i, value in enumerate(values):
+            tree.add(value, i)
+        self.assertEqual(len(tree), 2000)
+
+        for query in values[:20] + [rng.getrandbits(64) for _ in range(20)]:
+            expected = sorted(i for i, value in enumerate(values) if hamming(query, value) <= 12)
+            found = sorted(item for _, _, item in tree.search(query, 12))
+            self.assertEqual(found, expected)
+
+    def test_search_closest_first(self):
+        tree = BKTree()
+        tree.add(0b1111, "lontano")
+        tree.add(0b0001, "vicino")
+        self.assertEqual([item for _, _, item in tree.search(0, 4)], ["vicino", "lontano"])
+        self.assertEqual(BKTree().search(0, 4), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
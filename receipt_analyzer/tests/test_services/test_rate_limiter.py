@@ -0,0 +1,177 @@
+# tests/test_services/test_rate_limiter.py
+import asyncio
+import time
+import unittest
+import sys
+import os
+# Aggiungi il percorso root del progetto al PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from src.benchmark.fake_services import FakeServices
+from src.services.async_runtime import AsyncRuntime
+from src.services.pipeline import VISION_PROMPT, vision_messages
+from src.services.rate_limiter import ProviderUnavailable, RateLimiter, TokenBucket
+from src.services.stage_metrics import StageMetrics
+
+
+class StatusError(Exception):
+    """Errore con lo stato HTTP, come openai.APIStatusError."""
+
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class FlakyCall:
+    """Fallisce con gli stati indicati, poi risponde "ok"."""
+
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.statuses:
+            raise StatusError(self.statuses.pop(0))
+        return "ok"
+
+
+def limiter(**kwargs):
+    options = {"retry_base": 0.001, "retry_max": 0.01, "breaker_threshold": 3, "breaker_cooldown": 0.05}
+    return RateLimiter(**{**options, **kwargs})
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_retries_transient_errors(self):
+        """429 e 5xx sono ripetuti; i tentativi sono contati nella fase in corso."""
+        rate_limiter = limiter()
+        call = FlakyCall(429, 503)
+        metrics = StageMetrics()
+
+        async def run():
+            with metrics.measure("analysis"):
+                return await rate_limiter.call(call)
+
+        self.assertEqual(asyncio.run(run()), "ok")
+        self.assertEqual(call.calls, 3)
+        self.assertEqual(rate_limiter.stats["rate_limit"], 1)
+        self.assertEqual(metrics.stages["analysis"]["tentativi"], 2)
+
+    def test_client_errors_not_retried(self):
+        rate_limiter = limiter()
+        call = FlakyCall(400)
+        with self.assertRaises(StatusError):
+            asyncio.run(rate_limiter.call(call))
+        self.assertEqual(call.calls, 1)
+
+    def test_retries_exhausted(self):
+        rate_limiter = limiter(max_retries=2)
+        call = FlakyCall(429, 429, 429, 429)
+        with self.assertRaises(StatusError):
+            asyncio.run(rate_limiter.call(call))
+        self.assertEqual(call.calls, 3)
+
+    def test_circuit_breaker(self):
+        """Dopo la soglia il circuito si apre; passato il cooldown una chiamata riuscita lo richiude."""
+        rate_limiter = limiter()
+        with self.assertRaises(StatusError):
+            asyncio.run(rate_limiter.call(FlakyCall(500, 500, 500)))
+        self.assertEqual(rate_limiter.state()["circuito"], "aperto")
+
+        call = FlakyCall()
+        with self.assertRaises(ProviderUnavailable):
+            asyncio.run(rate_limiter.call(call))
+        self.assertEqual(call.calls, 0)
+
+        time.sleep(0.06)
+        self.assertEqual(asyncio.run(rate_limiter.call(call)), "ok")
+        self.assertEqual(rate_limiter.state()["circuito"], "chiuso")
+
+    def test_failed_probe_reopens(self):
+        rate_limiter = limiter()
+        with self.assertRaises(StatusError):
+            asyncio.run(rate_limiter.call(FlakyCall(500, 500, 500)))
+        time.sleep(0.06)
+        with self.assertRaises(StatusError):
+            asyncio.run(rate_limiter.call(FlakyCall(502)))
+        with self.assertRaises(ProviderUnavailable):
+            asyncio.run(rate_limiter.call(FlakyCall()))
+
+    def open_circuit(self):
+        rate_limiter = limiter()
+        with self.assertRaises(StatusError):
+            asyncio.run(rate_limiter.call(FlakyCall(500, 500, 500)))
+        time.sleep(0.06)
+        return rate_limiter
+
+    def test_probe_client_error_closes(self):
+        """Un 400 sulla prova dimostra che il provider risponde: il circuito si chiude."""
+        rate_limiter = self.open_circuit()
+        with self.assertRaises(StatusError):
+            asyncio.run(rate_limiter.call(FlakyCall(400)))
+        self.assertEqual(rate_limiter.state()["circuito"], "chiuso")
+        self.assertEqual(asyncio.run(rate_limiter.call(FlakyCall())), "ok")
+
+    def test_probe_rate_limited_reopens(self):
+        """Un 429 sulla prova riapre il circuito per un altro cooldown, poi una nuova prova passa."""
+        rate_limiter = self.open_circuit()
+        with self.assertRaises(StatusError):
+            asyncio.run(rate_limiter.call(FlakyCall(429)))
+        with self.assertRaises(ProviderUnavailable):
+            asyncio.run(rate_limiter.call(FlakyCall()))
+        time.sleep(0.06)
+        rate_limiter.requests.update(None, 100, time.monotonic())
+        rate_limiter.tokens.update(None, 100000, time.monotonic())
+        self.assertEqual(asyncio.run(rate_limiter.call(FlakyCall())), "ok")
+
+    def test_probe_cancelled_reopens(self):
+        rate_limiter = self.open_circuit()
+
+        async def cancelled_probe():
+            task = asyncio.ensure_future(rate_limiter.call(lambda: asyncio.sleep(10)))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancelled_probe())
+        with self.assertRaises(ProviderUnavailable):
+            asyncio.run(rate_limiter.call(FlakyCall()))
+        time.sleep(0.06)
+        self.assertEqual(asyncio.run(rate_limiter.call(FlakyCall())), "ok")
+
+    def test_bucket_wait(self):
+        """Oltre la capacità del minuto la chiamata attende il riempimento del secchio."""
+        bucket = TokenBucket(60)
+        now = time.monotonic()
+        self.assertEqual(bucket.reserve(60, now), 0.0)
+        self.assertAlmostEqual(bucket.reserve(2, now), 2.0)
+        bucket.update(120, 120, now)
+        self.assertEqual(bucket.reserve(1, now), 0.0)
+
+    def test_observe_headers(self):
+        rate_limiter = limiter()
+        rate_limiter.observe_headers({"x-ratelimit-limit-requests": "60", "x-ratelimit-remaining-requests": "0",
+                                      "x-ratelimit-limit-tokens": "1000", "x-ratelimit-remaining-tokens": "1000"})
+        self.assertEqual(rate_limiter.state()["limite_richieste"], 60)
+        self.assertGreater(rate_limiter._reserve(10), 0.5)
+
+
+class TestRuntimeLimits(unittest.TestCase):
+    def test_limits_read_from_responses(self):
+        """I client del runtime aggiornano il limitatore con gli header delle risposte."""
+        with FakeServices() as services:
+            runtime = AsyncRuntime()
+            try:
+                services.rate_limits["requests"] = 1234
+                client = runtime.openai_client("sk-test", services.openai_url)
+                self.assertEqual(client.max_retries, 0)
+                messages = vision_messages(VISION_PROMPT, ["data:image/jpeg;base64,AAAA"])
+                client.chat.completions.create(model="gpt-4o", messages=messages)
+                self.assertEqual(runtime.openai_limiter.state()["limite_richieste"], 1234)
+            finally:
+                runtime.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+# tests/test_services/test_receipt_watcher.py
+import shutil
+import tempfile
+import time
+import unittest
+import sys
+import os
+# Aggiungi il percorso root del progetto al PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from watchdog.events import FileCreatedEvent, FileModifiedEvent, FileMovedEvent
+
+from src.agents.file_agent import FileAgent
+from src.agents.ocr_agent import file_signature
+from src.services.receipt_watcher import ReceiptWatcher
+from tests.receipt_images import make_receipt
+
+
+class TestReceiptWatcher(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.submitted = []
+        self.accept = True
+        self.seen = set()
+        self.watcher = ReceiptWatcher(self.test_dir, self.submit, self.is_duplicate, settle=0.05)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def submit(self, path):
+        if self.accept:
+            self.submitted.append(os.path.basename(path))
+        return self.accept
+
+    def is_duplicate(self, path):
+        with open(path, "rb") as f:
+            content = f.read()
+        if content in self.seen:
+            return True
+        self.seen.add(content)
+        return False
+
+    def write(self, name, content=b"scontrino", mode="wb"):
+        path = os.path.join(self.test_dir, name)
+        with open(path, mode) as f:
+            f.write(content)
+        return path
+
+    def settle(self, polls=3):
+        for _ in range(polls):
+            time.sleep(0.06)
+            self.watcher.poll()
+
+    def test_waits_for_write_to_finish(self):
+        path = self.write("a.jpg", b"prima parte")
+        self.watcher.on_created(FileCreatedEvent(path))
+        time.sleep(0.06)
+        self.watcher.poll()  # Prima lettura della dimensione: non ancora confermata
+        self.write("a.jpg", b" seconda parte", mode="ab")
+        self.watcher.poll()
+        self.assertEqual(self.submitted, [])
+
+        self.settle()
+        self.assertEqual(self.submitted, ["a.jpg"])
+
+    def test_burst_of_events_submits_once(self):
+        path = self.write("a.jpg")
+        self.watcher.on_created(FileCreatedEvent(path))
+        for _ in range(5):
+            self.watcher.on_modified(FileModifiedEvent(path))
+        self.settle()
+        self.assertEqual(self.submitted, ["a.jpg"])
+
+    def test_ignored_files(self):
+        own_output = os.path.join(self.test_dir, "Scontrino_1.jpg")
+        self.watcher.ignore(own_output)
+        paths = [self.write(name, name.encode()) for name in
+                 ("b_optimized.jpg", "note.txt", ".file_history", "Scontrino_1.jpg.tmp")]
+        for path in paths:
+            self.watcher.on_created(FileCreatedEvent(path))
+        self.write("Scontrino_1.jpg")
+        self.watcher.on_moved(FileMovedEvent(paths[-1], own_output))
+        self.settle()
+        self.assertEqual(self.submitted, [])
+
+    def test_ignored_files_released(self):
+        """Le copie scritte dall'applicazione non restano nell'elenco degli ignorati per sempre."""
+        own_output = self.write("Scontrino_2.jpg")
+        self.watcher.ignore(own_output)
+        self.watcher.release(own_output, grace=0.05)
+        self.watcher.on_created(FileCreatedEvent(own_output))
+        self.settle()
+        self.assertEqual(self.submitted, [])
+        self.assertEqual(self.watcher._ignored, {})
+
+        self.watcher.on_modified(FileModifiedEvent(own_output))
+        self.settle()
+        self.assertEqual(self.submitted, ["Scontrino_2.jpg"])
+
+    def test_rename_counts_destination(self):
+        temp = self.write("c.jpg.tmp")
+        final = os.path.join(self.test_dir, "c.jpg")
+        os.replace(temp, final)
+        self.watcher.on_moved(FileMovedEvent(temp, final))
+        self.settle()
+        self.assertEqual(self.submitted, ["c.jpg"])
+
+    def test_catch_up_skips_duplicates(self):
+        self.write("vecchio.png", b"uno")
+        self.write("copia.png", b"uno")
+        self.write("nuovo.jpg", b"due")
+        self.write("vecchio_optimized.png", b"tre")
+        self.assertEqual(self.watcher.catch_up(), 2)
+        self.assertEqual(len(self.submitted), 2)
+        self.assertIn("nuovo.jpg", self.submitted)
+
+    def test_full_queue_retries(self):
+        """Coda piena: il file è riproposto, senza essere scambiato per un duplicato."""
+        self.accept = False
+        path = self.write("a.jpg")
+        self.watcher.on_created(FileCreatedEvent(path))
+        self.settle()
+        self.assertEqual(self.submitted, [])
+
+        self.accept = True
+        self.settle()
+        self.assertEqual(self.submitted, ["a.jpg"])
+
+    def test_near_duplicates_skipped(self):
+        """Lo stesso scontrino fotografato di nuovo nella cartella non è accodato, senza dialoghi."""
+        import cv2
+
+        agent = FileAgent(self.test_dir)
+        self.addCleanup(agent.close)
+        watcher = ReceiptWatcher(self.test_dir, self.submit, agent.is_duplicate, settle=0.05,
+                                 near_duplicate=lambda path: agent.near_duplicate(file_signature(path), path))
+        lines = ["BAR CENTRALE", "CAFFE 1,20", "CORNETTO 1,50", "TOTALE 2,70"]
+        cv2.imwrite(os.path.join(self.test_dir, "primo.png"), make_receipt(lines))
+        self.assertEqual(watcher.catch_up(), 1)
+
+        path = os.path.join(self.test_dir, "di_nuovo.jpg")
+        cv2.imwrite(path, cv2.resize(make_receipt(lines, 1), (300, 675)))
+        watcher.on_created(FileCreatedEvent(path))
+        for _ in range(3):
+            time.sleep(0.06)
+            watcher.poll()
+        self.assertEqual(self.submitted, ["primo.png"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+# tests/test_services/test_report_generator.py
+import shutil
+import tempfile
+import unittest
+from unittest.mock import Mock
+import sys
+import os
+# Aggiungi il percorso root del progetto al PYTHONPATH
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(PROJECT_ROOT)
+
+from src.models.receipt_store import ReceiptStore
+from src.services.report_generator import ReportGenerator, ReportPDF, shape_text
+
+
+class TestReportGenerator(unittest.TestCase):
+    def setUp(self):
+        # I font sono cercati nella cartella fonts/ del progetto
+        self.cwd = os.getcwd()
+        os.chdir(PROJECT_ROOT)
+        self.test_dir = tempfile.mkdtemp()
+        self.store = ReceiptStore(os.path.join(self.test_dir, "receipts.sqlite3"))
+        self.store.add_many([{
+            "Data": "16/01/2024",
+            "Importo": i + 1,
+            "Valuta": "OMR",
+            "Importo (EUR)": (i + 1) * 2,
+            "Descrizione": f"Lulu Hypermarket {i} - Muscat",
+            "Categoria": "Shopping",
+            "Sottocategoria": "Supermercato",
+            "File": f"Scontrino_{i}.jpg"
+        } for i in range(30)])
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.store.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_generate_in_chunks(self):
+        pdf_path = os.path.join(self.test_dir, "Reports", "report.pdf")
+        progress = Mock()
+
+        written = ReportGenerator(self.store, chunk_size=10).generate(pdf_path, progress)
+
+        self.assertEqual(written, 30)
+        self.assertTrue(os.path.exists(pdf_path))
+        self.assertEqual([c.args for c in progress.call_args_list], [(10, 30), (20, 30), (30, 30)])
+
+    def test_stop_request(self):
+        pdf_path = os.path.join(self.test_dir, "report.pdf")
+        with self.assertRaises(InterruptedError):
+            ReportGenerator(self.store, chunk_size=10).generate(pdf_path, should_stop=lambda: True)
+        self.assertFalse(os.path.exists(pdf_path))
+
+    def test_text_caches(self):
+        """Testi ripetuti vengono elaborati una sola volta."""
+        shape_text.cache_clear()
+        for _ in range(5):
+            shape_text("Lulu Hypermarket")
+        self.assertEqual(shape_text.cache_info().hits, 4)
+
+        pdf = ReportPDF()
+        pdf.set_font("NotoSans", size=9)
+        first = pdf.wrap_text("Lulu Hypermarket Muscat Grand Mall", 30)
+        second = pdf.wrap_text("Lulu Hypermarket Muscat Grand Mall", 30)
+        self.assertIs(first, second)
+        self.assertGreater(len(first), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# tests/test_services/test_result_cache.py
+import shutil
+import tempfile
+import unittest
+import sys
+import os
+# Aggiungi il percorso root del progetto al PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from src.services.result_cache import ResultCache, prompt_version
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.test_dir, "cache.sqlite3")
+        self.cache = ResultCache(self.db_path, max_bytes=10_000)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_put_and_get(self):
+        key = ResultCache.stage_key("hash-immagine", "ocr", "v1")
+        self.cache.put(key, "hash-immagine", "ocr", "v1", {"importo": 12.5})
+
+        self.assertEqual(self.cache.get(key), {"importo": 12.5})
+        self.assertIsNone(self.cache.get("inesistente"))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_prompt_change_invalidates_only_later_stages(self):
+        """Cambiare il prompt dell'analisi non invalida l'OCR."""
+        ocr_key = ResultCache.stage_key("img", "ocr", prompt_version("gpt-4o", "prompt ocr"))
+        old_analysis = ResultCache.stage_key(ocr_key, "analysis", prompt_version("gpt-4o", "prompt v1"))
+        new_analysis = ResultCache.stage_key(ocr_key, "analysis", prompt_version("gpt-4o", "prompt v2"))
+        old_validation = ResultCache.stage_key(old_analysis, "validation", "v")
+        new_validation = ResultCache.stage_key(new_analysis, "validation", "v")
+
+        self.assertNotEqual(old_analysis, new_analysis)
+        self.assertNotEqual(old_validation, new_validation)
+        self.assertEqual(ocr_key, ResultCache.stage_key("img", "ocr", prompt_version("gpt-4o", "prompt ocr")))
+
+    def test_persistence(self):
+        self.cache.put("k", "img", "ocr", "v1", "testo")
+        self.cache.close()
+
+        self.cache = ResultCache(self.db_path, max_bytes=10_000)
+        self.assertEqual(self.cache.get("k"), "testo")
+        self.assertGreater(self.cache.total_bytes, 0)
+
+    def test_size_eviction(self):
+        """Superato il limite vengono rimosse le voci usate meno di recente."""
+        self.cache.max_bytes = 250
+        payload = "x" * 100
+        self.cache.put("a", "img-a", "ocr", "v1", payload)
+        self.cache.put("b", "img-b", "ocr", "v1", payload)
+        self.cache.get("a")  # "a" diventa la più recente
+        self.cache.put("c", "img-c", "ocr", "v1", payload)
+
+        self.assertIsNotNone(self.cache.get("a"))
+        self.assertIsNone(self.cache.get("b"))
+        self.assertIsNotNone(self.cache.get("c"))
+        self.assertLessEqual(self.cache.total_bytes, 250)
+
+    def test_list_and_purge(self):
+        self.cache.put("a1", "img-a", "ocr", "v1", "testo")
+        self.cache.put("a2", "img-a", "analysis", "v1", {"importo": 1})
+        self.cache.put("b1", "img-b", "ocr", "v1", "testo")
+
+        self.assertEqual(len(self.cache.list_entries()), 3)
+        self.assertEqual({e["stage"] for e in self.cache.list_entries("img-a")}, {"ocr", "analysis"})
+
+        self.assertEqual(self.cache.purge(stage="analysis"), 1)
+        self.assertEqual(self.cache.purge(image_hash="img-b"), 1)
+        self.assertEqual([e["key"] for e in self.cache.list_entries()], ["a1"])
+
+        self.assertEqual(self.cache.purge(), 1)
+        self.assertEqual(self.cache.total_bytes, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
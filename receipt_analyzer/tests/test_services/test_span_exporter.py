@@ -0,0 +1,111 @@
+# tests/test_services/test_span_exporter.py
+import asyncio
+import json
+import shutil
+import tempfile
+import unittest
+import sys
+import os
+# Aggiungi il percorso root del progetto al PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from src.services.span_exporter import SpanExporter
+from src.services.stage_metrics import StageMetrics, nested_stage, record_request
+
+
+class TestStageSpans(unittest.TestCase):
+    def test_requests_attributed_to_current_stage(self):
+        """Le richieste HTTP sono attribuite alla fase in corso, anche in task concorrenti."""
+        metrics = StageMetrics()
+
+        async def stage(name, requests):
+            with metrics.measure(name):
+                for _ in range(requests):
+                    await asyncio.sleep(0)
+                    record_request(100)
+
+        async def run():
+            await asyncio.gather(stage("validation", 2), stage("fx", 3))
+
+        asyncio.run(run())
+        record_request(100)  # Fuori da una fase: ignorata
+
+        self.assertEqual(metrics.stages["validation"]["richieste"], 2)
+        self.assertEqual(metrics.stages["fx"]["bytes"], 300)
+        self.assertEqual({span["fase"] for span in metrics.spans}, {"validation", "fx"})
+
+    def test_nested_stage(self):
+        """La sotto-fase ha il suo span; i valori confluiscono nella fase madre, non nei totali due volte."""
+        metrics = StageMetrics()
+        with metrics.measure("categorization"):
+            with nested_stage("geocode"):
+                record_request(50, retry=True)
+            metrics.add_usage("categorization", 100, 20)
+
+        geocode = next(span for span in metrics.spans if span["fase"] == "geocode")
+        self.assertEqual(geocode["padre"], "categorization")
+        self.assertEqual(geocode["tentativi"], 1)
+        self.assertEqual(metrics.stages["categorization"]["bytes"], 50)
+        self.assertEqual(metrics.total()["richieste"], 1)
+        self.assertEqual(metrics.total()["prompt_tokens"], 100)
+
+    def test_failed_stage(self):
+        metrics = StageMetrics()
+        with self.assertRaises(ValueError):
+            with metrics.measure("analysis"):
+                raise ValueError("risposta non valida")
+        self.assertEqual(metrics.spans[0]["esito"], "errore")
+
+
+class TestSpanExporter(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.spans_path = os.path.join(self.test_dir, "spans.jsonl")
+        self.prometheus_path = os.path.join(self.test_dir, "metrics.prom")
+        self.exporter = SpanExporter(self.spans_path, self.prometheus_path)
+
+    def tearDown(self):
+        self.exporter.close()
+        shutil.rmtree(self.test_dir)
+
+    def export_receipt(self, name, seconds):
+        metrics = StageMetrics()
+        with metrics.measure("ocr"):
+            metrics.add_usage("ocr", 800, 60)
+            record_request(2048)
+        metrics.spans[0]["secondi"] = seconds
+        self.exporter.export(metrics.spans, name, "multi_stage")
+
+    def test_jsonl_and_stats(self):
+        for i in range(10):
+            self.export_receipt(f"{i}.jpg", (i + 1) / 10)
+
+        with open(self.spans_path) as f:
+            spans = [json.loads(line) for line in f]
+        self.assertEqual(len(spans), 10)
+        self.assertEqual(spans[0]["scontrino"], "0.jpg")
+        self.assertEqual(spans[0]["prompt_tokens"], 800)
+
+        stats = self.exporter.stats()["ocr"]
+        self.assertEqual(stats["span"], 10)
+        self.assertEqual(stats["bytes"], 20480)
+        self.assertEqual(stats["p95"], 1.0)
+
+    def test_prometheus_text(self):
+        self.export_receipt("a.jpg", 0.5)
+        with open(self.prometheus_path) as f:
+            text = f.read()
+        self.assertIn('receipt_stage_duration_seconds_count{stage="ocr"} 1', text)
+        self.assertIn('receipt_stage_tokens_total{stage="ocr",kind="prompt"} 800', text)
+        self.assertIn('receipt_stage_sent_bytes_total{stage="ocr"} 2048', text)
+
+    def test_rotation(self):
+        exporter = SpanExporter(self.spans_path, None, max_bytes=200)
+        for i in range(3):
+            exporter.export([{"fase": "ocr", "esito": "ok", "secondi": 0.1}], f"{i}.jpg")
+        exporter.close()
+        self.assertTrue(os.path.exists(self.spans_path + ".1"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+# tests/test_services/test_stage_graph.py
+import asyncio
+import time
+import unittest
+import sys
+import os
+# Aggiungi il percorso root del progetto al PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from src.services.stage_graph import Stage, StageGraph
+from src.services.stage_metrics import StageMetrics
+
+
+def sleeper(value, delay=0.1):
+    async def run(results):
+        await asyncio.sleep(delay)
+        return value
+    return run
+
+
+class TestStageGraph(unittest.TestCase):
+    def make_graph(self):
+        return StageGraph([
+            Stage("ocr", sleeper("testo", 0.02), ("image",)),
+            Stage("analysis", sleeper({"importo": 1}, 0.02), ("ocr",)),
+            Stage("validation", sleeper("ok"), ("analysis",)),
+            Stage("fx", sleeper("eur", 0.05), ("analysis",)),
+            Stage("categorization", sleeper("bar", 0.15), ("analysis",)),
+        ])
+
+    def test_independent_stages_run_concurrently(self):
+        graph = self.make_graph()
+        started = time.perf_counter()
+        results = asyncio.run(graph.run({"image": "b64"}))
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(results["categorization"], "bar")
+        # In sequenza sarebbero 0.34s; in parallelo conta solo il percorso più lungo
+        self.assertLess(elapsed, 0.3)
+
+    def test_dependencies_respected(self):
+        order = []
+
+        def record(name):
+            async def run(results):
+                order.append(name)
+                return name
+            return run
+
+        graph = StageGraph([
+            Stage("c", record("c"), ("b",)),
+            Stage("b", record("b"), ("a",)),
+            Stage("a", record("a")),
+        ])
+        asyncio.run(graph.run({}))
+        self.assertEqual(order, ["a", "b", "c"])
+
+    def test_inputs_skip_stages(self):
+        """Le fasi già presenti negli input non vengono eseguite."""
+        async def fail(results):
+            raise AssertionError("non doveva essere eseguita")
+
+        graph = StageGraph([
+            Stage("ocr", fail, ("image",)),
+            Stage("analysis", sleeper("dati", 0), ("ocr",)),
+        ])
+        results = asyncio.run(graph.run({"ocr": "testo"}))
+        self.assertEqual(results["analysis"], "dati")
+
+    def test_cycle_rejected(self):
+        with self.assertRaises(ValueError):
+            StageGraph([Stage("a", sleeper(1), ("b",)), Stage("b", sleeper(2), ("a",))])
+
+    def test_failure_cancels_running_stages(self):
+        async def fail(results):
+            raise RuntimeError("errore API")
+
+        cancelled = []
+
+        async def slow(results):
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        graph = StageGraph([
+            Stage("root", sleeper(1, 0)),
+            Stage("slow", slow, ("root",)),
+            Stage("fail", fail, ("root",)),
+        ])
+        with self.assertRaises(RuntimeError):
+            asyncio.run(graph.run({}))
+        self.assertEqual(cancelled, [True])
+
+    def test_critical_path_and_metrics(self):
+        graph = self.make_graph()
+        metrics = StageMetrics()
+        messages = []
+        asyncio.run(graph.run({"image": "b64"}, metrics, messages.append))
+
+        self.assertEqual(graph.critical_path(), ["ocr", "analysis", "categorization"])
+        self.assertEqual(set(metrics.stages), {"ocr", "analysis", "validation", "fx", "categorization"})
+        self.assertIn("Percorso critico: ocr -> analysis -> categorization", messages[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
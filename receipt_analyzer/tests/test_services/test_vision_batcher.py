@@ -0,0 +1,91 @@
+# tests/test_services/test_vision_batcher.py
+import asyncio
+import json
+import time
+import unittest
+from unittest.mock import Mock
+import sys
+import os
+# Aggiungi il percorso root del progetto al PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from src.services.stage_metrics import StageMetrics
+from src.services.vision_batcher import VisionBatcher
+
+
+def make_client(batch_reply=None):
+    """
+    Client finto: le immagini contengono il nome dell'esercente. I lotti
+    rispondono in ordine inverso con l'indice; `batch_reply` forza una risposta.
+    """
+    client = Mock()
+
+    def create(**kwargs):
+        images = [part["image_url"]["url"].split(",", 1)[1]
+                  for part in kwargs["messages"][0]["content"] if part["type"] == "image_url"]
+        if len(images) == 1:
+            content = json.dumps({"esercente": images[0]})
+        elif batch_reply is not None:
+            content = batch_reply
+        else:
+            items = [{"indice": i + 1, "esercente": image} for i, image in enumerate(images)]
+            content = json.dumps({"scontrini": list(reversed(items))})
+        return Mock(choices=[Mock(message=Mock(content=content))],
+                    usage=Mock(prompt_tokens=100 * len(images), completion_tokens=20 * len(images)))
+
+    client.chat.completions.create = Mock(side_effect=create)
+    return client
+
+
+async def extract_all(batcher, images, metrics=None):
+    return await asyncio.gather(*(batcher.extract(image, metrics) for image in images))
+
+
+class TestVisionBatcher(unittest.TestCase):
+    def test_full_batch_single_call(self):
+        client = make_client()
+        batcher = VisionBatcher(client, batch_size=4, window=5)
+        metrics = StageMetrics()
+
+        texts = asyncio.run(extract_all(batcher, ["a", "b", "c", "d"], metrics))
+
+        self.assertEqual([json.loads(t)["esercente"] for t in texts], ["a", "b", "c", "d"])
+        self.assertEqual(client.chat.completions.create.call_count, 1)
+        self.assertAlmostEqual(metrics.stages["ocr"]["chiamate"], 1)
+        self.assertAlmostEqual(metrics.stages["ocr"]["prompt_tokens"], 400)
+
+    def test_window_flushes_partial_batch(self):
+        """Un lotto incompleto parte allo scadere della finestra."""
+        client = make_client()
+        batcher = VisionBatcher(client, batch_size=8, window=0.05)
+
+        started = time.perf_counter()
+        texts = asyncio.run(extract_all(batcher, ["a", "b", "c"]))
+
+        self.assertLess(time.perf_counter() - started, 1)
+        self.assertEqual(len(texts), 3)
+        self.assertEqual(client.chat.completions.create.call_count, 1)
+
+    def test_malformed_reply_falls_back(self):
+        client = make_client(batch_reply='{"scontrini": [{"esercente": "solo uno"}]}')
+        batcher = VisionBatcher(client, batch_size=3, window=5)
+
+        texts = asyncio.run(extract_all(batcher, ["a", "b", "c"]))
+
+        self.assertEqual([json.loads(t)["esercente"] for t in texts], ["a", "b", "c"])
+        self.assertEqual(client.chat.completions.create.call_count, 4)
+        self.assertEqual(batcher.stats["fallback"], 1)
+
+    def test_parse_batch(self):
+        content = '```json\n[{"indice": 2, "importo": 5}, {"indice": 1, "importo": 3}]\n```'
+        texts = VisionBatcher.parse_batch(content, 2)
+        self.assertEqual([json.loads(t) for t in texts], [{"importo": 3}, {"importo": 5}])
+
+        with self.assertRaises(ValueError):
+            VisionBatcher.parse_batch('[{"indice": 1}, {"indice": 1}]', 2)
+        with self.assertRaises(ValueError):
+            VisionBatcher.parse_batch('{"errore": "troppe immagini"}', 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+# tests/test_ui/test_receipt_table_model.py
+import shutil
+import tempfile
+import unittest
+from unittest.mock import Mock
+import sys
+import os
+# Aggiungi il percorso root del progetto al PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from src.models.receipt_store import ReceiptStore
+from src.ui.components.receipt_table_model import ReceiptTableModel
+
+
+def make_row(i):
+    return {
+        "Data": "2024-01-16",
+        "Importo": float(i),
+        "Valuta": "EUR",
+        "Importo (EUR)": float(i),
+        "Descrizione": f"Negozio {i}",
+        "Categoria": "Shopping",
+        "Sottocategoria": "",
+        "File": f"Scontrino_{i}.jpg"
+    }
+
+
+class TestReceiptTableModel(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.store = ReceiptStore(os.path.join(self.test_dir, "receipts.sqlite3"))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_lazy_loading(self):
+        """Le righe vengono lette dall'archivio a blocchi."""
+        self.store.add_many([make_row(i) for i in range(25)])
+        model = ReceiptTableModel(self.store, fetch_batch=10)
+
+        self.assertEqual(model.rowCount(), 0)
+        self.assertTrue(model.canFetchMore())
+        model.fetchMore()
+        self.assertEqual(model.rowCount(), 10)
+        model.fetchMore()
+        model.fetchMore()
+        self.assertEqual(model.rowCount(), 25)
+        self.assertFalse(model.canFetchMore())
+        self.assertEqual(model.data(model.index(24, 4)), "Negozio 24")
+        self.assertEqual(model.data(model.index(3, 1)), "3.000")
+
+    def test_coalesced_inserts(self):
+        """Più righe arrivate insieme producono un solo inserimento nella vista."""
+        model = ReceiptTableModel(self.store)
+        inserted = Mock()
+        model.rowsInserted.connect(inserted)
+
+        for i in range(5):
+            self.store.add(make_row(i))
+            model.append_row(make_row(i))
+        self.assertEqual(model.rowCount(), 0)
+
+        model.flush()
+        self.assertEqual(model.rowCount(), 5)
+        inserted.assert_called_once()
+        self.assertEqual(model.data(model.index(4, 7)), "Scontrino_4.jpg")
+
+    def test_new_rows_not_loaded_until_scrolled(self):
+        """Se la vista non ha ancora caricato tutto, le nuove righe restano da leggere."""
+        self.store.add_many([make_row(i) for i in range(20)])
+        model = ReceiptTableModel(self.store, fetch_batch=10)
+        model.fetchMore()
+
+        self.store.add(make_row(20))
+        model.append_row(make_row(20))
+        model.flush()
+
+        self.assertEqual(model.rowCount(), 10)
+        while model.canFetchMore():
+            model.fetchMore()
+        self.assertEqual(model.rowCount(), 21)
+
+
+if __name__ == '__main__':
+    unittest.main()
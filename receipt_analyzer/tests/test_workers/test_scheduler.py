@@ -0,0 +1,136 @@
+# tests/test_workers/test_scheduler.py
+import unittest
+from unittest.mock import Mock
+import sys
+import os
+# Aggiungi il percorso root del progetto al PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from src.workers.scheduler import IngestionScheduler, PRIORITY_HIGH, PRIORITY_LOW
+
+
+class FakeWorker(QObject):
+    """Worker finto che non avvia thread: i test emettono i segnali a mano."""
+    finished = pyqtSignal(dict)
+    error = pyqtSignal(str)
+    skipped = pyqtSignal(str)
+    progress = pyqtSignal(str)
+    log_message = pyqtSignal(str)
+
+    def __init__(self, file_path):
+        super().__init__()
+        self.file_path = file_path
+        self.started = False
+
+    def start(self):
+        self.started = True
+
+    def isRunning(self):
+        return False
+
+    def wait(self, timeout=None):
+        return True
+
+
+class TestIngestionScheduler(unittest.TestCase):
+    def setUp(self):
+        self.workers = []
+
+        def factory(file_path):
+            worker = FakeWorker(file_path)
+            self.workers.append(worker)
+            return worker
+
+        self.scheduler = IngestionScheduler(factory, max_concurrent=2, max_queue_size=3)
+
+    def test_concurrency_limit(self):
+        """Non vengono avviati più worker del limite configurato."""
+        for i in range(5):
+            self.scheduler.submit(f"file{i}.jpg")
+
+        self.assertEqual(len(self.workers), 2)
+        self.assertEqual(self.scheduler.running_count(), 2)
+        self.assertEqual(self.scheduler.queue_depth(), 3)
+
+    def test_completion_starts_next_job(self):
+        """Il completamento di un worker libera uno slot per il successivo."""
+        results = Mock()
+        self.scheduler.finished.connect(results)
+        for i in range(3):
+            self.scheduler.submit(f"file{i}.jpg")
+
+        self.workers[0].finished.emit({"importo": 10})
+
+        results.assert_called_once_with({"importo": 10}, "file0.jpg")
+        self.assertEqual(len(self.workers), 3)
+        self.assertEqual(self.scheduler.completed, 1)
+
+    def test_priority_order(self):
+        """I file ad alta priorità vengono elaborati prima degli altri."""
+        self.scheduler.max_concurrent = 1
+        self.scheduler.submit("primo.jpg")
+        self.scheduler.submit("bassa.jpg", PRIORITY_LOW)
+        self.scheduler.submit("alta.jpg", PRIORITY_HIGH)
+
+        self.workers[0].finished.emit({})
+        self.assertEqual(self.workers[1].file_path, "alta.jpg")
+
+    def test_backpressure(self):
+        """Quando la coda è piena submit restituisce False."""
+        self.scheduler.max_concurrent = 1
+        accepted = [self.scheduler.submit(f"file{i}.jpg") for i in range(6)]
+        # 1 in esecuzione + 3 in coda
+        self.assertEqual(accepted, [True, True, True, True, False, False])
+        self.assertEqual(self.scheduler.free_slots(), 0)
+
+    def test_error_forwarding(self):
+        """Gli errori dei worker vengono inoltrati e contati."""
+        errors = Mock()
+        self.scheduler.error.connect(errors)
+        self.scheduler.submit("file.jpg")
+
+        self.workers[0].error.emit("Errore elaborazione: test")
+
+        errors.assert_called_once_with("Errore elaborazione: test")
+        stats = self.scheduler.stats()
+        self.assertEqual(stats["falliti"], 1)
+        self.assertEqual(stats["in_esecuzione"], 0)
+
+    def test_skipped_is_not_an_error(self):
+        """Un duplicato saltato libera lo slot senza passare dal segnale di errore."""
+        errors, skipped = Mock(), Mock()
+        self.scheduler.error.connect(errors)
+        self.scheduler.skipped.connect(skipped)
+        self.scheduler.submit("file.jpg")
+
+        self.workers[0].skipped.emit("Possibile duplicato di a.jpg")
+
+        errors.assert_not_called()
+        skipped.assert_called_once_with("Possibile duplicato di a.jpg", "file.jpg")
+        stats = self.scheduler.stats()
+        self.assertEqual((stats["falliti"], stats["saltati"], stats["in_esecuzione"]), (0, 1, 0))
+
+    def test_same_file_held_once(self):
+        """Un file già in coda o in elaborazione non avvia un secondo worker; concluso, può tornare."""
+        self.scheduler.max_concurrent = 1
+        self.assertTrue(self.scheduler.submit("a.jpg"))
+        self.assertTrue(self.scheduler.submit("b.jpg"))
+        self.assertTrue(self.scheduler.submit("a.jpg"))
+        self.assertTrue(self.scheduler.submit(os.path.abspath("b.jpg")))
+        self.assertEqual(self.scheduler.queue_depth(), 1)
+
+        self.workers[0].finished.emit({})
+        self.workers[1].error.emit("errore")
+        self.assertEqual([w.file_path for w in self.workers], ["a.jpg", "b.jpg"])
+        self.assertTrue(self.scheduler.submit("a.jpg"))
+        self.assertEqual(len(self.workers), 3)
+
+    def test_shutdown_rejects_new_jobs(self):
+        self.scheduler.shutdown()
+        self.assertFalse(self.scheduler.submit("file.jpg"))
+
+
+if __name__ == '__main__':
+    unittest.main()